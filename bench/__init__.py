@@ -0,0 +1 @@
+"""Benchmark and load-test harness for RetroRadio (see bench/run.py)."""
@@ -0,0 +1,221 @@
+"""Run one of the hardware daemons in-process against fake hardware.
+
+    GPIOZERO_PIN_FACTORY=mock MPD_PORT=... python3 -m bench.drivers station
+    GPIOZERO_PIN_FACTORY=mock MPD_PORT=... python3 -m bench.drivers amp
+
+The script is executed unmodified (its module-level main loop runs on a
+thread), then its GPIO pins are driven through gpiozero's mock factory and
+the fake SSD1306 / MPD see the effects. Prints one JSON object of results.
+"""
+import argparse, json, os, resource, statistics, sys, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import fakes  # noqa: E402
+
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+fakes.install_luma()
+
+from gpiozero import Device  # noqa: E402
+from gpiozero.pins.mock import MockFactory  # noqa: E402
+from radiolib.mpd import MPDClient, to_dict  # noqa: E402
+
+if Device.pin_factory is None:  # created lazily; the amp driver needs it first
+    Device.pin_factory = MockFactory()
+
+
+def pct(xs, p):
+    if not xs:
+        return None
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))]
+
+
+def summary_ms(xs):
+    return {"n": len(xs), "p50_ms": _ms(pct(xs, 50)), "p99_ms": _ms(pct(xs, 99)),
+            "mean_ms": _ms(statistics.mean(xs) if xs else None)}
+
+
+def _ms(v):
+    return None if v is None else round(v * 1000, 3)
+
+
+def cpu_seconds():
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+
+def idle_cpu(seconds):
+    """CPU% of this process while nothing is happening."""
+    c0, t0 = cpu_seconds(), time.monotonic()
+    time.sleep(seconds)
+    return round(100.0 * (cpu_seconds() - c0) / (time.monotonic() - t0), 2)
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_script(name, run_name="__bench__"):
+    """Exec scripts/<name> on a daemon thread; returns its globals once loaded."""
+    path = os.path.join(ROOT, "scripts", name)
+    g = {"__name__": run_name, "__file__": path}
+    code = compile(open(path).read(), path, "exec")
+    t = threading.Thread(target=exec, args=(code, g), name=name, daemon=True)
+    t.start()
+    return g
+
+
+def wait_for(pred, timeout=10.0, step=0.005):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if pred():
+            return True
+        time.sleep(step)
+    return False
+
+
+def mpd_command(*cmd):
+    c = MPDClient()
+    try:
+        return c.execute(*cmd)
+    finally:
+        c.close()
+
+
+def mpd_status():
+    return to_dict(mpd_command("status"))
+
+
+# ------------------ station_radio ------------------
+def bench_station(args):
+    g = run_script("station_radio.py")
+    if not wait_for(lambda: "enc" in g and "radio" in g and fakes.FakeSSD1306.instances):
+        raise SystemExit("station_radio did not start")
+    dev = fakes.FakeSSD1306.instances[-1]
+    pins = Device.pin_factory
+    a, b, btn = pins.pin(g["ENC_A"]), pins.pin(g["ENC_B"]), pins.pin(g["ENC_BTN"])
+    time.sleep(0.5)  # let the initial switch and first frame settle
+
+    def detent():
+        for x, y in ((0, 1), (0, 0), (1, 0), (1, 1)):
+            (a.drive_high if x else a.drive_low)()
+            (b.drive_high if y else b.drive_low)()
+
+    def click():
+        btn.drive_low()
+        time.sleep(0.06)
+        btn.drive_high()
+
+    # encoder detent -> first I²C write of the new frame
+    lat, sizes = [], []
+    for _ in range(args.steps):
+        t0 = time.monotonic()
+        detent()
+        if wait_for(lambda: dev.writes_since(t0), timeout=1.0, step=0.0005):
+            w = dev.writes_since(t0)
+            lat.append(w[0][0] - t0)
+            sizes.append(sum(n for _, n in w))
+        time.sleep(args.gap)
+
+    # fast spin: frames actually pushed per second while the knob turns
+    t0 = time.monotonic()
+    for _ in range(args.spin):
+        detent()
+        time.sleep(0.002)
+    spin_sec = time.monotonic() - t0
+    spin_frames = len(dev.writes_since(t0))
+    spin_threads = threading.active_count()
+
+    # tuning blink with no input
+    time.sleep(0.2)
+    t0 = time.monotonic()
+    time.sleep(2.0)
+    blink_writes = len(dev.writes_since(t0))
+
+    # click -> MPD reports "play"
+    mpd_command("stop")
+    t0 = time.monotonic()
+    click()
+    ok = wait_for(lambda: mpd_status().get("state") == "play", timeout=5.0, step=0.002)
+    click_to_play = time.monotonic() - t0 if ok else None
+
+    time.sleep(0.5)
+    return {
+        "encoder_to_oled": summary_ms(lat),
+        "i2c_bytes_per_step": {"p50": pct(sizes, 50), "max": max(sizes) if sizes else None},
+        "spin": {"detents": args.spin, "seconds": round(spin_sec, 3),
+                 "i2c_writes": spin_frames,
+                 "i2c_writes_per_sec": round(spin_frames / spin_sec, 1) if spin_sec else None,
+                 "threads": spin_threads},
+        "blink_i2c_writes_per_sec": round(blink_writes / 2.0, 1),
+        "click_to_play_ms": _ms(click_to_play),
+        "i2c_bytes_total": dev.bytes_sent,
+        "idle_cpu_pct": idle_cpu(args.idle),
+        "max_rss_kb": max_rss_kb(),
+    }
+
+
+# ------------------ amp_monitor ------------------
+def bench_amp(args):
+    g = run_script("amp_monitor.py")
+    wait_for(lambda: "main" in g)
+    pin = Device.pin_factory.pin(g["SENSE_PIN"])
+    pin.drive_high()
+    threading.Thread(target=g["main"], daemon=True).start()
+    time.sleep(0.5)
+    fader = g["FADER"]
+    g["set_volume"](75)
+    g["mpd"]("play")
+
+    cb, pause, resume = [], [], []
+    for _ in range(args.toggles):
+        t0 = time.monotonic()
+        pin.drive_low()
+        cb.append(time.monotonic() - t0)  # callbacks run inline on the mock pin
+        if wait_for(lambda: mpd_status().get("state") == "pause", timeout=5.0, step=0.002):
+            pause.append(time.monotonic() - t0)
+        time.sleep(0.2)
+        t0 = time.monotonic()
+        pin.drive_high()
+        cb.append(time.monotonic() - t0)
+        if wait_for(lambda: fader.active_target() is None and mpd_status().get("volume") == "75",
+                    timeout=5.0, step=0.002):
+            resume.append(time.monotonic() - t0)
+        time.sleep(0.2)
+
+    # amp bounced off->on faster than the fade: must end up playing
+    pin.drive_low()
+    time.sleep(0.2)
+    pin.drive_high()
+    time.sleep(1.5)
+    st = mpd_status()
+    return {
+        "callback": summary_ms(cb),
+        "off_to_paused": summary_ms(pause),
+        "on_to_full_volume": summary_ms(resume),
+        "quick_toggle_state": st.get("state"),
+        "quick_toggle_volume": st.get("volume"),
+        "idle_cpu_pct": idle_cpu(args.idle),
+        "max_rss_kb": max_rss_kb(),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python3 -m bench.drivers")
+    ap.add_argument("daemon", choices=("station", "amp"))
+    ap.add_argument("--steps", type=int, default=50, help="encoder detents to time")
+    ap.add_argument("--gap", type=float, default=0.05, help="pause between timed detents")
+    ap.add_argument("--spin", type=int, default=100, help="detents in the fast-spin test")
+    ap.add_argument("--toggles", type=int, default=5, help="amp off/on cycles")
+    ap.add_argument("--idle", type=float, default=3.0, help="seconds of idle CPU sampling")
+    args = ap.parse_args(argv)
+    res = bench_station(args) if args.daemon == "station" else bench_amp(args)
+    print(json.dumps(res))
+    sys.stdout.flush()
+    os._exit(0)  # the daemon threads never return
+
+
+if __name__ == "__main__":
+    main()
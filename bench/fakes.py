@@ -0,0 +1,78 @@
+"""Fake hardware for running the daemons off-device.
+
+gpiozero already ships a mock pin factory (GPIOZERO_PIN_FACTORY=mock);
+this module adds a stand-in for luma.oled's SSD1306 that records every
+I²C command/data write with a timestamp instead of talking to a panel.
+"""
+import sys, threading, time, types
+
+
+class FakeSSD1306:
+    """Records what would go over I²C. Mirrors the luma device API we use."""
+
+    instances = []
+
+    def __init__(self, serial_interface=None, width=128, height=64, **kw):
+        self.width, self.height = width, height
+        self.ram = bytearray(width * height // 8)
+        self.lock = threading.Lock()
+        self.writes = []          # (monotonic time, bytes) per data() call
+        self.bytes_sent = 0
+        self.visible = True
+        self._addr = (0, width - 1, 0, height // 8 - 1)
+        FakeSSD1306.instances.append(self)
+
+    def command(self, *cmd):
+        with self.lock:
+            self.bytes_sent += 1 + len(cmd)
+            if len(cmd) == 6 and cmd[0] == 0x21 and cmd[3] == 0x22:
+                self._addr = (cmd[1], cmd[2], cmd[4], cmd[5])
+
+    def data(self, data):
+        data = bytes(data)
+        with self.lock:
+            c0, c1, p0, p1 = self._addr
+            span = c1 - c0 + 1
+            for i in range(0, len(data), span):
+                p = p0 + i // span
+                if p > p1:
+                    break
+                self.ram[p * self.width + c0:p * self.width + c0 + span] = data[i:i + span]
+            self.bytes_sent += 1 + len(data)
+            self.writes.append((time.monotonic(), len(data)))
+
+    def display(self, img):
+        from radiolib.oled import pack
+        self.command(0x21, 0, self.width - 1, 0x22, 0, self.height // 8 - 1)
+        self.data(pack(img))
+
+    def show(self):
+        self.visible = True
+        self.command(0xAF)
+
+    def hide(self):
+        self.visible = False
+        self.command(0xAE)
+
+    def clear(self):
+        self.command(0x21, 0, self.width - 1, 0x22, 0, self.height // 8 - 1)
+        self.data(bytes(len(self.ram)))
+
+    def writes_since(self, t):
+        with self.lock:
+            return [w for w in self.writes if w[0] >= t]
+
+
+def install_luma():
+    """Register fake ``luma.core.interface.serial`` / ``luma.oled.device`` modules."""
+    def mod(name, **attrs):
+        m = types.ModuleType(name)
+        m.__dict__.update(attrs)
+        sys.modules[name] = m
+        return m
+    mod("luma")
+    mod("luma.core")
+    mod("luma.core.interface")
+    mod("luma.core.interface.serial", i2c=lambda port=1, address=0x3C, **kw: None)
+    mod("luma.oled")
+    mod("luma.oled.device", ssd1306=FakeSSD1306)
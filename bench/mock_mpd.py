@@ -0,0 +1,324 @@
+"""Stand-in MPD server speaking enough of the protocol for RetroRadio.
+
+Serves a real folder tree as the MPD database (no tag parsing), keeps a
+queue, stored playlists, outputs and volume, and supports command lists
+and idle/noidle. "Playback" is simulated: elapsed time starts counting
+``decode_delay`` seconds after ``play``, which is what the station-switch
+latency measurement keys on.
+
+    python3 -m bench.mock_mpd --music ~/music --port 6600
+"""
+import argparse, os, threading, time, random as _random
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+
+class MPDState:
+    def __init__(self, music_root, outputs=("EQ Warm", "EQ Flat")):
+        self.music_root = music_root
+        self.lock = threading.Condition()
+        self.queue = []
+        self.ids = []              # song id of each queue entry; never reused, like MPD's
+        self.next_id = 1
+        self.pos = None
+        self.state = "stop"
+        self.started = 0.0
+        self.offset = 0.0         # seek target; elapsed counts on from here
+        self.volume = 75
+        self.random = self.repeat = self.consume = 0
+        self.playlists = {}
+        self.outputs = [[i, n, 1 if i == 0 else 0] for i, n in enumerate(outputs)]
+        self.changes = []  # (seq, subsystem)
+        self.seq = 0
+        self.decode_delay = 0.05
+        self.duration = 180.0      # every track, for resume points
+        self.update_id = 0
+        self.connections = 0      # total accepted, to check clients keep them open
+        self.commands = 0
+
+    def changed(self, *subs):
+        for s in subs:
+            self.seq += 1
+            self.changes.append((self.seq, s))
+        del self.changes[:-100]
+        self.lock.notify_all()
+
+    def insert(self, files, pos=None):
+        pos = len(self.queue) if pos is None else int(pos)
+        ids = list(range(self.next_id, self.next_id + len(files)))
+        self.next_id += len(files)
+        self.queue[pos:pos] = files
+        self.ids[pos:pos] = ids
+        if self.pos is not None and pos <= self.pos and files:
+            self.pos += len(files)
+        self.changed("playlist")
+        return ids
+
+    def index(self, songid):
+        try:
+            return self.ids.index(int(songid))
+        except ValueError:
+            raise KeyError("song") from None
+
+    def remove(self, i):
+        del self.queue[i], self.ids[i]
+        if self.pos is not None and i < self.pos:
+            self.pos -= 1
+        self.changed("playlist")
+
+    def walk(self, folder):
+        base = os.path.join(self.music_root, folder)
+        if not os.path.isdir(base):
+            return None
+        out = []
+        for root, _, files in os.walk(base):
+            for f in sorted(files):
+                if f.lower().endswith((".mp3", ".flac")):
+                    out.append(os.path.relpath(os.path.join(root, f), self.music_root))
+        return sorted(out)
+
+
+class Handler(StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.st = self.server.state
+
+    def send(self, s):
+        self.wfile.write(s.encode())
+        self.wfile.flush()
+
+    def handle(self):
+        self.st.connections += 1
+        self.send("OK MPD 0.23.5\n")
+        batch = None
+        for raw in self.rfile:
+            line = raw.decode().rstrip("\n")
+            if line in ("command_list_ok_begin", "command_list_begin"):
+                batch, ok = [], line == "command_list_ok_begin"
+                continue
+            if line == "command_list_end":
+                out = ""
+                for i, cmd in enumerate(batch):
+                    r = self.run(cmd, i)
+                    if r.startswith("ACK"):
+                        out += r
+                        break
+                    out += r + ("list_OK\n" if ok else "")
+                else:
+                    out += "OK\n"
+                self.send(out)
+                batch = None
+                continue
+            if batch is not None:
+                batch.append(line)
+                continue
+            if line.startswith("idle"):
+                self.idle(_split(line)[1:])
+                continue
+            if line == "close":
+                return
+            r = self.run(line, 0)
+            self.send(r if r.startswith("ACK") else r + "OK\n")
+
+    def idle(self, subs):
+        st = self.st
+        with st.lock:
+            start = st.seq
+        self.connection.setblocking(False)
+        buf = b""
+        while True:
+            with st.lock:
+                hits = sorted({s for q, s in st.changes if q > start and (not subs or s in subs)})
+                if hits:
+                    break
+                st.lock.wait(0.05)
+            try:
+                buf += self.connection.recv(64)
+                if b"noidle" in buf:
+                    break
+                if not buf:
+                    return
+            except BlockingIOError:
+                pass
+        self.connection.setblocking(True)
+        self.send("".join(f"changed: {h}\n" for h in hits) + "OK\n")
+
+    def run(self, line, idx):
+        parts = _split(line)
+        name, args = parts[0], parts[1:]
+        st = self.st
+        fn = getattr(self, "c_" + name, None)
+        if fn is None:
+            return f"ACK [5@{idx}] {{{name}}} unknown command \"{name}\"\n"
+        with st.lock:
+            st.commands += 1
+            self.idx = idx
+            try:
+                return fn(*args)
+            except KeyError as e:
+                return f"ACK [50@{idx}] {{{name}}} No such {e.args[0]}\n"
+
+    # --- commands ---
+    def c_ping(self): return ""
+    def c_status(self):
+        st = self.st
+        r = (f"volume: {st.volume}\nrepeat: {st.repeat}\nrandom: {st.random}\nconsume: {st.consume}\n"
+             f"playlistlength: {len(st.queue)}\nstate: {st.state}\n")
+        if st.pos is not None and st.state != "stop":
+            el = max(0.0, time.time() - st.started - st.decode_delay) if st.state == "play" else 0.5
+            r += (f"song: {st.pos}\nsongid: {st.ids[st.pos]}\nelapsed: {st.offset + el:.3f}\nduration: {st.duration:.3f}\n"
+                  f"audio: 44100:24:2\n")
+        if st.update_id:
+            r += f"updating_db: {st.update_id}\n"
+        return r
+    def c_currentsong(self):
+        st = self.st
+        if st.pos is None:
+            return ""
+        f = st.queue[st.pos]
+        return f"file: {f}\nTitle: {os.path.basename(f)}\nArtist: Mock\nPos: {st.pos}\nId: {st.ids[st.pos]}\n"
+    def c_clear(self):
+        st = self.st
+        st.queue, st.ids, st.pos, st.state = [], [], None, "stop"
+        st.changed("playlist", "player")
+        return ""
+    def c_add(self, uri):
+        if uri.startswith(("http://", "https://")):   # streams are queued unchecked, like MPD
+            files = [uri]
+        else:
+            files = [uri] if os.path.isfile(os.path.join(self.st.music_root, uri)) else self.st.walk(uri)
+        if files is None:
+            raise KeyError("directory")
+        self.st.insert(files)
+        return ""
+    def c_load(self, name):
+        self.st.insert(list(self.st.playlists[name]))
+        return ""
+    def c_save(self, name):
+        if name in self.st.playlists:
+            return f"ACK [56@{self.idx}] {{save}} Playlist already exists\n"
+        self.st.playlists[name] = list(self.st.queue)
+        self.st.changed("stored_playlist")
+        return ""
+    def c_rm(self, name):
+        del self.st.playlists[name]
+        return ""
+    def c_listplaylists(self):
+        return "".join(f"playlist: {n}\nLast-Modified: 2020-01-01T00:00:00Z\n" for n in self.st.playlists)
+    def c_random(self, v): self.st.random = int(v); self.st.changed("options"); return ""
+    def c_repeat(self, v): self.st.repeat = int(v); self.st.changed("options"); return ""
+    def c_consume(self, v): self.st.consume = int(v); self.st.changed("options"); return ""
+    def c_setvol(self, v): self.st.volume = int(v); self.st.changed("mixer"); return ""
+    def c_play(self, pos=None):
+        st = self.st
+        if not st.queue:
+            return ""
+        st.pos = int(pos) if pos is not None else (
+            st.pos if st.pos is not None else (_random.randrange(len(st.queue)) if st.random else 0))
+        st.state, st.started, st.offset = "play", time.time(), 0.0
+        st.changed("player")
+        return ""
+    def c_pause(self, v="1"):
+        st = self.st
+        if st.state != "stop":
+            st.state = "pause" if v == "1" else "play"
+            st.changed("player")
+        return ""
+    def c_stop(self): self.st.state = "stop"; self.st.changed("player"); return ""
+    def c_next(self):
+        st = self.st
+        if st.queue and st.pos is not None:
+            if st.consume:
+                st.queue.pop(st.pos); st.ids.pop(st.pos); st.changed("playlist")
+                if not st.queue:
+                    st.pos, st.state = None, "stop"; st.changed("player"); return ""
+                st.pos %= len(st.queue)
+            else:
+                st.pos = (st.pos + 1) % len(st.queue)
+            st.started, st.offset = time.time(), 0.0; st.changed("player")
+        return ""
+    c_previous = c_next
+    def c_outputs(self):
+        return "".join(f"outputid: {i}\noutputname: {n}\nplugin: alsa\noutputenabled: {e}\n"
+                       for i, n, e in self.st.outputs)
+    def c_enableoutput(self, i): self.st.outputs[int(i)][2] = 1; self.st.changed("output"); return ""
+    def c_disableoutput(self, i): self.st.outputs[int(i)][2] = 0; self.st.changed("output"); return ""
+    def c_update(self, uri=None):
+        self.st.update_id += 1
+        st = self.st
+        def done():
+            time.sleep(0.05)
+            with st.lock:
+                st.update_id = 0
+                st.changed("database", "update")
+        threading.Thread(target=done, daemon=True).start()
+        return f"updating_db: {st.update_id}\n"
+    def c_replay_gain_mode(self, mode): self.st.replay_gain = mode; self.st.changed("options"); return ""
+    def c_replay_gain_status(self): return f"replay_gain_mode: {getattr(self.st, 'replay_gain', 'off')}\n"
+    def c_playlistinfo(self):
+        return "".join(f"file: {f}\nPos: {i}\nId: {n}\n" for i, (f, n) in enumerate(zip(self.st.queue, self.st.ids)))
+    def c_delete(self, pos):
+        self.st.remove(int(pos)); return ""
+    def c_deleteid(self, songid):
+        self.st.remove(self.st.index(songid)); return ""
+    def c_playlistid(self, songid=None):
+        i = self.st.index(songid)
+        return f"file: {self.st.queue[i]}\nPos: {i}\nId: {songid}\n"
+    def c_addid(self, uri, pos=None):
+        if self.st.walk(os.path.dirname(uri)) is None and not os.path.exists(os.path.join(self.st.music_root, uri)):
+            raise KeyError("file")
+        return f"Id: {self.st.insert([uri], pos)[0]}\n"
+    def c_seekcur(self, t):
+        self.st.started, self.st.offset = time.time(), float(t); return ""
+    def c_playlistfind(self, tag, value):
+        return "".join(f"file: {f}\nPos: {i}\nId: {n}\n" for i, (f, n) in enumerate(zip(self.st.queue, self.st.ids))
+                       if tag == "file" and f == value)
+
+
+def _split(line):
+    out, cur, q, esc = [], "", False, False
+    for ch in line:
+        if esc:
+            cur += ch; esc = False
+        elif ch == "\\" and q:
+            esc = True
+        elif ch == '"':
+            q = not q
+        elif ch == " " and not q:
+            if cur:
+                out.append(cur); cur = ""
+        else:
+            cur += ch
+    if cur:
+        out.append(cur)
+    return out
+
+
+class MockMPDServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, music_root, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.state = MPDState(music_root)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python3 -m bench.mock_mpd")
+    ap.add_argument("--music", required=True, help="folder served as music_directory")
+    ap.add_argument("--port", type=int, default=6600)
+    args = ap.parse_args(argv)
+    srv = MockMPDServer(args.music, args.port)
+    print(f"mock MPD on 127.0.0.1:{srv.port}", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""Reproducible latency/throughput benchmark for RetroRadio, off-device.
+
+Builds a synthetic library in a throw-away HOME, serves it from the mock
+MPD (bench/mock_mpd.py), puts a fake ``systemctl`` on PATH, then:
+
+* starts the web app and times /api/status, /api/play_station,
+  /api/services and /api/stations (p50/p99), plus concurrent throughput;
+* times a station switch through radiolib directly (RTT and time to audio);
+* plays a stand-in Icecast stream (bench/stream_server.py) that keeps
+  dropping out, once directly and once through the ring-buffer relay
+  (radiolib.stream), and compares how long each listener hears silence;
+* runs station_radio and amp_monitor against mock GPIO pins and a fake
+  SSD1306 (bench/drivers.py) for encoder->OLED latency, frame rates and
+  amp fade timings;
+* samples CPU and RSS of every process.
+
+Results are written as JSON so runs can be compared across commits:
+
+    python3 -m bench.run -o before.json
+    python3 -m bench.run -o after.json
+    python3 -m bench.run --compare before.json after.json
+"""
+import argparse, http.client, json, os, platform, shutil, socket, subprocess, sys
+import tempfile, threading, time, urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.drivers import summary_ms  # noqa: E402
+from bench.mock_mpd import MockMPDServer  # noqa: E402
+
+FAKE_SYSTEMCTL = """#!/bin/sh
+# bench: answer `systemctl show -p ... -- units` like systemd would
+seen=0
+for a in "$@"; do
+  if [ "$seen" = 1 ]; then
+    printf 'ActiveState=active\\nUnitFileState=enabled\\nActiveEnterTimestamp=Thu 2024-01-01 00:00:00 UTC\\n\\n'
+  fi
+  [ "$a" = "--" ] && seen=1
+done
+exit 0
+"""
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417-byte frames
+_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+
+
+# ------------------ fixture ------------------
+def make_library(music, stations, tracks, frames):
+    names = {}
+    for s in range(1, stations + 1):
+        sid = f"{s:02d}"
+        d = os.path.join(music, sid)
+        os.makedirs(d)
+        names[sid] = f"Bench {sid}"
+        for t in range(tracks):
+            title = f"Track {t:03d}".encode()
+            tit2 = b"TIT2" + (len(title) + 1).to_bytes(4, "big") + b"\x00\x00\x00" + title
+            id3 = b"ID3\x03\x00\x00" + len(tit2).to_bytes(4, "big") + tit2
+            with open(os.path.join(d, f"{t:03d} bench.mp3"), "wb") as f:
+                f.write(id3 + _FRAME * frames)
+    with open(os.path.join(music, "stations.json"), "w") as f:
+        json.dump(names, f)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ------------------ process sampling ------------------
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def proc_cpu(pid):
+    """Total user+system CPU seconds of ``pid`` (from /proc)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def proc_rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+
+class CpuWindow:
+    def __init__(self, pid):
+        self.pid = pid
+        self.c0, self.t0 = proc_cpu(pid), time.monotonic()
+
+    def pct(self):
+        return round(100.0 * (proc_cpu(self.pid) - self.c0) / (time.monotonic() - self.t0), 2)
+
+
+# ------------------ HTTP ------------------
+def request(port, method, path, timeout=30):
+    c = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        t0 = time.perf_counter()
+        c.request(method, path)
+        r = c.getresponse()
+        r.read()
+        return time.perf_counter() - t0, r.status
+    finally:
+        c.close()
+
+
+def time_endpoint(port, method, paths, n):
+    lat, errors = [], 0
+    for i in range(n):
+        dt, status = request(port, method, paths[i % len(paths)])
+        lat.append(dt)
+        errors += status >= 400
+    out = summary_ms(lat)
+    out["errors"] = errors
+    return out
+
+
+def throughput(port, path, workers, seconds):
+    lat, errors, stop = [], [0], time.monotonic() + seconds
+    lock = threading.Lock()
+
+    def worker():
+        mine = []
+        while time.monotonic() < stop:
+            try:
+                dt, status = request(port, "GET", path, timeout=10)
+                mine.append(dt)
+                if status >= 400:
+                    errors[0] += 1
+            except OSError:
+                errors[0] += 1
+        with lock:
+            lat.extend(mine)
+
+    t0 = time.monotonic()
+    ts = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    wall = time.monotonic() - t0
+    out = summary_ms(lat)
+    out.update(workers=workers, rps=round(len(lat) / wall, 1), errors=errors[0])
+    return out
+
+
+def status_during_uploads(port, station, uploads, n):
+    """Time /api/status while ``uploads`` clients trickle chunk bodies."""
+    stop = threading.Event()
+
+    def trickle():
+        body = json.dumps({"filename": "slow.mp3", "size": 1 << 20}).encode()
+        c = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        c.request("POST", f"/api/upload/{station}", body, {"Content-Type": "application/json"})
+        uid = json.loads(c.getresponse().read())["id"]
+        c.close()
+        c = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        c.putrequest("PUT", f"/api/upload/{station}/{uid}?offset=0")
+        c.putheader("Content-Length", str(1 << 20))
+        c.endheaders()
+        try:
+            while not stop.is_set():
+                c.send(bytes(4096))
+                time.sleep(0.05)
+        except OSError:
+            pass  # rejected (503) and closed by the server
+        c.close()
+
+    ts = [threading.Thread(target=trickle, daemon=True) for _ in range(uploads)]
+    for t in ts:
+        t.start()
+    time.sleep(0.5)
+    out = time_endpoint(port, "GET", ["/api/status"], n)
+    out["uploads"] = uploads
+    stop.set()
+    for t in ts:
+        t.join(5)
+    return out
+
+
+def wait_http(port, timeout=30):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            request(port, "GET", "/api/status", timeout=2)
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+# ------------------ benchmarks ------------------
+def bench_web(env, args, stations):
+    port = free_port()
+    env = dict(env, RADIO_WEB_HOST="127.0.0.1", RADIO_WEB_PORT=str(port))
+    p = subprocess.Popen([sys.executable, os.path.join("webapp", "app.py")], cwd=ROOT, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_http(port):
+            raise SystemExit("web app did not come up")
+        time.sleep(args.settle)
+        res = {"startup_rss_kb": proc_rss_kb(p.pid)}
+        idle = CpuWindow(p.pid)
+        time.sleep(args.idle)
+        res["idle_cpu_pct"] = idle.pct()
+
+        load = CpuWindow(p.pid)
+        sids = [f"{s:02d}" for s in range(1, stations + 1)]
+        res["status"] = time_endpoint(port, "GET", ["/api/status"], args.n)
+        res["services"] = time_endpoint(port, "GET", ["/api/services"], args.n)
+        res["stations"] = time_endpoint(port, "GET", ["/api/stations"], args.n)
+        res["play_station"] = time_endpoint(port, "POST", [f"/api/play_station/{s}" for s in sids],
+                                            max(1, args.n // 4))
+        res["station_page"] = time_endpoint(port, "GET", [f"/station/{sids[0]}"], max(1, args.n // 4))
+        res["busy_cpu_pct"] = load.pct()
+
+        res["status_during_uploads"] = status_during_uploads(port, sids[0], args.workers, args.n // 4)
+        res["concurrent_status"] = throughput(port, "/api/status", args.workers, args.duration)
+        res["concurrent_services"] = throughput(port, "/api/services", args.workers, args.duration)
+        res["max_rss_kb"] = proc_rss_kb(p.pid)
+        return res
+    finally:
+        p.terminate()
+        try:
+            p.wait(5)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def bench_switch(music, port, stations, n):
+    from radiolib.mpd import MPDPool
+    from radiolib.shuffle import Shuffler
+    from radiolib.switch import StationSwitcher
+    from radiolib.warmstart import PositionStore, WarmCache
+    pool = MPDPool("127.0.0.1", port, size=1)
+    sw = StationSwitcher(pool, music, positions=PositionStore(os.path.join(music, ".positions.json")),
+                         warm=WarmCache(), shuffler=Shuffler(music, path=os.path.join(music, ".shuffle.json")))
+    lat = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        sw.switch(1 + i % stations)
+        lat.append(time.perf_counter() - t0)
+        sw.prepare(1 + (i + 1) % stations)  # what the knob does while tuning
+        time.sleep(0.15)  # let the first-audio probe finish
+    out = summary_ms(lat)
+    out["switcher"] = sw.stats()
+    pool.close()
+    return out
+
+
+def _open_stream(url, timeout=5.0):
+    """A socket positioned at the body of ``GET url``, plus any body bytes already read."""
+    u = urllib.parse.urlsplit(url)
+    sock = socket.socket()
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024)  # the player's buffer is ``cap``
+        sock.settimeout(timeout)
+        sock.connect((u.hostname, u.port or 80))
+        sock.sendall(f"GET {u.path or '/'} HTTP/1.0\r\nHost: {u.hostname}\r\n\r\n".encode())
+        head = b""
+        while b"\r\n\r\n" not in head:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise OSError("closed before headers")
+            head += chunk
+        head, _, body = head.partition(b"\r\n\r\n")
+        if head.split(b" ", 2)[1] != b"200":
+            raise OSError(head.split(b"\r\n", 1)[0].decode(errors="replace"))
+        sock.settimeout(0.05)
+        return sock, body
+    except BaseException:
+        sock.close()
+        raise
+
+
+def stream_listener(url, byte_rate, seconds, cap=2.0, prebuffer=0.5, retry=0.5):
+    """Play ``url`` like MPD would: a ``cap``-second buffer drained in real time.
+
+    Reconnects by itself ``retry`` seconds after any failure, so a direct
+    listener is given the same second chance the relay has.
+    """
+    out = {"connects": 0, "dropouts": 0, "silence_s": 0.0, "start_s": None}
+    t0 = last = time.monotonic()
+    buffered, playing, sock, retry_at = 0.0, False, None, 0.0
+    while True:
+        now = time.monotonic()
+        if now - t0 >= seconds:
+            break
+        dt, last = now - last, now
+        if playing:
+            buffered -= dt
+            if buffered < 0:
+                out["silence_s"] -= buffered
+                out["dropouts"] += 1
+                buffered, playing = 0.0, False
+        elif out["start_s"] is not None:
+            out["silence_s"] += dt
+        data = b""
+        if sock is None:
+            if now < retry_at:
+                time.sleep(0.02)
+                continue
+            try:
+                sock, data = _open_stream(url)
+                out["connects"] += 1
+            except OSError:
+                retry_at = now + retry
+                continue
+        elif buffered >= cap:
+            time.sleep(0.02)
+            continue
+        else:
+            try:
+                data = sock.recv(16384)
+            except socket.timeout:
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                sock.close()
+                sock, retry_at = None, now + retry
+                continue
+        buffered += len(data) / byte_rate
+        if not playing and buffered >= prebuffer:
+            playing = True
+            if out["start_s"] is None:
+                out["start_s"] = round(now - t0, 3)
+    if sock is not None:
+        sock.close()
+    out["silence_s"] = round(out["silence_s"], 3)
+    return out
+
+
+def bench_stream(music, args):
+    from radiolib import metrics
+    from radiolib.stream import Proxy, StreamStations
+    from bench.stream_server import StreamServer
+    upstream = StreamServer(kbps=128, drop_every=args.stream_drop_every,
+                            outage=args.stream_outage).start()
+    sid = f"{args.stations + 1:02d}"
+    stations = StreamStations(os.path.join(music, "stations.json"), port=free_port())
+    stations.set(sid, upstream.url)
+    proxy = Proxy(stations)
+    srv = proxy.server("127.0.0.1", stations.port)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        stations.prefetch(sid)          # the knob tuning towards the station
+        time.sleep(args.stream_prefetch)
+        byte_rate = upstream.kbps * 1000 / 8
+        res = {}
+        def listen(label, url):
+            res[label] = stream_listener(url, byte_rate, args.stream_seconds)
+        threads = [threading.Thread(target=listen, args=("direct", upstream.url)),
+                   threading.Thread(target=listen, args=("proxied", stations.url(sid)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        res["upstream_connections"] = upstream.connections
+        res["relay"] = proxy.status().get(sid)
+        res["metrics"] = {f["name"]: f["series"][0][1] for f in metrics.snapshot()
+                          if f["name"].startswith("stream_") and f["series"]}
+        return res
+    finally:
+        srv.shutdown()
+        proxy.close()
+        upstream.shutdown()
+
+
+def bench_daemon(name, env, args):
+    cmd = [sys.executable, "-m", "bench.drivers", name, "--idle", str(args.idle)]
+    p = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True, timeout=300)
+    lines = [ln for ln in p.stdout.splitlines() if ln.startswith("{")]
+    if p.returncode or not lines:
+        return {"error": (p.stderr or p.stdout).strip().splitlines()[-5:]}
+    return json.loads(lines[-1])
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    home = tempfile.mkdtemp(prefix="radio-bench-")
+    try:
+        music = os.path.join(home, "music")
+        make_library(music, args.stations, args.tracks, args.frames)
+        fakebin = os.path.join(home, "bin")
+        os.makedirs(fakebin)
+        with open(os.path.join(fakebin, "systemctl"), "w") as f:
+            f.write(FAKE_SYSTEMCTL)
+        os.chmod(os.path.join(fakebin, "systemctl"), 0o755)
+
+        srv = MockMPDServer(music).start()
+        srv.state.decode_delay = args.decode_delay
+        env = dict(os.environ, HOME=home, MPD_HOST="127.0.0.1", MPD_PORT=str(srv.port),
+                   PATH=fakebin + os.pathsep + os.environ.get("PATH", ""),
+                   RADIO_BUS_DIR=os.path.join(home, "bus"),
+                   GPIOZERO_PIN_FACTORY="mock", PYTHONPATH=ROOT)
+        os.environ.update(RADIO_BUS_DIR=env["RADIO_BUS_DIR"])
+
+        results = {"meta": {
+            "rev": git_rev(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "machine": platform.machine(),
+            "cpus": os.cpu_count(), "stations": args.stations, "tracks": args.tracks,
+        }}
+        results["web"] = bench_web(env, args, args.stations)
+        results["switch"] = bench_switch(music, srv.port, args.stations, max(1, args.n // 4))
+        if args.stream_seconds > 0:
+            results["stream"] = bench_stream(music, args)
+        if not args.skip_daemons:
+            results["station_radio"] = bench_daemon("station", env, args)
+            results["amp_monitor"] = bench_daemon("amp", env, args)
+        results["mpd"] = {"connections": srv.state.connections, "commands": srv.state.commands}
+        srv.shutdown()
+        return results
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+# ------------------ comparing runs ------------------
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            out.update(flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(a_path, b_path):
+    with open(a_path) as f:
+        a = json.load(f)
+    with open(b_path) as f:
+        b = json.load(f)
+    fa, fb = flatten(a), flatten(b)
+    print(f"{'metric':48} {a['meta'].get('rev') or a_path:>12} {b['meta'].get('rev') or b_path:>12}  change")
+    for k in sorted(set(fa) | set(fb)):
+        if k.startswith("meta."):
+            continue
+        va, vb = fa.get(k), fb.get(k)
+        delta = ""
+        if va not in (None, 0) and vb is not None:
+            delta = f"{100.0 * (vb - va) / va:+.1f}%"
+        print(f"{k:48} {'' if va is None else va:>12} {'' if vb is None else vb:>12}  {delta}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python3 -m bench.run")
+    ap.add_argument("-o", "--output", help="write results JSON here (default: stdout)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files")
+    ap.add_argument("-n", type=int, default=200, help="requests per endpoint")
+    ap.add_argument("--workers", type=int, default=8, help="concurrent clients")
+    ap.add_argument("--duration", type=float, default=5.0, help="seconds per throughput test")
+    ap.add_argument("--stations", type=int, default=8)
+    ap.add_argument("--tracks", type=int, default=40, help="tracks per station")
+    ap.add_argument("--frames", type=int, default=20, help="MPEG frames per synthetic track")
+    ap.add_argument("--decode-delay", type=float, default=0.05, help="mock MPD time to first audio")
+    ap.add_argument("--idle", type=float, default=3.0, help="seconds of idle CPU sampling")
+    ap.add_argument("--settle", type=float, default=1.0, help="seconds after startup before timing")
+    ap.add_argument("--stream-seconds", type=float, default=15.0,
+                    help="seconds each stream listener plays (0 skips the stream test)")
+    ap.add_argument("--stream-drop-every", type=float, default=5.0, help="stand-in stream cuts out this often")
+    ap.add_argument("--stream-outage", type=float, default=4.0, help="seconds the stand-in stays down")
+    ap.add_argument("--stream-prefetch", type=float, default=3.0, help="seconds the relay runs before listening")
+    ap.add_argument("--skip-daemons", action="store_true", help="only benchmark the web app")
+    args = ap.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    out = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
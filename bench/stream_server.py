@@ -0,0 +1,107 @@
+"""Stand-in Icecast server for the stream relay benchmark.
+
+Sends an endless MP3 stream (repeated silent MPEG frames) at a steady
+bitrate, with an ``icy-br`` header and, like Icecast, a burst of a few
+seconds on connect. To imitate a flaky link it can go down for
+``outage`` seconds after every ``drop_every`` seconds up: all connections
+are cut and new ones refused (503) until it is back, so every client sees
+the same outages.
+
+    python3 -m bench.stream_server --port 8000 --kbps 128 --drop-every 20 --outage 3
+"""
+import argparse, socket, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417 bytes, 26.1 ms of audio
+FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+TICK = 0.05
+SNDBUF = 4 * 1024           # keep the kernel from hiding seconds of audio in flight
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def setup(self):
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+        super().setup()
+
+    def do_GET(self):
+        st = self.server
+        if st.down():
+            self.send_response(503)
+            self.end_headers()
+            return
+        with st.lock:
+            st.connections += 1
+        rate = st.kbps * 1000 / 8
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("icy-br", str(st.kbps))
+        self.send_header("icy-name", "bench")
+        self.end_headers()
+        t0 = time.monotonic()
+        sent = 0
+        try:
+            while True:
+                now = time.monotonic()
+                if st.down():
+                    return                  # connection cut
+                due = int(rate * st.burst + rate * (now - t0)) - sent
+                if due >= len(FRAME):
+                    n = due // len(FRAME)
+                    self.wfile.write(FRAME * n)
+                    self.wfile.flush()
+                    sent += n * len(FRAME)
+                time.sleep(TICK)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class StreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, kbps=128, burst=4.0, drop_every=0.0, outage=0.0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.kbps, self.burst = kbps, burst
+        self.drop_every, self.outage = drop_every, outage
+        self.started = time.monotonic()
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def down(self):
+        if not (self.drop_every and self.outage):
+            return False
+        return (time.monotonic() - self.started) % (self.drop_every + self.outage) >= self.drop_every
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/live.mp3"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python3 -m bench.stream_server")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--kbps", type=int, default=128)
+    ap.add_argument("--burst", type=float, default=4.0, help="seconds sent at once on connect")
+    ap.add_argument("--drop-every", type=float, default=0.0, help="seconds up between outages")
+    ap.add_argument("--outage", type=float, default=0.0, help="seconds down each time")
+    args = ap.parse_args(argv)
+    srv = StreamServer(args.port, args.kbps, args.burst, args.drop_every, args.outage)
+    print(f"stream on {srv.url}", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,8 @@ echo "[1/12] System packages"
 sudo apt-get update
 sudo apt-get install -y \
   network-manager python3-pip python3-flask python3-pil python3-smbus \
-  python3-gpiozero i2c-tools mpd mpc alsa-utils ladspa-sdk rsync
+  python3-gpiozero python3-dbus python3-gi i2c-tools mpd mpc alsa-utils \
+  ladspa-sdk libasound2-plugin-equal caps rsync curl brotli ffmpeg
 
 echo "[2/12] Enable I2C & NetworkManager"
 # Safe even if already enabled
@@ -52,8 +53,14 @@ if [ ! -f "${MUSIC_ROOT}/stations.json" ]; then
 JSON
 fi
 
-echo "[6/12] ALSA (EQ presets)"
+echo "[6/12] ALSA (live EQ)"
 sudo install -m 0644 -o root -g root config/asound.conf /etc/asound.conf
+# EQ controls file + saved curve: shared by MPD (plays through it) and the web app (sets it)
+sudo install -d -m 2775 -o root -g audio /var/lib/retroradio
+sudo usermod -aG audio "${USER_NAME}"
+# Event bus (radiolib.bus): made by root at every boot, before any user could claim the name
+echo 'd /tmp/retroradio-bus 2770 root audio -' | sudo tee /etc/tmpfiles.d/retroradio-bus.conf >/dev/null
+sudo systemd-tmpfiles --create /etc/tmpfiles.d/retroradio-bus.conf
 
 echo "[7/12] MPD config"
 # Prepare MPD state dirs/files & permissions before touching the service
@@ -66,7 +73,7 @@ fi
 sudo touch /var/lib/mpd/tag_cache /var/lib/mpd/state /var/lib/mpd/sticker.sql
 sudo chown mpd:audio /var/lib/mpd/tag_cache /var/lib/mpd/state /var/lib/mpd/sticker.sql
 
-# Write a minimal, safe /etc/mpd.conf (Unix line endings; device left default)
+# Write a minimal, safe /etc/mpd.conf (Unix line endings; one output through the live EQ)
 sudo tee /etc/mpd.conf >/dev/null <<EOF
 music_directory         "${MUSIC_ROOT}"
 playlist_directory      "/var/lib/mpd/playlists"
@@ -83,6 +90,7 @@ port                    "6600"
 audio_output {
     type            "alsa"
     name            "RetroRadio DAC"
+    device          "eq"
     mixer_type      "software"
 }
 
@@ -105,6 +113,24 @@ mpc update || true
 echo "[8/12] Web app + portal"
 sudo -u "${USER_NAME}" rsync -a webapp/ "${WEB_ROOT}/"
 sudo -u "${USER_NAME}" rsync -a portal/ "${PORTAL_DIR}/"
+# Bootstrap is served locally (the setup AP has no internet), precompressed for weak Wi-Fi
+BS_VER="5.3.3"
+BS_DIR="${WEB_ROOT}/static/vendor/bootstrap-${BS_VER}"
+for SPEC in "css/bootstrap.min.css QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH" \
+            "js/bootstrap.bundle.min.js YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz"; do
+  set -- $SPEC
+  DEST="${BS_DIR}/$1"
+  if [ ! -f "$DEST" ]; then
+    sudo -u "${USER_NAME}" mkdir -p "$(dirname "$DEST")"
+    sudo -u "${USER_NAME}" curl -fsSL -o "$DEST.tmp" "https://cdn.jsdelivr.net/npm/bootstrap@${BS_VER}/dist/$1"
+    if [ "$(openssl dgst -sha384 -binary "$DEST.tmp" | openssl base64 -A)" != "$2" ]; then
+      echo "Error: checksum mismatch for bootstrap $1" >&2; rm -f "$DEST.tmp"; exit 1
+    fi
+    sudo -u "${USER_NAME}" mv "$DEST.tmp" "$DEST"
+  fi
+  sudo -u "${USER_NAME}" gzip -9 -k -f "$DEST"
+  sudo -u "${USER_NAME}" brotli -q 11 -k -f "$DEST" || true
+done
 
 echo "[9/12] Services"
 # Install unit files
@@ -114,6 +140,7 @@ sudo install -m 0644 services/radio-netcheck.service /etc/systemd/system/
 sudo install -m 0644 services/radio-portal.service /etc/systemd/system/
 sudo install -m 0644 services/eq-apply.service /etc/systemd/system/
 sudo install -m 0644 services/amp-monitor.service /etc/systemd/system/
+sudo install -m 0644 services/radio-stream.service /etc/systemd/system/
 
 # Patch unit files to use correct user/home (avoid baked-in 'pi' or /home/pi)
 for UNIT in /etc/systemd/system/*.service; do
@@ -123,7 +150,7 @@ for UNIT in /etc/systemd/system/*.service; do
 done
 
 sudo systemctl daemon-reload
-sudo systemctl enable station-radio.service eq-apply.service radio-netcheck.service amp-monitor.service
+sudo systemctl enable station-radio.service eq-apply.service radio-netcheck.service amp-monitor.service radio-stream.service
 # Do not start portal/web here—net may be reconfiguring; leave units to start on boot or by dependency.
 
 echo "[9.5/12] Sudoers (web controls)"
@@ -139,6 +166,7 @@ ${USER_NAME} ALL=(root) NOPASSWD: \
 /bin/systemctl is-active radio-portal, /bin/systemctl is-enabled radio-portal, /bin/systemctl restart radio-portal, \
 /bin/systemctl is-active eq-apply, /bin/systemctl is-enabled eq-apply, /bin/systemctl restart eq-apply, \
 /bin/systemctl is-active amp-monitor, /bin/systemctl is-enabled amp-monitor, /bin/systemctl restart amp-monitor, \
+/bin/systemctl is-active radio-stream, /bin/systemctl is-enabled radio-stream, /bin/systemctl restart radio-stream, \
 /usr/bin/df, /sbin/reboot
 EOF
 
@@ -152,6 +180,7 @@ fi
 rm -f "$SUDOERS_TEMP"
 
 echo "[10/12] Scripts"
+sudo -u "${USER_NAME}" rsync -a --delete radiolib/ "${USER_HOME}/radiolib/"
 sudo install -m 0755 scripts/station_radio.py "${USER_HOME}/station_radio.py"
 sudo install -m 0755 scripts/amp_monitor.py    "${USER_HOME}/amp_monitor.py"
 sudo chown "${USER_NAME}:${USER_NAME}" "${USER_HOME}/station_radio.py" "${USER_HOME}/amp_monitor.py"
@@ -168,8 +197,9 @@ echo 'address=/RetroRadio/10.10.10.10' | sudo tee /etc/NetworkManager/dnsmasq.d/
 sudo systemctl restart NetworkManager || true
 
 echo "[12/12] Default EQ preset"
-echo "EQ Warm" | sudo tee /var/local/eq_preset >/dev/null
-sudo mpc enableonly "EQ Warm" || true
+if [ ! -f /var/lib/retroradio/eq.json ]; then
+  sudo -u "${USER_NAME}" env PYTHONPATH="${USER_HOME}" python3 -m radiolib.eq set "EQ Warm" || true
+fi
 
 echo "Done. Rebooting..."
 sleep 2
@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
-import os
+import os, sys
 from flask import Flask, request
 
-OLED_MSG="/tmp/display_message"
+# radiolib/ is installed next to this folder (~/radiolib beside ~/portal)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from radiolib import bus
+from radiolib.files import send_static
+
 PORTAL_DONE="/var/local/radio_portal_done"
+# Bundled CSS lives with the web app; the setup AP has no internet for a CDN
+STATIC_ROOT=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "webapp", "static")
+
+def show(msg): bus.publish(bus.DISPLAY_MESSAGE, text=msg, sticky=True)
 
-def show(msg):
-    try: open(OLED_MSG,"w").write(msg)
-    except: pass
+app=Flask(__name__, static_folder=None)
 
-app=Flask(__name__)
+@app.route("/static/<path:filename>")
+def static_file(filename): return send_static(STATIC_ROOT, filename)
 
 HTML='''<!doctype html><meta name=viewport content="width=device-width, initial-scale=1">
 <title>RetroRadio Wi-Fi</title>
-<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
+<link href="/static/vendor/bootstrap-5.3.3/css/bootstrap.min.css" rel="stylesheet">
 <div class="container py-4" style="max-width:560px">
 <h3 class="mb-3">RetroRadio Wi-Fi Setup</h3>
 <p class="text-muted">Enter your home Wi-Fi details.</p>
@@ -0,0 +1,5 @@
+"""Shared helpers for the RetroRadio daemons and web UI.
+
+Installed next to station_radio.py / amp_monitor.py in the radio user's
+home directory; the web app adds that directory to ``sys.path``.
+"""
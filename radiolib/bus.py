@@ -0,0 +1,198 @@
+"""Tiny local event bus over Unix datagram sockets.
+
+Replaces the old file-polling IPC (/tmp/display_message,
+/var/local/amp_state). There is no broker: every subscriber binds a
+socket in BUS_DIR and :func:`publish` sends one datagram to each of them,
+so delivery takes microseconds and idle subscribers never wake up.
+Messages are small JSON objects with a ``type``; values published with
+``retain=True`` are also stored in BUS_DIR so a subscriber that starts
+later can replay the current state (e.g. whether the amp is on).
+
+Command line, for shell units: ``python3 -m radiolib.bus display [--sticky] TEXT``
+"""
+import grp, json, logging, os, socket, stat, threading, time
+
+BUS_DIR = os.environ.get("RADIO_BUS_DIR", "/tmp/retroradio-bus")
+BUS_GROUP = os.environ.get("RADIO_BUS_GROUP", "audio")   # root (portal) + the radio user
+MAX_DGRAM = 8192
+
+# Message types
+AMP_STATE = "amp_state"               # {"on": bool}
+DISPLAY_MESSAGE = "display_message"   # {"text": str, "sticky": bool}
+STATION_CHANGED = "station_changed"   # {"station": "NN", "name": str}
+
+log = logging.getLogger(__name__)
+_out = None
+_out_lock = threading.Lock()
+_file_mode = None
+
+
+def _ensure_dir():
+    """Create BUS_DIR if needed; returns the mode for sockets and files in it.
+
+    The directory belongs to BUS_GROUP (setgid, 2770) so only the portal
+    and the radio user can publish or listen. Without that group it falls
+    back to a sticky 1777 directory, where nobody can replace another
+    user's socket or retained value. A directory that someone else made
+    (BUS_DIR is in /tmp), or one left writable for everybody, is refused
+    with PermissionError rather than trusted.
+    """
+    global _file_mode
+    if _file_mode is not None and os.path.isdir(BUS_DIR):
+        return _file_mode
+    if not os.path.isdir(BUS_DIR):
+        os.makedirs(BUS_DIR, exist_ok=True)
+    st = os.lstat(BUS_DIR)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid not in (os.geteuid(), 0):
+        raise PermissionError(f"{BUS_DIR} is not a directory owned by us or root; refusing to use it")
+    if st.st_uid == os.geteuid() and st.st_mode & 0o7777 not in (0o2770, 0o1777):
+        try:
+            os.chown(BUS_DIR, -1, grp.getgrnam(BUS_GROUP).gr_gid)
+            os.chmod(BUS_DIR, 0o2770)
+        except (KeyError, OSError):
+            try:
+                os.chmod(BUS_DIR, 0o1777)
+            except OSError:
+                pass
+        st = os.lstat(BUS_DIR)
+    if st.st_mode & 0o002 and not st.st_mode & stat.S_ISVTX:
+        raise PermissionError(f"{BUS_DIR} is writable by everyone; refusing to use it")
+    _file_mode = 0o660 if st.st_mode & 0o2000 else 0o666
+    return _file_mode
+
+
+def _retained_path(mtype):
+    return os.path.join(BUS_DIR, mtype + ".last")
+
+
+def publish(mtype, retain=False, **fields):
+    """Send a message to every live subscriber; never blocks the caller."""
+    global _out
+    msg = dict(fields, type=mtype, pid=os.getpid(), ts=time.time())
+    data = json.dumps(msg).encode("utf-8")
+    try:
+        mode = _ensure_dir()
+        if retain:
+            tmp = _retained_path(mtype) + f".{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.chmod(tmp, mode)
+            os.replace(tmp, _retained_path(mtype))
+        names = os.listdir(BUS_DIR)
+    except OSError as e:
+        log.warning("bus publish %s failed: %s", mtype, e)
+        return
+    with _out_lock:
+        if _out is None:
+            _out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            _out.setblocking(False)
+        for fn in names:
+            if not fn.endswith(".sock"):
+                continue
+            path = os.path.join(BUS_DIR, fn)
+            try:
+                _out.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)  # subscriber died without cleaning up
+                except OSError:
+                    pass
+            except OSError as e:  # receiver's queue full: drop rather than stall
+                log.warning("bus: %s dropped %s: %s", fn, mtype, e)
+
+
+def last(mtype):
+    """The last retained message of ``mtype``, or None."""
+    try:
+        with open(_retained_path(mtype), "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+class Subscriber:
+    """Receive bus messages and dispatch by type.
+
+    ``handlers`` maps message type -> callable(msg). Types listed in
+    ``replay`` get their retained value delivered once on :meth:`start`.
+    Messages published by this same process are ignored. Handlers run on
+    a background thread, or on the asyncio loop passed to :meth:`start`.
+    """
+
+    def __init__(self, name, handlers, replay=()):
+        self.handlers = dict(handlers)
+        self.replay = replay
+        mode = _ensure_dir()
+        self.path = os.path.join(BUS_DIR, f"{name}-{os.getpid()}.sock")
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, mode)
+
+    def start(self, loop=None):
+        for mtype in self.replay:
+            msg = last(mtype)
+            if msg:
+                self._dispatch(msg, replayed=True)
+        if loop is not None:
+            self.sock.setblocking(False)
+            loop.add_reader(self.sock.fileno(), self._drain)
+        else:
+            threading.Thread(target=self._loop, name="bus", daemon=True).start()
+        return self
+
+    def _dispatch(self, msg, replayed=False):
+        fn = self.handlers.get(msg.get("type"))
+        if fn is None or (msg.get("pid") == os.getpid() and not replayed):
+            return
+        try:
+            fn(msg)
+        except Exception:
+            log.exception("bus handler for %s failed", msg.get("type"))
+
+    def _loop(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_DGRAM)
+                self._dispatch(json.loads(data))
+            except ValueError:
+                continue
+            except OSError:
+                return  # closed
+
+    def _drain(self):
+        """Dispatch everything queued on the (non-blocking) socket."""
+        while True:
+            try:
+                data = self.sock.recv(MAX_DGRAM)
+            except OSError:  # BlockingIOError: queue empty
+                return
+            try:
+                self._dispatch(json.loads(data))
+            except ValueError:
+                continue
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(prog="python3 -m radiolib.bus")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    d = sub.add_parser("display", help="show a message on the OLED")
+    d.add_argument("--sticky", action="store_true", help="keep it until the knob is used")
+    d.add_argument("text")
+    args = ap.parse_args(argv)
+    publish(DISPLAY_MESSAGE, text=args.text, sticky=args.sticky)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,551 @@
+"""Persistent music library catalog (SQLite, ``~/music/.catalog.db``).
+
+Keeps one row per track -- station, file name, size, mtime, duration,
+bitrate and ID3 title/artist/album -- so pages and daemons never have to
+``os.listdir`` the library. Rescans are incremental: a station folder is
+re-listed only when its directory mtime changes, and a file is re-probed
+only when its size or mtime changes. Probing (reading tags and the first
+MPEG frame) is deferred to :meth:`Catalog.enrich`, which the web app runs
+in the background, so a fresh or freshly-uploaded library lists instantly.
+
+Each row also carries the file's inode and a BLAKE2 hash of its audio
+payload (:func:`audio_hash`; tags excluded), which make the library
+content-addressed: uploads find identical tracks already on the card,
+copies in other stations are hardlinked instead of stored again
+(:meth:`Catalog.dedupe` does the same for an existing library), and
+:meth:`Catalog.storage` accounts for shared bytes from the index alone.
+"""
+import base64, hashlib, json, os, secrets, sqlite3, struct, threading, time
+
+DB_NAME = ".catalog.db"
+AUDIO_EXTS = (".mp3",)
+REFRESH_SEC = 2.0        # min interval between automatic mtime sweeps
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stations (
+    station TEXT PRIMARY KEY, mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    station TEXT NOT NULL, name TEXT NOT NULL,
+    size INTEGER NOT NULL, mtime REAL NOT NULL,
+    duration REAL, bitrate INTEGER,
+    title TEXT, artist TEXT, album TEXT,
+    probed INTEGER NOT NULL DEFAULT 0,
+    ino INTEGER, hash TEXT,
+    PRIMARY KEY (station, name)
+);
+CREATE INDEX IF NOT EXISTS tracks_unprobed ON tracks (probed);
+CREATE INDEX IF NOT EXISTS tracks_size ON tracks (station, size, name);
+CREATE INDEX IF NOT EXISTS tracks_duration ON tracks (station, COALESCE(duration, -1), name);
+CREATE INDEX IF NOT EXISTS tracks_mtime ON tracks (station, mtime, name);
+"""
+HASH_BUF = 256 * 1024
+DEDUPE_TMP = ".dedupe-"
+
+TRACK_COLS = ("station", "name", "size", "mtime", "duration", "bitrate", "title", "artist", "album")
+SORT_KEYS = {"name": "name", "size": "size", "duration": "COALESCE(duration, -1)", "mtime": "mtime"}
+PAGE_MAX = 500
+
+
+def is_station_id(name: str) -> bool:
+    return len(name) == 2 and name.isdigit()
+
+
+def is_audio(name: str) -> bool:
+    return name.lower().endswith(AUDIO_EXTS) and not name.startswith(".")
+
+
+# ------------------ MP3 probing (ID3v2 + first frame / Xing) ------------------
+_BITRATES = {  # kbps, Layer III
+    "1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_RATES = {"1": [44100, 48000, 32000], "2": [22050, 24000, 16000], "2.5": [11025, 12000, 8000]}
+_ID3_FIELDS = {"TIT2": "title", "TT2": "title", "TPE1": "artist", "TP1": "artist",
+               "TALB": "album", "TAL": "album"}
+
+
+def _syncsafe(b):
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+
+def _id3_text(data):
+    if not data:
+        return None
+    enc, raw = data[0], data[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(enc, "latin-1")
+    text = raw.decode(codec, "replace").split("\x00")[0].strip()
+    return text or None
+
+
+def _id3_frames(body, major):
+    tags, i = {}, 0
+    hlen = 6 if major == 2 else 10
+    while i + hlen <= len(body) and body[i] != 0:
+        if major == 2:
+            fid, size = body[i:i + 3].decode("latin-1"), int.from_bytes(body[i + 3:i + 6], "big")
+        else:
+            fid = body[i:i + 4].decode("latin-1")
+            size = _syncsafe(body[i + 4:i + 8]) if major == 4 else int.from_bytes(body[i + 4:i + 8], "big")
+        if size <= 0:
+            break
+        field = _ID3_FIELDS.get(fid)
+        if field and field not in tags:
+            tags[field] = _id3_text(body[i + hlen:i + hlen + size])
+        i += hlen + size
+    return tags
+
+
+def probe_mp3(path):
+    """Best-effort ``{duration, bitrate, rate, title, artist, album}`` for an MP3."""
+    info = dict.fromkeys(("duration", "bitrate", "rate", "title", "artist", "album"))
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            head, start = f.read(10), 0
+            if len(head) == 10 and head[:3] == b"ID3":
+                tlen = _syncsafe(head[6:10])
+                info.update(_id3_frames(f.read(tlen), head[3]))
+                start = 10 + tlen + (10 if head[5] & 0x10 else 0)
+            f.seek(start)
+            buf = f.read(8192)
+    except OSError:
+        return info
+    for i in range(len(buf) - 4):
+        if buf[i] != 0xFF or (buf[i + 1] & 0xE0) != 0xE0:
+            continue
+        b1, b2, b3 = buf[i + 1], buf[i + 2], buf[i + 3]
+        ver = {3: "1", 2: "2", 0: "2.5"}.get((b1 >> 3) & 3)
+        bi, ri = b2 >> 4, (b2 >> 2) & 3
+        if ver is None or (b1 >> 1) & 3 != 1 or bi in (0, 15) or ri == 3:
+            continue  # not a Layer III header, keep scanning
+        kbps = _BITRATES["1" if ver == "1" else "2"][bi]
+        rate = _RATES[ver][ri]
+        spf = 1152 if ver == "1" else 576
+        mono = (b3 >> 6) == 3
+        xoff = i + 4 + ((17 if mono else 32) if ver == "1" else (9 if mono else 17))
+        audio_bytes = size - start - i
+        frames = None
+        if buf[xoff:xoff + 4] in (b"Xing", b"Info") and len(buf) >= xoff + 12:
+            flags = struct.unpack(">I", buf[xoff + 4:xoff + 8])[0]
+            if flags & 1:
+                frames = struct.unpack(">I", buf[xoff + 8:xoff + 12])[0]
+        if frames:
+            info["duration"] = frames * spf / rate
+            info["bitrate"] = int(audio_bytes * 8 / info["duration"] / 1000) if info["duration"] else kbps
+        else:
+            info["duration"] = audio_bytes * 8 / (kbps * 1000)
+            info["bitrate"] = kbps
+        info["duration"] = round(info["duration"], 2)
+        info["rate"] = rate
+        break
+    return info
+
+
+# ------------------ content hash ------------------
+def _audio_span(f, size):
+    """``(start, end)`` of the audio between a leading ID3v2 and trailing ID3v1 tag."""
+    head = f.read(10)
+    start = 0
+    if len(head) == 10 and head[:3] == b"ID3":
+        start = 10 + _syncsafe(head[6:10]) + (10 if head[5] & 0x10 else 0)
+    end = size
+    if size - start >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b"TAG":
+            end = size - 128
+    return start, end
+
+
+def audio_hash(path):
+    """BLAKE2b of the audio payload, so retagging a track doesn't change it."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        start, end = _audio_span(f, os.fstat(f.fileno()).st_size)
+        f.seek(start)
+        left = end - start
+        while left > 0:
+            buf = f.read(min(HASH_BUF, left))
+            if not buf:
+                break
+            h.update(buf)
+            left -= len(buf)
+    return h.hexdigest()
+
+
+def tag_hash(path):
+    """BLAKE2b of everything *but* the audio: the ID3v2 and ID3v1 tags.
+
+    Two files are only hardlinked when this matches too, so linking
+    never swaps one copy's tags for another's.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end = _audio_span(f, size)
+        f.seek(0)
+        h.update(f.read(min(start, size)))
+        f.seek(end)
+        h.update(f.read())
+    return h.hexdigest()
+
+
+class AudioHasher:
+    """:func:`audio_hash` of data arriving in pieces, e.g. while an upload streams in."""
+
+    def __init__(self):
+        self._h = hashlib.blake2b(digest_size=16)
+        self._head, self._tail = b"", b""   # first 10 bytes / last 128 (maybe ID3v1)
+        self._skip = None                   # ID3v2 bytes still to skip; None until known
+
+    def update(self, data):
+        if self._skip is None:
+            self._head += data
+            if len(self._head) < 10:
+                return
+            data, h = self._head, self._head[:10]
+            self._head = b""
+            self._skip = 10 + _syncsafe(h[6:10]) + (10 if h[5] & 0x10 else 0) if h[:3] == b"ID3" else 0
+        if self._skip:
+            n = min(self._skip, len(data))
+            self._skip -= n
+            data = data[n:]
+        buf = self._tail + data
+        self._h.update(buf[:-128])
+        self._tail = buf[-128:]
+
+    def hexdigest(self):
+        h = self._h.copy()
+        tail = self._head if self._skip is None else self._tail
+        if not (len(tail) == 128 and tail[:3] == b"TAG"):
+            h.update(tail)
+        return h.hexdigest()
+
+
+def _cursor(key, name):
+    return base64.urlsafe_b64encode(json.dumps([key, name]).encode("utf-8")).decode("ascii")
+
+
+def _uncursor(token):
+    try:
+        key, name = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("malformed cursor") from None
+    return key, name
+
+
+def _link_over(src, dst):
+    """Atomically replace ``dst`` with a hardlink to ``src``."""
+    tmp = os.path.join(os.path.dirname(dst), f"{DEDUPE_TMP}{os.getpid()}-{threading.get_ident()}-"
+                                             f"{secrets.token_hex(4)}.tmp")
+    os.link(src, tmp)
+    try:
+        os.replace(tmp, dst)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+
+# ------------------ Catalog ------------------
+class Catalog:
+    """Thread-safe SQLite index of ``music_root/NN/*.mp3``."""
+
+    def __init__(self, music_root, path=None):
+        self.music_root = music_root
+        self.path = path or os.path.join(music_root, DB_NAME)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._dedupe_lock = threading.Lock()
+        self._last_sweep = 0.0
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+            cols = {r[1] for r in self._db.execute("PRAGMA table_info(tracks)")}
+            if "hash" not in cols:  # catalog from before content hashing: hash everything once
+                self._db.execute("ALTER TABLE tracks ADD COLUMN ino INTEGER")
+                self._db.execute("ALTER TABLE tracks ADD COLUMN hash TEXT")
+                self._db.execute("UPDATE tracks SET probed=0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS tracks_hash ON tracks (hash)")
+
+    # ---- incremental scan ----
+    def refresh(self, station=None, force=False):
+        """Bring the index up to date with the filesystem (cheap: stats only)."""
+        if station is None and not force and time.monotonic() - self._last_sweep < REFRESH_SEC:
+            return
+        with self._lock:
+            known = {r["station"]: r["mtime"] for r in self._db.execute("SELECT * FROM stations")}
+            if station is not None:
+                todo = [station]
+            else:
+                self._last_sweep = time.monotonic()
+                try:
+                    todo = [d for d in os.listdir(self.music_root) if is_station_id(d)]
+                except OSError:
+                    todo = []
+                todo += [s for s in known if s not in todo]
+            for st in todo:
+                p = os.path.join(self.music_root, st)
+                mtime = os.stat(p).st_mtime if os.path.isdir(p) else None
+                if mtime is None:
+                    self._drop(st)
+                elif force or station is not None or known.get(st) != mtime:
+                    self._rescan(st, mtime)
+
+    def _drop(self, station):
+        with self._db:
+            self._db.execute("DELETE FROM tracks WHERE station=?", (station,))
+            self._db.execute("DELETE FROM stations WHERE station=?", (station,))
+
+    def _rescan(self, station, mtime):
+        d = os.path.join(self.music_root, station)
+        have = {r["name"]: (r["size"], r["mtime"]) for r in
+                self._db.execute("SELECT name, size, mtime FROM tracks WHERE station=?", (station,))}
+        seen = set()
+        with self._db:
+            try:
+                entries = list(os.scandir(d))
+            except OSError:
+                entries = []
+            for e in entries:
+                if not is_audio(e.name) or not e.is_file():
+                    continue
+                st = e.stat()
+                seen.add(e.name)
+                if have.get(e.name) != (st.st_size, st.st_mtime):
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO tracks (station, name, size, mtime, ino, probed) "
+                        "VALUES (?, ?, ?, ?, ?, 0)", (station, e.name, st.st_size, st.st_mtime, st.st_ino))
+            gone = [(station, n) for n in have if n not in seen]
+            self._db.executemany("DELETE FROM tracks WHERE station=? AND name=?", gone)
+            self._db.execute("INSERT OR REPLACE INTO stations VALUES (?, ?)", (station, mtime))
+
+    def add(self, station, name, digest=None):
+        """Index one new file right away (e.g. a committed upload, hashed while streaming)."""
+        st = os.stat(os.path.join(self.music_root, station, name))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tracks (station, name, size, mtime, ino, hash, probed) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)", (station, name, st.st_size, st.st_mtime, st.st_ino, digest))
+
+    def carry(self, station, dest, names):
+        """Index files just linked from ``station`` into ``dest`` (``{old: new}``).
+
+        Tags, duration and hash travel with the row, so moved or copied
+        tracks are not probed or hashed again; both folders are then
+        rescanned (a moved file's old row goes with it).
+        """
+        with self._lock:
+            with self._db:
+                for old, new in names.items():
+                    try:
+                        st = os.stat(os.path.join(self.music_root, dest, new))
+                    except OSError:
+                        continue
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO tracks (station, name, size, mtime, duration, bitrate, title, "
+                        "artist, album, probed, ino, hash) SELECT ?, ?, ?, ?, duration, bitrate, title, "
+                        "artist, album, probed, ?, hash FROM tracks WHERE station=? AND name=?",
+                        (dest, new, st.st_size, st.st_mtime, st.st_ino, station, old))
+            self.refresh(station)
+            self.refresh(dest)
+
+    def enrich(self, limit=None):
+        """Probe tags/duration (and hash) rows not probed yet; returns how many were done."""
+        with self._lock:
+            rows = self._db.execute("SELECT station, name, hash FROM tracks WHERE probed=0"
+                                    + (f" LIMIT {int(limit)}" if limit else "")).fetchall()
+        for r in rows:
+            path = os.path.join(self.music_root, r["station"], r["name"])
+            info = probe_mp3(path)
+            try:
+                ino, digest = os.stat(path).st_ino, r["hash"] or audio_hash(path)
+            except OSError:
+                ino = digest = None
+            with self._lock, self._db:
+                self._db.execute(
+                    "UPDATE tracks SET duration=?, bitrate=?, title=?, artist=?, album=?, ino=?, hash=?, "
+                    "probed=1 WHERE station=? AND name=?",
+                    (info["duration"], info["bitrate"], info["title"], info["artist"], info["album"],
+                     ino, digest, r["station"], r["name"]))
+        return len(rows)
+
+    def run_enricher(self, interval=5.0):
+        """Background loop: sweep mtimes and probe new files forever."""
+        def loop():
+            while True:
+                try:
+                    self.refresh()
+                    if self.enrich(limit=50):
+                        continue
+                except sqlite3.Error:
+                    pass
+                time.sleep(interval)
+        threading.Thread(target=loop, name="catalog", daemon=True).start()
+
+    # ---- queries ----
+    def stations(self):
+        """Sorted station ids that exist on disk."""
+        self.refresh()
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT station FROM stations ORDER BY station")]
+
+    def max_station(self):
+        s = self.stations()
+        return int(s[-1]) if s else 0
+
+    def tracks(self, station):
+        self.refresh()
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(TRACK_COLS)} FROM tracks WHERE station=? ORDER BY name",
+                (station,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def page(self, station, sort="name", desc=False, q=None, min_size=None, max_size=None,
+             min_duration=None, max_duration=None, after=None, limit=100):
+        """One page of a station's tracks: ``{"tracks", "total", "next"}``.
+
+        Keyset-paginated on (sort key, name): ``next`` is an opaque cursor for
+        the following page (None at the end), so a deep page costs what the
+        first does and tracks added or removed meanwhile never shift the rest.
+        ``q`` matches file name, title or artist. Raises ValueError for an
+        unknown ``sort`` or a malformed cursor.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"unknown sort {sort!r}")
+        key, op, order = SORT_KEYS[sort], ("<" if desc else ">"), ("DESC" if desc else "ASC")
+        where, args = ["station=?"], [station]
+        if q:
+            pat = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(name LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\' OR artist LIKE ? ESCAPE '\\')")
+            args += [pat] * 3
+        for col, lo, hi in (("size", min_size, max_size), ("duration", min_duration, max_duration)):
+            if lo is not None:
+                where.append(f"{col} >= ?")
+                args.append(lo)
+            if hi is not None:
+                where.append(f"{col} <= ?")
+                args.append(hi)
+        limit = max(1, min(int(limit), PAGE_MAX))
+        self.refresh()
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM tracks WHERE {' AND '.join(where)}",
+                                     args).fetchone()[0]
+            if after:
+                where.append(f"({key}, name) {op} (?, ?)")
+                args += list(_uncursor(after))
+            rows = self._db.execute(
+                f"SELECT {', '.join(TRACK_COLS)}, {key} AS k FROM tracks WHERE {' AND '.join(where)} "
+                f"ORDER BY {key} {order}, name {order} LIMIT ?", args + [limit + 1]).fetchall()
+        more, rows = len(rows) > limit, rows[:limit]
+        return {"tracks": [{c: r[c] for c in TRACK_COLS} for r in rows], "total": total,
+                "next": _cursor(rows[-1]["k"], rows[-1]["name"]) if more else None}
+
+    def summary(self):
+        """``{station: {"tracks": n, "bytes": b, "duration": s}}``."""
+        self.refresh()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.station, COUNT(t.name), COALESCE(SUM(t.size), 0), COALESCE(SUM(t.duration), 0) "
+                "FROM stations s LEFT JOIN tracks t ON t.station = s.station GROUP BY s.station").fetchall()
+        return {r[0]: {"tracks": r[1], "bytes": r[2], "duration": r[3]} for r in rows}
+
+    # ---- content addressing ----
+    def hashes(self, station, names):
+        """``{name: audio hash}`` for indexed tracks of ``station`` (unhashed ones left out)."""
+        with self._lock:
+            rows = self._db.execute("SELECT name, hash FROM tracks WHERE station=? AND hash IS NOT NULL",
+                                    (station,)).fetchall()
+        wanted = set(names)
+        return {r["name"]: r["hash"] for r in rows if r["name"] in wanted}
+
+    def find_hash(self, digest):
+        """Indexed tracks with this audio hash: ``[{"station", "name", "ino"}]``."""
+        with self._lock:
+            rows = self._db.execute("SELECT station, name, ino FROM tracks WHERE hash=? "
+                                    "ORDER BY station, name", (digest,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def storage(self):
+        """Per-station bytes from the index, counting hardlinked copies once.
+
+        ``own`` is stored only for that station, ``shared`` is also linked from
+        other stations, ``reclaimable`` is held by same-audio copies that
+        :meth:`dedupe` could link (at most: copies whose tags differ stay).
+        """
+        self.refresh()
+        with self._lock:
+            rows = self._db.execute("SELECT station, ino, hash, size FROM tracks ORDER BY station, name").fetchall()
+        owners, first = {}, {}          # ino -> stations; hash -> ino kept by dedupe
+        for r in rows:
+            owners.setdefault(r["ino"], set()).add(r["station"])
+            if r["hash"]:
+                first.setdefault(r["hash"], r["ino"])
+        out, seen = {}, set()
+        for r in rows:
+            s = out.setdefault(r["station"], {"files": 0, "bytes": 0, "own": 0, "shared": 0,
+                                              "reclaimable": 0})
+            s["files"] += 1
+            s["bytes"] += r["size"]
+            s["shared" if len(owners[r["ino"]]) > 1 else "own"] += r["size"]
+            if r["hash"] and first[r["hash"]] != r["ino"] and r["ino"] not in seen:
+                s["reclaimable"] += r["size"]
+            seen.add(r["ino"])
+        sizes = {r["ino"]: r["size"] for r in rows}
+        apparent = sum(r["size"] for r in rows)
+        return {"stations": out, "apparent_bytes": apparent, "stored_bytes": sum(sizes.values()),
+                "linked_bytes": apparent - sum(sizes.values())}
+
+    def dedupe(self):
+        """Hardlink identical tracks to one copy; returns ``{"linked", "bytes", "stations", "tags_differ"}``.
+
+        Tracks are identical when both the audio and the tags match; the
+        first copy (by station, name) is kept. ``tags_differ`` counts copies
+        not linked to their audio's first copy because their tags differ
+        (they are still linked to copies with the same tags). One run at a time.
+        """
+        with self._dedupe_lock:
+            return self._dedupe()
+
+    def _dedupe(self):
+        with self._lock:
+            rows = self._db.execute("SELECT station, name, ino, size, hash FROM tracks "
+                                    "WHERE hash IN (SELECT hash FROM tracks WHERE hash IS NOT NULL "
+                                    "GROUP BY hash HAVING COUNT(DISTINCT ino) > 1) "
+                                    "ORDER BY hash, station, name").fetchall()
+        linked = saved = differ = 0
+        stations, keep, freed = set(), {}, set()   # keep: (audio, tags) -> first copy
+        first = {}                                 # audio -> tags of its first copy
+        for r in rows:
+            dst = os.path.join(self.music_root, r["station"], r["name"])
+            try:
+                tags = tag_hash(dst)
+            except OSError:
+                continue
+            if first.setdefault(r["hash"], tags) != tags:
+                differ += 1
+            src = keep.setdefault((r["hash"], tags), r)
+            if r["ino"] == src["ino"]:
+                continue
+            try:
+                _link_over(os.path.join(self.music_root, src["station"], src["name"]), dst)
+                st = os.stat(dst)
+            except OSError:
+                continue
+            with self._lock, self._db:
+                self._db.execute("UPDATE tracks SET ino=?, size=?, mtime=?, probed=0 "
+                                 "WHERE station=? AND name=?",
+                                 (st.st_ino, st.st_size, st.st_mtime, r["station"], r["name"]))
+            linked += 1
+            stations.add(r["station"])
+            if r["ino"] not in freed:
+                freed.add(r["ino"])
+                saved += r["size"]
+        return {"linked": linked, "bytes": saved, "stations": sorted(stations),
+                "tags_differ": differ}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,210 @@
+"""Live 10-band EQ on a single ALSA output.
+
+MPD plays into one PCM, ``eq``, which runs the CAPS ``Eq10`` LADSPA
+plugin through alsaequal (``config/asound.conf``). alsaequal keeps the
+band gains in a memory-mapped controls file shared by the PCM (inside MPD)
+and its control device (``ctl.equal``), so gains written through the
+control device take effect on the next audio period -- the device is never
+reopened and playback never drops out.
+
+:class:`Equalizer` writes the gains through one long-lived ``amixer -s``
+process and crossfades between curves in small steps (Eq10 also smooths
+each step internally), so switching presets is a glide, not a click. The
+chosen curve is kept in STATE_FILE and restored at boot by
+``python3 -m radiolib.eq apply`` (eq-apply.service).
+
+``python3 -m radiolib.eq cpu`` reports what the EQ stage costs in CPU.
+"""
+import json, logging, os, resource, subprocess, threading, time
+
+from . import state as statestore
+
+BANDS_HZ = (31, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)
+PRESETS = {
+    "EQ Warm":   (8, 6, 4, 2, 0, 0, -2, -3, -4, -5),
+    "EQ Flat":   (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+    "EQ Voice":  (0, 0, 2, 3, 2, 1, 0, -2, -3, -4),
+    "EQ Night":  (6, 5, 3, 2, 0, 0, -2, -3, -4, -5),
+    "EQ Bright": (0, 0, 1, 1, 0, 0, 1, 2, 2, 1),
+    "EQ Bypass": (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),   # flat: Eq10 at 0 dB is transparent
+}
+DEFAULT_PRESET = "EQ Warm"
+CTL_DEVICE = os.environ.get("RADIO_EQ_CTL", "equal")
+PCM_DEVICE = os.environ.get("RADIO_EQ_PCM", "eq")
+STATE_FILE = "/var/lib/retroradio/eq.json"
+LEGACY_PRESET_FILE = "/var/local/eq_preset"     # preset name only, from the per-output setup
+PLUGIN_MIN_DB, PLUGIN_MAX_DB = -48.0, 24.0     # Eq10 band range; alsaequal maps it to 0..100
+GAIN_LIMIT_DB = 12.0                            # custom curves are clamped to +/- this
+FADE_SEC = 0.4
+FADE_STEPS = 8
+
+log = logging.getLogger(__name__)
+
+
+def _raw(db):
+    return int(round((db - PLUGIN_MIN_DB) / (PLUGIN_MAX_DB - PLUGIN_MIN_DB) * 100))
+
+
+def clamp_gains(gains):
+    """Validate a custom curve: ten numbers, clamped to +/-GAIN_LIMIT_DB."""
+    gains = [float(g) for g in gains]
+    if len(gains) != len(BANDS_HZ):
+        raise ValueError(f"expected {len(BANDS_HZ)} band gains, got {len(gains)}")
+    return [max(-GAIN_LIMIT_DB, min(GAIN_LIMIT_DB, g)) for g in gains]
+
+
+def load_state(path=STATE_FILE):
+    """``{"preset": name or None, "gains": [...]}`` last applied."""
+    st = statestore.document(path).data()
+    try:
+        return {"preset": st.get("preset"), "gains": clamp_gains(st["gains"])}
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        name = open(LEGACY_PRESET_FILE).read().strip()
+    except OSError:
+        name = None
+    name = name if name in PRESETS else DEFAULT_PRESET
+    return {"preset": name, "gains": list(PRESETS[name])}
+
+
+class Equalizer:
+    """Thread-safe front end to the alsaequal control device."""
+
+    def __init__(self, ctl=CTL_DEVICE, state_file=STATE_FILE):
+        self.ctl, self.state_file = ctl, state_file
+        self._doc = statestore.document(state_file)   # slider drags coalesce into one write
+        self.state = load_state(state_file)
+        self._applied = None            # gains currently in the controls file, as far as we know
+        self._names = None
+        self._proc = None
+        self._lock = threading.Lock()   # amixer pipe
+        self._gen = 0                   # newest set() wins; older fades stop
+
+    # ---- amixer ----
+    def _controls(self):
+        if self._names is None:
+            out = subprocess.run(["amixer", "-D", self.ctl, "scontrols"], capture_output=True,
+                                 text=True, timeout=5).stdout
+            names = [line.split("'")[1] for line in out.splitlines() if line.count("'") >= 2]
+            if len(names) != len(BANDS_HZ):
+                raise OSError(f"{self.ctl}: expected {len(BANDS_HZ)} EQ controls, found {len(names)}")
+            self._names = names
+        return self._names
+
+    def _write(self, gains):
+        lines = "".join(f"sset '{n}' {_raw(g)}\n" for n, g in zip(self._controls(), gains))
+        with self._lock:
+            for attempt in (0, 1):
+                if self._proc is None or self._proc.poll() is not None:
+                    self._proc = subprocess.Popen(["amixer", "-q", "-D", self.ctl, "-s"],
+                                                  stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                                  stderr=subprocess.DEVNULL, text=True)
+                try:
+                    self._proc.stdin.write(lines)
+                    self._proc.stdin.flush()
+                    break
+                except (BrokenPipeError, OSError):
+                    self._proc = None
+                    if attempt:
+                        raise
+        self._applied = list(gains)
+
+    def close(self):
+        self._doc.flush()
+        with self._lock:
+            if self._proc:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+                self._proc = None
+
+    # ---- curves ----
+    def set(self, gains=None, preset=None, fade=FADE_SEC):
+        """Glide to ``preset`` or a custom ``gains`` curve; returns at once.
+
+        Raises ValueError for an unknown preset or malformed curve.
+        """
+        if preset is not None:
+            if preset not in PRESETS:
+                raise ValueError(f"unknown preset {preset!r}")
+            gains = PRESETS[preset]
+        target = clamp_gains(gains)
+        self.state = {"preset": preset, "gains": target}
+        self._save()
+        self._gen += 1
+        start = self._applied or target
+        if fade <= 0 or start == target:
+            self._write(target)
+        else:
+            threading.Thread(target=self._fade, args=(self._gen, start, target, fade),
+                             name="eq-fade", daemon=True).start()
+        return self.state
+
+    def _fade(self, gen, start, target, fade):
+        for k in range(1, FADE_STEPS + 1):
+            if gen != self._gen:
+                return  # a newer curve took over from wherever we got to
+            f = k / FADE_STEPS
+            try:
+                self._write([a + (b - a) * f for a, b in zip(start, target)])
+            except (OSError, subprocess.SubprocessError) as e:
+                log.warning("eq: %s", e)
+                return
+            time.sleep(fade / FADE_STEPS)
+
+    def apply(self):
+        """Push the saved curve to the control device (boot, after a controls-file reset)."""
+        self._write(self.state["gains"])
+
+    def _save(self):
+        self._doc.update(self.state)
+
+    def info(self):
+        return {"bands_hz": list(BANDS_HZ), "presets": {k: list(v) for k, v in PRESETS.items()},
+                "limit_db": GAIN_LIMIT_DB, **self.state}
+
+
+def cpu_cost(seconds=10.0, pcm=PCM_DEVICE, plain="plughw:0,0"):
+    """CPU% of playing ``seconds`` of CD audio through ``pcm`` vs straight to ``plain``.
+
+    The EQ runs inside the playing process (for the radio: MPD), so the
+    difference between the two is what the EQ stage costs.
+    """
+    frames = int(seconds * 44100)
+    out = {}
+    for label, dev in (("eq", pcm), ("plain", plain)):
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        t0 = time.monotonic()
+        subprocess.run(["aplay", "-q", "-D", dev, "-t", "raw", "-f", "cd", "-s", str(frames),
+                        "/dev/zero"], check=True, stderr=subprocess.DEVNULL)
+        wall = time.monotonic() - t0
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        used = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+        out[label + "_cpu_pct"] = round(100.0 * used / wall, 1)
+    out["eq_cost_pct"] = round(out["eq_cpu_pct"] - out["plain_cpu_pct"], 1)
+    return out
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(prog="python3 -m radiolib.eq")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("apply", help="restore the saved curve (boot)")
+    s = sub.add_parser("set", help="glide to a preset")
+    s.add_argument("preset", choices=sorted(PRESETS))
+    c = sub.add_parser("cpu", help="measure the EQ stage's CPU cost (plays silence)")
+    c.add_argument("--seconds", type=float, default=10.0)
+    args = ap.parse_args(argv)
+    if args.cmd == "cpu":
+        print(json.dumps(cpu_cost(args.seconds)))
+        return
+    eq = Equalizer()
+    if args.cmd == "apply":
+        eq.apply()
+    else:
+        eq.set(preset=args.preset, fade=0)
+    eq.close()
+
+
+if __name__ == "__main__":
+    main()
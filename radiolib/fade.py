@@ -0,0 +1,115 @@
+"""Non-blocking, cancellable volume fades.
+
+A single :class:`Fader` thread owns all volume ramps. Ramps are
+time-based (the volume at time t is computed from the curve, so a slow
+round trip never stretches a fade) and a new :meth:`Fader.fade` cancels
+the one in progress and continues from wherever the volume got to. The
+optional ``then`` action only runs if the fade was not superseded -- so
+a quick amp off->on never pauses playback after the fade back up.
+"""
+import logging, threading, time
+
+from . import metrics
+
+FADE_SEC = 0.6
+FADE_HZ = 30          # max volume updates per second
+
+log = logging.getLogger(__name__)
+
+
+def linear(a, b, p):
+    return a + (b - a) * p
+
+
+def perceptual(a, b, p):
+    """Interpolate in a cube-root (roughly loudness-linear) domain."""
+    ca, cb = (a / 100.0) ** (1 / 3), (b / 100.0) ** (1 / 3)
+    return 100.0 * (ca + (cb - ca) * p) ** 3
+
+
+CURVES = {"linear": linear, "perceptual": perceptual}
+_DONE = metrics.counter("fades_total", "Volume fades by outcome.", result="done")
+_SUPERSEDED = metrics.counter("fades_total", "Volume fades by outcome.", result="superseded")
+_DURATION = metrics.histogram("fade_seconds", "Wall time of completed volume fades.",
+                              buckets=(.1, .25, .5, .6, .75, 1.0, 1.5, 2.5, 5.0))
+
+
+class Fader:
+    """Owns volume ramps. ``setvol(v)``/``getvol()`` talk to the mixer."""
+
+    def __init__(self, setvol, getvol, hz=FADE_HZ):
+        self.setvol, self.getvol = setvol, getvol
+        self.period = 1.0 / hz
+        self.current = None           # last volume we set
+        self._interrupted = False     # previous ramp was superseded mid-way
+        self.last_duration = None     # seconds the last completed fade took
+        self._job = None
+        self._cv = threading.Condition()
+        threading.Thread(target=self._loop, name="fader", daemon=True).start()
+
+    def fade(self, target, duration=FADE_SEC, curve="perceptual", before=None, then=None):
+        """Start ramping to ``target`` (0-100); returns immediately.
+
+        ``before`` runs on the fader thread before the ramp (e.g. "play"),
+        ``then`` after it completes, unless another fade replaced it.
+        """
+        job = {"target": max(0, min(100, int(target))), "duration": max(0.0, duration),
+               "curve": CURVES[curve], "before": before, "then": then}
+        with self._cv:
+            self._job = job
+            self._cv.notify()
+
+    def cancel(self):
+        with self._cv:
+            self._job = None
+            self._cv.notify()
+
+    def active_target(self):
+        """Target of the fade in progress, or None when idle."""
+        job = self._job
+        return job["target"] if job else None
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while self._job is None:
+                    self._cv.wait()
+                job = self._job
+            try:
+                self._run(job)
+            except Exception:
+                log.exception("fade to %s failed", job["target"])
+                with self._cv:
+                    if self._job is job:
+                        self._job = None
+
+    def _run(self, job):
+        if job["before"]:
+            job["before"]()
+        # Continue from where a superseded ramp stopped; otherwise ask the
+        # mixer, since someone else may have changed the volume meanwhile.
+        start = self.current if self._interrupted and self.current is not None else self.getvol()
+        self._interrupted = False
+        target, dur, curve = job["target"], job["duration"], job["curve"]
+        t0 = time.monotonic()
+        last = None
+        while True:
+            p = 1.0 if dur <= 0 else min(1.0, (time.monotonic() - t0) / dur)
+            v = int(round(curve(start, target, p)))
+            if v != last:
+                self.setvol(v)
+                self.current = last = v
+            with self._cv:
+                if self._job is not job:
+                    self._interrupted = True
+                    _SUPERSEDED.inc()
+                    return
+                if p >= 1.0:
+                    self._job = None
+                    break
+                self._cv.wait(self.period)
+        self.last_duration = time.monotonic() - t0
+        _DONE.inc()
+        _DURATION.observe(self.last_duration)
+        if job["then"]:
+            job["then"]()
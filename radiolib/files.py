@@ -0,0 +1,98 @@
+"""File responses for the web UI: conditional, ranged and zero-copy.
+
+:func:`send_path` lets Werkzeug work out ETag / Last-Modified, 304s and
+``Range`` / ``If-Range`` (206) exactly as ``send_file`` does, then -- when
+running under :mod:`radiolib.server` -- swaps the body for one that hands
+the byte range to ``sendfile(2)``, so a 10 MB MP3 is never copied through
+Python. :func:`send_static` adds precompressed ``.br`` / ``.gz`` variants
+and long-lived cache headers for bundled CSS/JS.
+"""
+import mimetypes, os
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+SOCKET_KEY = "radio.socket"           # set in the WSGI environ by radiolib.server
+STATIC_MAX_AGE = 365 * 24 * 3600      # versioned asset paths: cache for a year
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class SendfileBody:
+    """WSGI body that writes ``count`` bytes at ``offset`` with sendfile(2)."""
+
+    def __init__(self, path, offset, count, sock):
+        self.path, self.offset, self.count, self.sock = path, offset, count, sock
+
+    def __iter__(self):
+        yield b""  # makes the server send the status line and headers first
+        if self.count:
+            with open(self.path, "rb") as f:
+                self.sock.sendfile(f, self.offset, self.count)
+
+    def close(self):
+        pass
+
+
+class ClosingBody:
+    """WSGI body that calls ``on_close`` once the server has finished with it.
+
+    ``Response.call_on_close`` is skipped for passthrough file bodies, so
+    callbacks that must outlive the transfer go here instead.
+    """
+
+    def __init__(self, body, on_close):
+        self.body, self.on_close = body, on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.on_close()
+
+
+def resolve(root, name):
+    """``root/name`` if it is a regular file inside ``root``; 404 otherwise."""
+    path = safe_join(root, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return path
+
+
+def send_path(path, mimetype=None, as_attachment=False, download_name=None, max_age=None,
+              on_close=None):
+    """``send_file`` with sendfile(2); ``on_close()`` runs when the body has been sent."""
+    rv = send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                   download_name=download_name, conditional=True, etag=True, max_age=max_age)
+    sock = request.environ.get(SOCKET_KEY)
+    if sock is not None and request.method != "HEAD" and rv.status_code in (200, 206):
+        if rv.status_code == 206:
+            start, stop = rv.content_range.start, rv.content_range.stop
+        else:
+            start, stop = 0, os.path.getsize(path)
+        rv.response.close()
+        rv.response = SendfileBody(path, start, stop - start, sock)
+    if on_close is not None:
+        rv.response = ClosingBody(rv.response, on_close)
+    return rv
+
+
+def send_static(root, name, max_age=STATIC_MAX_AGE):
+    """Serve ``root/name``, preferring a precompressed sibling the client accepts."""
+    path = resolve(root, name)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    accepted = request.accept_encodings
+    for coding, ext in ENCODINGS:
+        if accepted[coding] and os.path.isfile(path + ext):
+            rv = send_path(path + ext, mimetype=mimetype, max_age=max_age)
+            rv.headers["Content-Encoding"] = coding
+            break
+    else:
+        rv = send_path(path, mimetype=mimetype, max_age=max_age)
+    rv.vary.add("Accept-Encoding")
+    rv.cache_control.public = True
+    rv.cache_control.immutable = True
+    return rv
@@ -0,0 +1,226 @@
+"""Upload-time transcoding to the DAC's native format.
+
+MPD opens the output at each track's own sample rate, so a 48 kHz or
+22.05 kHz MP3 is resampled in real time by ALSA's plug layer ahead of the
+EQ, on the Zero's one core -- and anything that is not an MP3 could not be
+uploaded at all. :class:`Ingest` converts such uploads once, when they
+arrive: FLAC, WAV, M4A and friends, and MP3s at the wrong rate, become
+MP3s at TARGET_RATE (the PCM5102A's rate), stereo, tags kept. MP3s
+already at TARGET_RATE skip the queue and are filed at once.
+
+Jobs run one at a time as ffmpeg processes at the lowest CPU and I/O
+priority, set before ffmpeg starts so its threads inherit it (see
+:func:`radiolib.loudness.idle_cpu`); they only use cycles playback
+leaves idle. Each source waits in its station folder
+as ``.ingest-<id>-<name>`` -- hidden from MPD and the catalog -- and is
+queued again after a restart. Progress comes from ffmpeg's ``-progress``
+output; :meth:`Ingest.jobs` lists queued, running and recently finished
+jobs for the web API.
+"""
+import collections, logging, os, secrets, shutil, subprocess, tempfile, threading, time
+
+from . import metrics
+from .catalog import is_station_id, probe_mp3
+from .loudness import idle_cpu
+
+INGEST_EXTS = (".mp3", ".flac", ".wav", ".m4a", ".aac", ".ogg", ".opus")
+TARGET_RATE = int(os.environ.get("RADIO_DAC_RATE", "44100"))
+LAME_QUALITY = "2"             # VBR, ~190 kbps
+PREFIX = ".ingest-"
+KEEP_FINISHED = 50             # finished jobs still listed
+PROBE_TIMEOUT = 30
+
+log = logging.getLogger(__name__)
+_JOBS = {s: metrics.counter("ingest_jobs_total", "Upload transcodes by outcome.", result=s)
+         for s in ("done", "failed", "cancelled")}
+_SECONDS = metrics.histogram("ingest_seconds", "Wall time of one upload transcode.",
+                             buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+
+
+def accepts(filename):
+    """True for an upload name the radio can take (directly or transcoded)."""
+    return not filename.startswith(".") and filename.lower().endswith(INGEST_EXTS)
+
+
+def needs_transcode(path, filename):
+    """Anything but an MP3 at TARGET_RATE (unparseable MP3s are left alone)."""
+    if not filename.lower().endswith(".mp3"):
+        return True
+    rate = probe_mp3(path)["rate"]
+    return rate is not None and rate != TARGET_RATE
+
+
+def duration(path):
+    """Length in seconds via ffprobe, or None."""
+    try:
+        out = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                              "-of", "default=nw=1:nk=1", path],
+                             capture_output=True, text=True, timeout=PROBE_TIMEOUT).stdout
+        return float(out.strip()) or None
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+class Ingest:
+    """Queue of upload transcodes, worked through by one background thread.
+
+    ``commit(path, station, filename)`` files a finished MP3 in the library
+    (consuming ``path``) and returns ``(name, how)``, like the web app's
+    ``commit_upload``.
+    """
+
+    def __init__(self, music_root, commit):
+        self.music_root, self.commit = music_root, commit
+        self.enabled = bool(shutil.which("ffmpeg"))
+        if not self.enabled:
+            log.warning("ffmpeg not found: only MP3 uploads accepted, none resampled")
+        self._cv = threading.Condition()
+        self._jobs = collections.OrderedDict()   # id -> job dict, oldest first
+        self._queue = collections.deque()
+        self._current = None                      # (job id, Popen) being transcoded
+        if self.enabled:
+            self.recover()
+            threading.Thread(target=self._loop, name="ingest", daemon=True).start()
+
+    # ---- queue ----
+    def _new_job(self, uid, station, filename, src):
+        job = {"id": uid, "station": station, "filename": filename, "state": "queued",
+               "progress": 0.0, "name": None, "stored": None, "error": None,
+               "created": time.time(), "finished": None, "_src": src}
+        self._jobs[uid] = job
+        self._queue.append(uid)
+        self._cv.notify()
+        return job
+
+    def submit(self, path, station, filename):
+        """Queue ``path`` (moved into the station folder) for transcoding; returns the job."""
+        uid = secrets.token_hex(6)
+        src = os.path.join(self.music_root, station, f"{PREFIX}{uid}-{os.path.basename(filename)}")
+        os.replace(path, src)
+        with self._cv:
+            return self._public(self._new_job(uid, station, filename, src))
+
+    def recover(self):
+        """Queue sources left behind by a restart; drop half-written outputs."""
+        for station in sorted(os.listdir(self.music_root)):
+            d = os.path.join(self.music_root, station)
+            if not (is_station_id(station) and os.path.isdir(d)):
+                continue
+            for fn in sorted(os.listdir(d)):
+                if not fn.startswith(PREFIX):
+                    continue
+                uid, sep, filename = fn[len(PREFIX):].partition("-")
+                if not sep:                       # ".ingest-<id>.out.mp3"
+                    _unlink(os.path.join(d, fn))
+                    continue
+                with self._cv:
+                    if uid not in self._jobs:
+                        self._new_job(uid, station, filename, os.path.join(d, fn))
+
+    def cancel(self, uid):
+        """Drop a queued job or stop a running one; False if it already finished."""
+        with self._cv:
+            job = self._jobs.get(uid)
+            if job is None or job["state"] not in ("queued", "running"):
+                return False
+            if job["state"] == "queued":
+                self._queue.remove(uid)
+                self._finish(job, "cancelled")
+                _unlink(job["_src"])
+                return True
+            if job.get("_committing"):          # already being filed: too late
+                return False
+            job["state"] = "cancelling"         # the worker checks this before filing
+            if self._current and self._current[0] == uid:
+                self._current[1].kill()
+            return True
+
+    # ---- listing ----
+    @staticmethod
+    def _public(job):
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def jobs(self, station=None):
+        with self._cv:
+            return [self._public(j) for j in self._jobs.values()
+                    if station is None or j["station"] == station]
+
+    def job(self, uid):
+        with self._cv:
+            j = self._jobs.get(uid)
+            return self._public(j) if j else None
+
+    def _finish(self, job, state, error=None):
+        job.update(state=state, error=error, finished=time.time())
+        _JOBS[state].inc()
+        done = [u for u, j in self._jobs.items() if j["finished"]]
+        for u in done[:max(0, len(done) - KEEP_FINISHED)]:
+            del self._jobs[u]
+
+    # ---- worker ----
+    def _loop(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._queue)
+                job = self._jobs[self._queue.popleft()]
+                job["state"] = "running"
+            t0 = time.monotonic()
+            out = os.path.join(os.path.dirname(job["_src"]), f"{PREFIX}{job['id']}.out.mp3")
+            try:
+                self._transcode(job, out)
+                with self._cv:
+                    if job["state"] == "cancelling":    # ffmpeg had finished when it came
+                        raise RuntimeError("cancelled")
+                    job["_committing"] = True
+                name, how = self.commit(out, job["station"], os.path.splitext(job["filename"])[0] + ".mp3")
+            except Exception as e:      # a bad file fails its job, never the queue
+                with self._cv:
+                    cancelled = job["state"] == "cancelling"
+                    self._finish(job, "cancelled" if cancelled else "failed", None if cancelled else str(e))
+                if not cancelled:
+                    log.warning("ingest %s/%s failed: %s", job["station"], job["filename"], e)
+                _unlink(out)
+                _unlink(job["_src"])
+                continue
+            _unlink(job["_src"])
+            _SECONDS.observe(time.monotonic() - t0)
+            with self._cv:
+                job.update(name=name, stored=how, progress=1.0)
+                self._finish(job, "done")
+            log.info("ingest %s/%s -> %s (%s)", job["station"], job["filename"], name, how)
+
+    def _transcode(self, job, out):
+        total = duration(job["_src"])
+        cmd = ["ionice", "-c", "3"] if shutil.which("ionice") else []
+        cmd += ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-threads", "1",
+               "-i", job["_src"], "-map", "0:a:0", "-map_metadata", "0",
+               "-ar", str(TARGET_RATE), "-ac", "2", "-c:a", "libmp3lame", "-q:a", LAME_QUALITY,
+               "-id3v2_version", "3", "-progress", "pipe:1", "-nostats", "-f", "mp3", out]
+        # stderr goes to a file: a damaged source logs an error per packet, which
+        # would fill a pipe nobody reads until stdout ends, and wedge the queue
+        with tempfile.TemporaryFile() as log_file:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log_file, text=True,
+                                    errors="replace", preexec_fn=idle_cpu)
+            with self._cv:
+                self._current = (job["id"], proc)
+            try:
+                for line in proc.stdout:
+                    key, _, value = line.strip().partition("=")
+                    if key == "out_time_us" and total and value.isdigit():
+                        job["progress"] = round(min(0.99, int(value) / 1e6 / total), 3)
+                if proc.wait() != 0:
+                    log_file.seek(max(0, log_file.seek(0, os.SEEK_END) - 4096))
+                    err = log_file.read().decode("utf-8", "replace").strip()
+                    raise RuntimeError(err.splitlines()[-1] if err else
+                                       f"ffmpeg exited with {proc.returncode}")
+            finally:
+                with self._cv:
+                    self._current = None
+                proc.stdout.close()
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,403 @@
+"""Library loudness analysis and ReplayGain tagging.
+
+Uploaded MP3s vary wildly in loudness while MPD's volume is pinned, so
+every track is measured once (EBU R128 integrated loudness and true peak,
+via ffmpeg's ``ebur128`` filter) and tagged with ReplayGain 2.0 values:
+track gain from its own loudness, album gain from its station's. MPD then
+levels playback itself once ``replay_gain_mode`` is on.
+
+The work runs in a small process pool at the lowest CPU and I/O priority
+(nice 19, SCHED_IDLE, ionice idle), so it never competes with playback.
+Results are cached in ``~/music/.loudness.db`` keyed by a BLAKE2 hash of
+the audio payload -- tags excluded -- so re-uploading (or moving) a track,
+and re-tagging it, never measures it again.
+
+Tags are ``TXXX:REPLAYGAIN_*`` frames in the file's ID3v2 tag, written
+to a copy that is renamed over the track (keeping its padding and mtime),
+so a crash never leaves a torn tag. A track hardlinked into several
+stations (see :meth:`~radiolib.catalog.Catalog.dedupe`) is left untagged:
+its stations disagree on album gain, and a copy would undo the link.
+Stations are only re-tagged when a file in them was added, changed or
+removed, so a rescan of an unchanged library costs a ``stat()`` per track.
+"""
+import logging, math, multiprocessing, os, re, shutil, sqlite3, subprocess, threading, time
+from concurrent.futures import ProcessPoolExecutor
+
+from .catalog import audio_hash, is_audio, is_station_id, probe_mp3
+from .mpd import MPDError
+
+DB_NAME = ".loudness.db"
+REFERENCE_LUFS = -18.0         # ReplayGain 2.0 reference level
+SILENT_LUFS = -70.0            # ebur128's floor: nothing to level
+ALBUM_RETAG_DB = 0.5           # album gain drift tolerated before re-tagging a station
+TAG_PADDING = 1024             # room left in new tags for later edits
+REPLAYGAIN_MODE = os.environ.get("RADIO_REPLAYGAIN_MODE", "auto")  # MPD: track in shuffle, album in order
+WORKERS = 1
+COPY_BUF = 256 * 1024
+FFMPEG_TIMEOUT = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loudness (
+    hash TEXT PRIMARY KEY, lufs REAL, peak REAL, duration REAL, ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, hash TEXT NOT NULL
+);
+"""
+
+log = logging.getLogger(__name__)
+
+
+# ------------------ worker side (runs in the pool) ------------------
+def idle_cpu(pid=0):
+    """Drop ``pid`` (0: the calling thread) to nice 19 and SCHED_IDLE.
+
+    Safe as a ``preexec_fn``: threads the child starts later inherit it.
+    """
+    os.setpriority(os.PRIO_PROCESS, pid, 19)
+    try:
+        os.sched_setscheduler(pid, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        pass
+
+
+def lowest_priority(pid=0):
+    """Drop ``pid`` (0: this process) to nice 19, SCHED_IDLE and idle I/O."""
+    idle_cpu(pid)
+    if shutil.which("ionice"):
+        subprocess.run(["ionice", "-c", "3", "-p", str(pid or os.getpid())],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _syncsafe(n):
+    return bytes(((n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F))
+
+
+def _unsyncsafe(b):
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+
+_SUMMARY_I = re.compile(r"^\s*I:\s+(-?[\d.]+|-inf) LUFS", re.M)
+_SUMMARY_PEAK = re.compile(r"^\s*Peak:\s+(-?[\d.]+|-inf) dBFS", re.M)
+
+
+def measure(path):
+    """``(integrated LUFS, true peak dBFS, duration)`` of one file via ffmpeg."""
+    out = subprocess.run(
+        ["ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-threads", "1", "-i", path,
+         "-map", "0:a:0", "-af", "ebur128=peak=true:framelog=quiet", "-f", "null", "-"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=FFMPEG_TIMEOUT,
+        text=True, errors="replace")
+    i, peak = _SUMMARY_I.findall(out.stderr), _SUMMARY_PEAK.findall(out.stderr)
+    if out.returncode or not i:
+        raise ValueError(f"ffmpeg: {out.stderr.strip().splitlines()[-1:] or out.returncode}")
+    lufs = max(float(i[-1]), SILENT_LUFS)
+    return lufs, (float(peak[-1]) if peak else None), probe_mp3(path)["duration"]
+
+
+def _walk(body, syncsafe):
+    """``[(id, flags, data)]`` if the frames fill ``body`` up to its padding exactly, else None."""
+    out, i = [], 0
+    while i + 10 <= len(body) and body[i] != 0:
+        fid = body[i:i + 4]
+        size = _unsyncsafe(body[i + 4:i + 8]) if syncsafe else int.from_bytes(body[i + 4:i + 8], "big")
+        if not (fid.isalnum() and fid.upper() == fid) or size <= 0 or i + 10 + size > len(body):
+            return None
+        out.append((fid, body[i + 8:i + 10], body[i + 10:i + 10 + size]))
+        i += 10 + size
+    return out if not any(body[i:]) else None
+
+
+def _frames(body, major):
+    """Split an ID3v2.3/2.4 tag body into ``[(id, flags, data)]``.
+
+    v2.4 frames written with plain big-endian sizes (as iTunes did) are
+    read that way when the syncsafe reading doesn't add up. A tag that
+    parses neither way raises ValueError: rewriting it from the frames
+    that did parse would drop the rest.
+    """
+    frames = _walk(body, major == 4)
+    if frames is None and major == 4:
+        frames = _walk(body, False)
+    if frames is None:
+        raise ValueError("ID3 frames don't parse; tag is not edited")
+    return frames
+
+
+def _txxx(data):
+    """``(DESCRIPTION, value)`` of a TXXX frame body."""
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(data[0], "latin-1")
+    text = data[1:].decode(codec, "replace")
+    desc, _, value = text.partition("\x00")
+    return desc.upper(), value.strip("\x00").strip()
+
+
+def write_tags(path, values, album_tolerance=ALBUM_RETAG_DB):
+    """Set ``TXXX:REPLAYGAIN_*`` to ``values``; returns the new ``(size, mtime)`` or None if unchanged.
+
+    Album gain within ``album_tolerance`` dB of the tagged value is left
+    alone, so one more upload doesn't rewrite a whole station.
+    """
+    st = os.stat(path)
+    with open(path, "rb") as f:
+        head = f.read(10)
+        if len(head) == 10 and head[:3] == b"ID3":
+            major, flags, room = head[3], head[5], _unsyncsafe(head[6:10])
+            if major not in (3, 4) or flags & 0xD0:  # v2.2 / unsynchronised / extended / footer
+                raise ValueError(f"ID3v2.{major} tag with flags {flags:#x} is not edited")
+            frames = _frames(f.read(room), major)
+        else:
+            major, room, frames = 4, 0, []
+    keep, have = [], {}
+    for fid, fflags, data in frames:
+        if fid == b"TXXX" and data:
+            desc, value = _txxx(data)
+            if desc.startswith("REPLAYGAIN_"):
+                have[desc] = value
+                continue
+        keep.append((fid, fflags, data))
+
+    def gain(v):
+        try:
+            return float(v.split()[0])
+        except (AttributeError, IndexError, ValueError):
+            return None
+    same = all(have.get(k) == v for k, v in values.items() if not k.startswith("REPLAYGAIN_ALBUM_"))
+    ag, had = gain(values.get("REPLAYGAIN_ALBUM_GAIN")), gain(have.get("REPLAYGAIN_ALBUM_GAIN"))
+    if same and set(have) == set(values) and (ag is None or (had is not None and abs(ag - had) <= album_tolerance)):
+        return None
+
+    def size(n):
+        return _syncsafe(n) if major == 4 else n.to_bytes(4, "big")
+    body = b"".join(fid + size(len(data)) + fflags + data for fid, fflags, data in keep)
+    for k, v in values.items():
+        data = b"\x00" + k.encode("latin-1") + b"\x00" + v.encode("latin-1")
+        body += b"TXXX" + size(len(data)) + b"\x00\x00" + data
+    # Always a new file renamed over the old one: a crash never leaves a torn
+    # tag, and a track deduplicated into several stations (hardlinks) is not
+    # retagged through all of them at once.
+    if st.st_nlink > 1:
+        raise ValueError("shared by several stations; not retagged")
+    pad = bytes(room - len(body) if room and len(body) <= room else TAG_PADDING)
+    tmp = f"{path}.rg-{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(path, "rb") as src, open(tmp, "wb") as dst:
+            dst.write(b"ID3" + bytes((major, 0, 0)) + _syncsafe(len(body) + len(pad)) + body + pad)
+            src.seek(10 + room if room else 0)
+            shutil.copyfileobj(src, dst, COPY_BUF)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.chmod(tmp, st.st_mode & 0o7777)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+# ------------------ gains ------------------
+def album_loudness(recs):
+    """Station loudness: duration-weighted energy mean of the tracks' loudness.
+
+    Close to (not exactly) R128 over the concatenated audio, which would
+    need every track decoded again whenever one is added.
+    """
+    recs = [r for r in recs if r["lufs"] > SILENT_LUFS]
+    if not recs:
+        return None
+    w = [r["duration"] or 1.0 for r in recs]
+    energy = sum(wi * 10 ** (r["lufs"] / 10) for wi, r in zip(w, recs)) / sum(w)
+    return 10 * math.log10(energy)
+
+
+def replaygain_values(rec, album_lufs, album_peak):
+    values = {"REPLAYGAIN_TRACK_GAIN": f"{REFERENCE_LUFS - rec['lufs']:+.2f} dB"}
+    if rec["peak"] is not None:
+        values["REPLAYGAIN_TRACK_PEAK"] = f"{10 ** (rec['peak'] / 20):.6f}"
+    if album_lufs is not None:
+        values["REPLAYGAIN_ALBUM_GAIN"] = f"{REFERENCE_LUFS - album_lufs:+.2f} dB"
+        if album_peak is not None:
+            values["REPLAYGAIN_ALBUM_PEAK"] = f"{10 ** (album_peak / 20):.6f}"
+    return values
+
+
+# ------------------ coordinator ------------------
+class LoudnessStore:
+    """Thread-safe SQLite cache: content hash -> loudness, path -> content hash."""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def hash_for(self, rel, st):
+        with self._lock:
+            r = self._db.execute("SELECT size, mtime, hash FROM files WHERE path=?", (rel,)).fetchone()
+        return r["hash"] if r and (r["size"], r["mtime"]) == (st.st_size, st.st_mtime) else None
+
+    def set_file(self, rel, size, mtime, h):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (rel, size, mtime, h))
+
+    def paths(self, station):
+        with self._lock:
+            rows = self._db.execute("SELECT path FROM files WHERE path LIKE ?", (station + "/%",)).fetchall()
+        return {r["path"] for r in rows}
+
+    def prune(self, station, keep):
+        with self._lock, self._db:
+            rows = self._db.execute("SELECT path FROM files WHERE path LIKE ?", (station + "/%",)).fetchall()
+            self._db.executemany("DELETE FROM files WHERE path=?",
+                                 [(r["path"],) for r in rows if r["path"] not in keep])
+
+    def get(self, h):
+        with self._lock:
+            r = self._db.execute("SELECT lufs, peak, duration FROM loudness WHERE hash=?", (h,)).fetchone()
+        return dict(r) if r else None
+
+    def put(self, h, lufs, peak, duration):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?)",
+                             (h, lufs, peak, duration, time.time()))
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM loudness").fetchone()[0]
+
+
+class Analyzer:
+    """Measures and tags stations in the background; :meth:`schedule` queues work.
+
+    ``pool`` (an MPDPool) gets ``replay_gain_mode`` switched on once any
+    track carries gain data.
+    """
+
+    def __init__(self, music_root, pool=None, workers=WORKERS, mode=REPLAYGAIN_MODE):
+        self.music_root = music_root
+        self.pool, self.workers, self.mode = pool, workers, mode
+        self.store = LoudnessStore(os.path.join(music_root, DB_NAME))
+        self.enabled = bool(shutil.which("ffmpeg"))
+        if not self.enabled:
+            log.warning("ffmpeg not found: loudness analysis disabled")
+        self._procs = None
+        self._cv = threading.Condition()
+        self._pending, self._all = set(), False
+        self.albums = {}                # station -> {"tracks", "lufs", "gain"}
+        self.counts = {"measured": 0, "cached": 0, "tagged": 0, "failed": 0}
+        self.busy = None
+        threading.Thread(target=self._loop, name="loudness", daemon=True).start()
+
+    def schedule(self, stations=None):
+        """Queue an iterable of stations, or the whole library (None)."""
+        with self._cv:
+            if stations is None:
+                self._all = True
+            else:
+                self._pending.update(stations)
+            self._cv.notify()
+
+    def _executor(self):
+        if self._procs is None:
+            # fork: the workers only hash files and run ffmpeg, and spawn
+            # would re-import the calling program's __main__
+            self._procs = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"),
+                                              initializer=lowest_priority)
+        return self._procs
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._pending or self._all)
+                if self._all:
+                    try:
+                        todo = {d for d in os.listdir(self.music_root) if is_station_id(d)}
+                    except OSError:
+                        todo = set()
+                    todo |= self._pending
+                else:
+                    todo = self._pending
+                self._pending, self._all = set(), False
+            if not self.enabled:
+                continue
+            for station in sorted(todo):
+                self.busy = station
+                try:
+                    self._station(station)
+                except Exception:
+                    log.exception("loudness: station %s failed", station)
+            self.busy = None
+            if self.pool and self.store.count():
+                try:
+                    self.pool.execute("replay_gain_mode", self.mode)
+                except (MPDError, OSError) as e:
+                    log.warning("loudness: setting replay_gain_mode failed: %s", e)
+
+    def _station(self, station):
+        d = os.path.join(self.music_root, station)
+        try:
+            names = sorted(n for n in os.listdir(d) if is_audio(n))
+        except OSError:
+            names = []
+        ex = self._executor()
+        known = self.store.paths(station)
+        changed = False                 # anything hashed or measured, or files gone
+        tracks = []                     # (rel, hash, rec, hardlinked)
+        for name in names:
+            rel, path = f"{station}/{name}", os.path.join(d, name)
+            try:
+                st = os.stat(path)
+                h = self.store.hash_for(rel, st)
+                if h is None:
+                    h = ex.submit(audio_hash, path).result()
+                    self.store.set_file(rel, st.st_size, st.st_mtime, h)
+                    changed = True
+                rec = self.store.get(h)
+                if rec is None:
+                    rec = dict(zip(("lufs", "peak", "duration"), ex.submit(measure, path).result()))
+                    self.store.put(h, rec["lufs"], rec["peak"], rec["duration"])
+                    self.counts["measured"] += 1
+                    changed = True
+                else:
+                    self.counts["cached"] += 1
+            except (OSError, ValueError, subprocess.SubprocessError) as e:
+                log.warning("loudness: %s: %s", rel, e)
+                self.counts["failed"] += 1
+                continue
+            tracks.append((rel, h, rec, st.st_nlink > 1))
+        keep = {t[0] for t in tracks}
+        changed = changed or bool(known - keep)
+        self.store.prune(station, keep)
+        album = album_loudness([t[2] for t in tracks])
+        peaks = [t[2]["peak"] for t in tracks if t[2]["peak"] is not None]
+        album_peak = max(peaks) if peaks else None
+        self.albums[station] = {"tracks": len(tracks),
+                                "lufs": None if album is None else round(album, 1),
+                                "gain": None if album is None else round(REFERENCE_LUFS - album, 2)}
+        if not changed:
+            return                      # every file as tagged last time: nothing to write
+        for rel, h, rec, shared in tracks:
+            if rec["lufs"] <= SILENT_LUFS or shared:
+                continue
+            values = replaygain_values(rec, album, album_peak)
+            try:
+                done = ex.submit(write_tags, os.path.join(self.music_root, rel), values).result()
+            except (OSError, ValueError) as e:
+                log.info("loudness: not tagging %s: %s", rel, e)
+                continue
+            if done:
+                self.store.set_file(rel, done[0], done[1], h)
+                self.counts["tagged"] += 1
+
+    def stats(self):
+        with self._cv:
+            pending = sorted(self._pending) + (["*"] if self._all else [])
+        return {"enabled": self.enabled, "mode": self.mode, "busy": self.busy, "pending": pending,
+                "analysed": self.store.count(), **self.counts, "stations": dict(self.albums)}
@@ -0,0 +1,299 @@
+"""Process metrics, a Prometheus exporter and an on-demand profiler.
+
+Code records into this module's registry through small handles --
+``counter(name, help, **labels).inc()``, ``gauge(...).set(v)``,
+``histogram(...).observe(seconds)`` -- which cost a lock and a dict update,
+so they can sit on hot paths (MPD round trips, OLED frames, encoder steps).
+
+Nothing is pushed on a timer. Each daemon calls :func:`serve` once: a
+thread blocks on ``BUS_DIR/<name>.metrics`` (a Unix stream socket) and
+answers one request line per connection -- ``metrics`` (a JSON snapshot)
+or ``profile SECONDS`` (folded stacks, sampled on a thread of their own;
+one at a time, ``busy`` otherwise). The web app's ``/metrics`` asks
+every daemon with :func:`collect`, adds a ``daemon`` label and renders it
+all in the Prometheus text format, so idle daemons only wake when scraped.
+
+:func:`profile` samples every thread's Python stack for a while and
+returns them folded (``thread;outer;inner count`` lines), ready for
+flamegraph.pl or speedscope.
+"""
+import json, logging, os, resource, socket, sys, threading, time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+from .bus import BUS_DIR, _ensure_dir
+
+SUFFIX = ".metrics"              # not .sock: bus.publish sends datagrams to those
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_HZ = 100
+PROFILE_MAX_SEC = 60.0
+COLLECT_TIMEOUT = 2.0
+PROFILE_BUSY = b"busy\n"         # reply while another profile of the daemon is running
+
+log = logging.getLogger(__name__)
+_lock = threading.Lock()
+_profiling = threading.Lock()    # held while a profile requested over the socket runs
+_families = {}                   # name -> {"type", "help", "buckets", "series": {labels: value}}
+
+
+def _family(name, kind, help, buckets=None):
+    with _lock:
+        fam = _families.get(name)
+        if fam is None:
+            fam = _families[name] = {"type": kind, "help": help, "buckets": buckets, "series": {}}
+        elif fam["type"] != kind:
+            raise ValueError(f"metric {name} is a {fam['type']}, not a {kind}")
+        return fam
+
+
+class _Handle:
+    __slots__ = ("_series", "_key")
+
+    def __init__(self, fam, labels, zero):
+        self._series, self._key = fam["series"], tuple(sorted(labels.items()))
+        with _lock:
+            self._series.setdefault(self._key, zero)
+
+
+class Counter(_Handle):
+    def inc(self, n=1):
+        with _lock:
+            self._series[self._key] += n
+
+
+class Gauge(_Handle):
+    def set(self, v):
+        with _lock:
+            self._series[self._key] = v
+
+    def inc(self, n=1):
+        with _lock:
+            self._series[self._key] += n
+
+
+class Histogram(_Handle):
+    __slots__ = ("_bounds",)
+
+    def __init__(self, fam, labels):
+        self._bounds = fam["buckets"]
+        super().__init__(fam, labels, None)
+        with _lock:
+            if self._series[self._key] is None:
+                self._series[self._key] = [0] * (len(self._bounds) + 1) + [0.0]  # buckets, +Inf, sum
+
+    def observe(self, v):
+        with _lock:
+            s = self._series[self._key]
+            for i, b in enumerate(self._bounds):
+                if v <= b:
+                    s[i] += 1
+                    break
+            else:
+                s[-2] += 1
+            s[-1] += v
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+
+def counter(name, help="", **labels):
+    return Counter(_family(name, "counter", help), labels, 0)
+
+
+def gauge(name, help="", **labels):
+    return Gauge(_family(name, "gauge", help), labels, 0)
+
+
+def histogram(name, help="", buckets=DEFAULT_BUCKETS, **labels):
+    return Histogram(_family(name, "histogram", help, tuple(buckets)), labels)
+
+
+# ------------------ snapshot & text format ------------------
+def _process_families():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        rss = ru.ru_maxrss * 1024
+    return [
+        {"name": "process_cpu_seconds_total", "type": "counter", "help": "User and system CPU time.",
+         "series": [[{}, ru.ru_utime + ru.ru_stime]]},
+        {"name": "process_resident_memory_bytes", "type": "gauge", "help": "Resident set size.",
+         "series": [[{}, rss]]},
+        {"name": "process_threads", "type": "gauge", "help": "Live Python threads.",
+         "series": [[{}, threading.active_count()]]},
+    ]
+
+
+def snapshot():
+    """This process's metrics as JSON-able families."""
+    with _lock:
+        fams = [{"name": n, "type": f["type"], "help": f["help"], "buckets": f["buckets"],
+                 "series": [[dict(k), list(v) if isinstance(v, list) else v]
+                            for k, v in f["series"].items()]}
+                for n, f in _families.items()]
+    return fams + _process_families()
+
+
+def _labels(d):
+    if not d:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in d.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(d, esc)) + "}"
+
+
+def _num(v):
+    return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render(groups):
+    """Prometheus text format for ``[(extra_labels, families), ...]``, merged by name."""
+    merged = {}
+    for extra, fams in groups:
+        for f in fams:
+            m = merged.setdefault(f["name"], dict(f, series=[]))
+            if m["type"] != f["type"]:
+                continue
+            m["series"] += [[dict(extra, **labels), v] for labels, v in f["series"]]
+    out = []
+    for name in sorted(merged):
+        f = merged[name]
+        out.append(f"# HELP {name} {f['help']}")
+        out.append(f"# TYPE {name} {f['type']}")
+        for labels, v in f["series"]:
+            if f["type"] != "histogram":
+                out.append(f"{name}{_labels(labels)} {_num(v)}")
+                continue
+            acc = 0
+            for b, n in zip(list(f["buckets"]) + [float("inf")], v[:-1]):
+                acc += n
+                out.append(f"{name}_bucket{_labels(dict(labels, le=_num(float(b))))} {acc}")
+            out.append(f"{name}_sum{_labels(labels)} {_num(v[-1])}")
+            out.append(f"{name}_count{_labels(labels)} {acc}")
+    return "\n".join(out) + "\n"
+
+
+# ------------------ profiler ------------------
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def profile(seconds=10.0, hz=PROFILE_HZ):
+    """Sample all threads' stacks for ``seconds``; return folded stacks."""
+    seconds = max(0.1, min(float(seconds), PROFILE_MAX_SEC))
+    me = threading.get_ident()
+    tally = _Tally()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            tally[";".join(reversed(stack))] += 1
+        time.sleep(1.0 / hz)
+    return "".join(f"{stack} {n}\n" for stack, n in tally.most_common())
+
+
+# ------------------ local socket ------------------
+def _path(name):
+    return os.path.join(BUS_DIR, name + SUFFIX)
+
+
+def _handle(conn):
+    with conn:
+        conn.settimeout(5)
+        line = conn.makefile("rb").readline().decode("utf-8", "replace").split()
+        if not line:
+            return
+        if line[0] == "metrics":
+            conn.sendall(json.dumps(snapshot()).encode("utf-8"))
+        elif line[0] == "profile":
+            # up to a minute of sampling: it gets its own thread, one at a
+            # time, so metrics scrapes keep being answered meanwhile
+            seconds = float(line[1]) if len(line) > 1 else 10.0
+            if not _profiling.acquire(blocking=False):
+                conn.sendall(PROFILE_BUSY)
+                return
+            threading.Thread(target=_profile_reply, args=(conn.dup(), seconds),
+                             name="profile", daemon=True).start()
+
+
+def _profile_reply(conn, seconds):
+    try:
+        with conn:
+            conn.settimeout(PROFILE_MAX_SEC + 5)
+            conn.sendall(profile(seconds).encode("utf-8"))
+    except OSError as e:
+        log.debug("profile request failed: %s", e)
+    finally:
+        _profiling.release()
+
+
+def serve(name):
+    """Answer metrics/profile requests for this daemon on a background thread."""
+    mode = _ensure_dir()
+    path = _path(name)
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, mode)
+    sock.listen(4)
+
+    def loop():
+        while True:
+            conn, _ = sock.accept()
+            try:
+                _handle(conn)
+            except (OSError, ValueError) as e:
+                log.debug("metrics request failed: %s", e)
+    threading.Thread(target=loop, name="metrics", daemon=True).start()
+    return sock
+
+
+def daemons():
+    try:
+        return sorted(fn[:-len(SUFFIX)] for fn in os.listdir(BUS_DIR) if fn.endswith(SUFFIX))
+    except OSError:
+        return []
+
+
+def ask(name, request, timeout=COLLECT_TIMEOUT):
+    """Send one request line to daemon ``name``; return the raw reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(_path(name))
+        s.sendall(request.encode("utf-8") + b"\n")
+        chunks = []
+        while True:
+            b = s.recv(65536)
+            if not b:
+                return b"".join(chunks)
+            chunks.append(b)
+
+
+def collect(own="web"):
+    """Every daemon's metrics plus this process's, as Prometheus text."""
+    groups = [({"daemon": own}, snapshot())]
+    for name in daemons():
+        try:
+            groups.append(({"daemon": name}, json.loads(ask(name, "metrics"))))
+        except (OSError, ValueError) as e:
+            log.debug("metrics from %s unavailable: %s", name, e)
+    up = [[{"daemon": labels["daemon"]}, 1] for labels, _ in groups]
+    groups.append(({}, [{"name": "radio_daemon_up", "type": "gauge", "help": "Daemons that answered.",
+                         "series": up}]))
+    return render(groups)
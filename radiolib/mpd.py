@@ -0,0 +1,377 @@
+"""Minimal MPD protocol client with persistent connections.
+
+Replaces forking ``mpc`` for every action: each program keeps a small
+pool of TCP (or Unix socket) connections to MPD, reconnects transparently
+when MPD restarts or drops an idle connection, and can pipeline several
+commands in one ``command_list_ok_begin``/``command_list_end`` exchange.
+:class:`AsyncMPDClient` is the same protocol for asyncio programs.
+"""
+import asyncio, os, socket, threading, time
+from contextlib import contextmanager
+
+from . import metrics
+
+DEFAULT_HOST = os.environ.get("MPD_HOST", "localhost")
+DEFAULT_PORT = int(os.environ.get("MPD_PORT", "6600"))
+DEFAULT_TIMEOUT = 5.0
+
+
+class MPDError(Exception):
+    """MPD answered a command with ``ACK [code@index] {command} message``."""
+
+    def __init__(self, line: str):
+        super().__init__(line)
+        self.code, self.index, self.command, self.message = None, None, None, line
+        try:
+            head, _, rest = line[len("ACK ["):].partition("] {")
+            code, _, index = head.partition("@")
+            self.code, self.index = int(code), int(index)
+            self.command, _, self.message = rest.partition("} ")
+        except ValueError:
+            pass
+
+
+def quote(arg) -> str:
+    s = str(arg).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{s}"'
+
+
+def format_command(cmd) -> str:
+    """``"play"`` or ``("add", "01")`` -> protocol line."""
+    if isinstance(cmd, str):
+        return cmd
+    name, *args = cmd
+    return " ".join([name] + [quote(a) for a in args])
+
+
+def _pair(line):
+    k, _, v = line.partition(": ")
+    return k, v
+
+
+def _record(commands, t0):
+    """Count each command; time the round trip by command (or ``command_list``)."""
+    names = [(c if isinstance(c, str) else c[0]).split(" ", 1)[0] for c in commands]
+    for n in names:
+        metrics.counter("mpd_commands_total", "MPD commands sent.", cmd=n).inc()
+    metrics.histogram("mpd_request_seconds", "MPD round-trip time.",
+                      cmd=names[0] if len(names) == 1 else "command_list").observe(time.perf_counter() - t0)
+
+
+def _list_lines(commands):
+    return ["command_list_ok_begin"] + [format_command(c) for c in commands] + ["command_list_end"]
+
+
+def to_dict(pairs):
+    """Collapse ``[(key, value), ...]`` into a dict (last value wins)."""
+    return {k: v for k, v in pairs}
+
+
+def to_dicts(pairs, start_key):
+    """Split a response into one dict per object, each starting at ``start_key``."""
+    out = []
+    for k, v in pairs:
+        if k == start_key or not out:
+            out.append({})
+        out[-1][k] = v
+    return out
+
+
+class MPDClient:
+    """One MPD connection. Not thread-safe on its own; use MPDPool to share."""
+
+    def __init__(self, host=None, port=None, timeout=DEFAULT_TIMEOUT):
+        self.host = host or DEFAULT_HOST
+        self.port = port or DEFAULT_PORT
+        self.timeout = timeout
+        self.version = None
+        self._sock = None
+        self._rfile = None
+        self._replied = False       # MPD answered the command in flight (so it may have run)
+
+    # ---- connection ----
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self):
+        self.close()
+        if self.host.startswith("/"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.host)
+        else:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock, self._rfile = sock, sock.makefile("rb")
+        self._replied = False
+        hello = self._readline()
+        if not hello.startswith("OK MPD "):
+            self.close()
+            raise ConnectionError(f"unexpected MPD greeting: {hello!r}")
+        self.version = hello[len("OK MPD "):]
+
+    def close(self):
+        for f in (self._rfile, self._sock):
+            try:
+                if f: f.close()
+            except OSError:
+                pass
+        self._sock = self._rfile = None
+
+    # ---- wire ----
+    def _send(self, lines):
+        self._replied = False
+        self._sock.sendall(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def _readline(self) -> str:
+        line = self._rfile.readline()
+        if not line:
+            raise ConnectionError("MPD closed the connection")
+        self._replied = True
+        return line.decode("utf-8", "replace").rstrip("\n")
+
+    def _read_pairs(self):
+        """Read one response up to OK/list_OK; raise MPDError on ACK."""
+        pairs = []
+        while True:
+            line = self._readline()
+            if line in ("OK", "list_OK"):
+                return pairs
+            if line.startswith("ACK "):
+                raise MPDError(line)
+            pairs.append(_pair(line))
+
+    def _with_retry(self, fn):
+        """Run ``fn`` once; on a dead socket reconnect and try exactly once more.
+
+        Only a connection that failed before MPD answered anything is
+        retried (MPD closes idle connections, and one it had closed never
+        ran the command). After a timeout or a partial reply the command
+        may have run, and sending it again could repeat an ``add`` or
+        ``save``, so the error is raised instead.
+        """
+        if not self.connected:
+            self.connect()
+        try:
+            return fn()
+        except OSError as e:  # includes ConnectionError / socket.timeout
+            self.close()
+            if isinstance(e, socket.timeout) or self._replied:
+                raise
+            self.connect()
+            return fn()
+
+    # ---- commands ----
+    def execute(self, cmd, *args):
+        """Run one command and return its ``(key, value)`` pairs."""
+        line = format_command((cmd,) + args if args else cmd)
+
+        def go():
+            self._send([line])
+            return self._read_pairs()
+        t0 = time.perf_counter()
+        try:
+            return self._with_retry(go)
+        finally:
+            _record([cmd], t0)
+
+    def command_list(self, commands):
+        """Pipeline ``commands`` in one round trip; return a list of pair-lists.
+
+        MPD aborts the list at the first failing command and raises MPDError
+        (its ``index`` names the failing entry); earlier commands took effect.
+        """
+        commands = list(commands)
+        if not commands:
+            return []
+        lines = _list_lines(commands)
+
+        def go():
+            self._send(lines)
+            results = [self._read_pairs() for _ in commands]
+            self._read_pairs()  # trailing OK
+            return results
+        t0 = time.perf_counter()
+        try:
+            return self._with_retry(go)
+        finally:
+            _record(commands, t0)
+
+    def idle(self, *subsystems):
+        """Block until one of ``subsystems`` changes; return the changed names.
+
+        MPD remembers events that happen between two idle calls on the same
+        connection, so a loop of idle() + re-read never misses a change.
+        """
+        line = format_command(("idle",) + subsystems if subsystems else "idle")
+
+        def go():
+            self._sock.settimeout(None)
+            try:
+                self._send([line])
+                return [v for k, v in self._read_pairs() if k == "changed"]
+            finally:
+                if self._sock:
+                    self._sock.settimeout(self.timeout)
+        return self._with_retry(go)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MPDPool:
+    """Thread-safe pool of persistent MPDClient connections."""
+
+    def __init__(self, host=None, port=None, size=2, timeout=DEFAULT_TIMEOUT):
+        self.host, self.port, self.timeout = host, port, timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def client(self):
+        self._slots.acquire()
+        with self._lock:
+            c = self._idle.pop() if self._idle else MPDClient(self.host, self.port, self.timeout)
+        try:
+            yield c
+        except OSError:
+            c.close()  # leave no half-read socket in the pool
+            raise
+        finally:
+            with self._lock:
+                self._idle.append(c)
+            self._slots.release()
+
+    def execute(self, cmd, *args):
+        with self.client() as c:
+            return c.execute(cmd, *args)
+
+    def command_list(self, commands):
+        with self.client() as c:
+            return c.command_list(commands)
+
+    def close(self):
+        with self._lock:
+            for c in self._idle:
+                c.close()
+
+
+class AsyncMPDClient:
+    """One MPD connection for an asyncio event loop.
+
+    Same calls as :class:`MPDClient` (as coroutines); requests are
+    serialized, so tasks can share one client.
+    """
+
+    def __init__(self, host=None, port=None, timeout=DEFAULT_TIMEOUT):
+        self.host = host or DEFAULT_HOST
+        self.port = port or DEFAULT_PORT
+        self.timeout = timeout
+        self.version = None
+        self._reader = self._writer = None
+        self._lock = None
+        self._replied = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def connect(self):
+        self.close()
+        if self.host.startswith("/"):
+            conn = asyncio.open_unix_connection(self.host)
+        else:
+            conn = asyncio.open_connection(self.host, self.port)
+        self._reader, self._writer = await asyncio.wait_for(conn, self.timeout)
+        sock = self._writer.get_extra_info("socket")
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        hello = await self._readline()
+        if not hello.startswith("OK MPD "):
+            self.close()
+            raise ConnectionError(f"unexpected MPD greeting: {hello!r}")
+        self.version = hello[len("OK MPD "):]
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _readline(self) -> str:
+        line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+        if not line:
+            raise ConnectionError("MPD closed the connection")
+        self._replied = True
+        return line.decode("utf-8", "replace").rstrip("\n")
+
+    async def _read_pairs(self):
+        pairs = []
+        while True:
+            line = await self._readline()
+            if line in ("OK", "list_OK"):
+                return pairs
+            if line.startswith("ACK "):
+                raise MPDError(line)
+            pairs.append(_pair(line))
+
+    async def _exchange(self, lines, responses):
+        """Send ``lines`` and read ``responses`` replies; reconnect once on a dead socket.
+
+        As with :meth:`MPDClient._with_retry`, only a connection that died
+        before MPD answered is retried, never a timeout.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if not self.connected:
+                        await self.connect()
+                    self._replied = False
+                    self._writer.write(("\n".join(lines) + "\n").encode("utf-8"))
+                    await self._writer.drain()
+                    return [await self._read_pairs() for _ in range(responses)]
+                except MPDError:
+                    if responses > 1:
+                        self.close()  # rest of a failed list is unread; start clean
+                    raise
+                except (OSError, asyncio.TimeoutError) as e:
+                    self.close()
+                    if attempt or isinstance(e, (socket.timeout, asyncio.TimeoutError)) or self._replied:
+                        raise
+
+    async def execute(self, cmd, *args):
+        line = format_command((cmd,) + args if args else cmd)
+        t0 = time.perf_counter()
+        try:
+            return (await self._exchange([line], 1))[0]
+        finally:
+            _record([cmd], t0)
+
+    async def idle(self, *subsystems):
+        """Wait, however long it takes, until one of ``subsystems`` changes.
+
+        Holds the connection meanwhile, so give idle a client of its own.
+        """
+        line = format_command(("idle",) + subsystems if subsystems else "idle")
+        timeout, self.timeout = self.timeout, None
+        try:
+            pairs = (await self._exchange([line], 1))[0]
+        finally:
+            self.timeout = timeout
+        return [v for k, v in pairs if k == "changed"]
+
+    async def command_list(self, commands):
+        commands = list(commands)
+        if not commands:
+            return []
+        t0 = time.perf_counter()
+        try:
+            return (await self._exchange(_list_lines(commands), len(commands) + 1))[:-1]
+        finally:
+            _record(commands, t0)
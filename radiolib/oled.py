@@ -0,0 +1,101 @@
+"""Dirty-region SSD1306 driver on top of a luma.oled device.
+
+luma's ``device.display(img)`` converts and pushes the whole 128x64 frame
+(1 KiB plus addressing) over I²C every time. :class:`FrameDisplay` keeps
+the last frame it sent in the controller's native page layout, skips
+identical frames entirely and, for changed frames, sends only the
+changed column span of each changed 8-pixel page.
+
+Frames are passed around pre-packed (see :func:`pack`), so callers can
+cache them and never re-render or re-convert an unchanged screen.
+"""
+import threading
+
+from . import metrics
+
+SET_COLUMN_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+_REVERSE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def pack(img):
+    """1-bit PIL image -> SSD1306 page-major bytes (LSB = top pixel of a page).
+
+    Transposing turns each display column into a row whose packed bytes
+    are the column's pages, MSB first; bit-reverse those and regroup by
+    page. All of it runs in C.
+    """
+    w, h = img.size
+    pages = h // 8
+    cols = img.transpose(5).tobytes().translate(_REVERSE)  # 5 == Image.TRANSPOSE
+    return b"".join(cols[p::pages] for p in range(pages))
+
+
+def _span(a, b):
+    """First and last differing index of two equal-length byte strings."""
+    lo = 0
+    while a[lo] == b[lo]:
+        lo += 1
+    hi = len(a) - 1
+    while a[hi] == b[hi]:
+        hi -= 1
+    return lo, hi
+
+
+_SENT = metrics.counter("oled_frames_total", "Frames handed to the display.", result="sent")
+_SKIPPED = metrics.counter("oled_frames_total", "Frames handed to the display.", result="skipped")
+_I2C_BYTES = metrics.counter("oled_i2c_bytes_total", "Addressing and pixel bytes written over I2C.")
+
+
+class FrameDisplay:
+    """Thread-safe wrapper that only sends what changed on the panel."""
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.width, self.height = dev.width, dev.height
+        self.pages = self.height // 8
+        self._col0 = getattr(dev, "_colstart", 0)
+        self._last = None
+        self._lock = threading.Lock()
+        self.frames_sent = self.frames_skipped = self.bytes_sent = 0
+
+    def invalidate(self):
+        """Forget what is on the panel; the next frame is sent in full."""
+        with self._lock:
+            self._last = None
+
+    def show(self, frame: bytes):
+        """Display a frame produced by :func:`pack`."""
+        w = self.width
+        with self._lock:
+            last = self._last
+            if frame == last:
+                self.frames_skipped += 1
+                _SKIPPED.inc()
+                return
+            sent = 0
+            for p in range(self.pages):
+                new = frame[p * w:(p + 1) * w]
+                if last is None:
+                    lo, hi = 0, w - 1
+                else:
+                    old = last[p * w:(p + 1) * w]
+                    if new == old:
+                        continue
+                    lo, hi = _span(new, old)
+                self.dev.command(SET_COLUMN_ADDR, self._col0 + lo, self._col0 + hi,
+                                 SET_PAGE_ADDR, p, p)
+                self.dev.data(list(new[lo:hi + 1]))
+                sent += 6 + hi - lo + 1
+            self._last = frame
+            self.bytes_sent += sent
+            self.frames_sent += 1
+        _SENT.inc()
+        _I2C_BYTES.inc(sent)
+
+    def show_image(self, img):
+        self.show(pack(img))
+
+    def clear(self):
+        self.show(bytes(self.width * self.pages))
@@ -0,0 +1,148 @@
+"""Production HTTP serving for the Flask apps.
+
+``app.run()`` is Werkzeug's development server: one request at a time
+unless told otherwise, and one new thread per connection when it is.
+:func:`serve` keeps Werkzeug's request handling (so uploads still stream
+straight to disk) but runs requests on a fixed-size thread pool behind a
+bounded wait queue (503 beyond it), closes connections after each
+response so an idle browser can't pin a worker, drops per-request access
+logging and exposes the client socket so file downloads can use
+sendfile(2) (see :mod:`radiolib.files`).
+:class:`Gate` caps how many requests of one kind (uploads, event streams, downloads) may hold workers at once,
+so long transfers can never starve status and control requests.
+"""
+import logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+DEFAULT_THREADS = 8
+DEFAULT_BACKLOG = 64
+DEFAULT_QUEUE = 32        # accepted connections waiting for a worker before we answer 503
+BUSY_RESPONSE = (b"HTTP/1.0 503 Service Unavailable\r\nRetry-After: 2\r\n"
+                 b"Content-Type: text/plain\r\nContent-Length: 5\r\nConnection: close\r\n\r\nbusy\n")
+SOCKET_TIMEOUT = 60       # seconds a client may stall mid-request
+
+log = logging.getLogger(__name__)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.0"   # one request per connection
+    timeout = SOCKET_TIMEOUT
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ["radio.socket"] = self.connection  # lets radiolib.files use sendfile(2)
+        return environ
+
+    def log_request(self, code="-", size="-"):
+        if isinstance(code, int) and code >= 500:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server dispatching connections to a bounded thread pool.
+
+    At most ``threads + queue`` accepted connections are held; beyond
+    that a connection gets an immediate 503 instead of waiting in memory,
+    so overload shows up at the client rather than as a growing queue.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=DEFAULT_THREADS, backlog=DEFAULT_BACKLOG,
+                 queue=DEFAULT_QUEUE):
+        self.request_queue_size = backlog
+        super().__init__(host, port, app, handler=QuietRequestHandler)
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        self._slots = threading.BoundedSemaphore(threads + queue)
+        self.rejected = 0
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            self._refuse(request)
+            return
+        try:
+            self.pool.submit(self._process, request, client_address)
+        except RuntimeError:            # pool shut down
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _refuse(self, request):
+        try:
+            request.settimeout(0.5)     # runs on the accept thread: never block it for long
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        pool = getattr(self, "pool", None)
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def serve(app, host, port, threads=DEFAULT_THREADS, backlog=DEFAULT_BACKLOG, queue=DEFAULT_QUEUE):
+    """Serve a WSGI app until interrupted."""
+    srv = PooledWSGIServer(host, port, app, threads=threads, backlog=backlog, queue=queue)
+    log.info("serving on %s:%s with %d threads", host, srv.port, threads)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+
+
+class Gate:
+    """Non-blocking admission limit for one class of requests.
+
+    Use as a decorator on a Flask view; when ``limit`` requests are
+    already inside, further ones get 503 + Retry-After immediately
+    instead of queueing behind them.
+    """
+
+    def __init__(self, name, limit, retry_after=2):
+        self.name, self.limit, self.retry_after = name, limit, retry_after
+        self._sem = threading.BoundedSemaphore(limit)
+        self.rejected = 0
+
+    def acquire(self):
+        if self._sem.acquire(blocking=False):
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self):
+        self._sem.release()
+
+    def busy(self):
+        from flask import jsonify
+        resp = jsonify({"ok": False, "error": f"too many concurrent {self.name}"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(self.retry_after)
+        return resp
+
+    def __call__(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.acquire():
+                return self.busy()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                self.release()
+        return wrapper
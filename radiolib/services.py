@@ -0,0 +1,117 @@
+"""Cached, batched systemd unit status.
+
+All allow-listed units are queried with a single unprivileged
+``systemctl show -p ... unit1 unit2 ...`` call and kept in a TTL cache.
+Restarts invalidate the cache explicitly; when python3-dbus and
+python3-gi are available the cache also listens for systemd's
+PropertiesChanged signals and refreshes as soon as a unit changes, so the
+TTL becomes a backstop rather than the refresh rate.
+"""
+import logging, subprocess, threading, time
+
+from . import metrics
+
+PROPERTIES = ("ActiveState", "UnitFileState", "ActiveEnterTimestamp")
+TTL_POLLING = 5.0     # seconds, when no D-Bus signals are available
+TTL_SIGNALS = 60.0    # seconds, when PropertiesChanged keeps us fresh
+
+log = logging.getLogger(__name__)
+
+
+def unit_name(name: str) -> str:
+    return name if "." in name else name + ".service"
+
+
+def unit_object_path(name: str) -> str:
+    """systemd's bus path for a unit (``ssh.service`` -> ``.../ssh_2eservice``)."""
+    out = []
+    for i, ch in enumerate(unit_name(name)):
+        if ch.isascii() and (ch.isalpha() or (ch.isdigit() and i > 0)):
+            out.append(ch)
+        else:
+            out.append("_%02x" % ord(ch))
+    return "/org/freedesktop/systemd1/unit/" + "".join(out)
+
+
+def query(names, timeout=10):
+    """One ``systemctl show`` for every unit; returns ``{name: status}``."""
+    cmd = ["systemctl", "show", "-p", ",".join(PROPERTIES), "--"] + [unit_name(n) for n in names]
+    try:
+        with metrics.histogram("subprocess_seconds", "Child processes run, by program.", cmd="systemctl").time():
+            out = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        log.warning("systemctl show failed: %s", e)
+        out = ""
+    blocks = out.strip("\n").split("\n\n") if out.strip() else []
+    result = {}
+    for i, name in enumerate(names):
+        props = {}
+        if i < len(blocks):
+            for line in blocks[i].splitlines():
+                k, _, v = line.partition("=")
+                props[k] = v
+        result[name] = {
+            "name": name,
+            "active": props.get("ActiveState") == "active",
+            "enabled": props.get("UnitFileState") == "enabled",
+            "since": props.get("ActiveEnterTimestamp") or None,
+        }
+    return result
+
+
+class ServiceStatusCache:
+    """TTL cache over :func:`query`, optionally kept fresh by D-Bus signals.
+
+    ``executor`` (e.g. the web app's child-process pool) runs the
+    ``systemctl`` call, so it counts against that pool's limit.
+    """
+
+    def __init__(self, names, ttl=None, executor=None):
+        self.names = list(names)
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._data, self._at = {}, 0.0
+        self.signals = self._subscribe()
+        self.ttl = ttl if ttl is not None else (TTL_SIGNALS if self.signals else TTL_POLLING)
+
+    def invalidate(self):
+        self._at = 0.0
+
+    def get_all(self):
+        with self._lock:
+            if time.monotonic() - self._at > self.ttl:
+                if self.executor is not None:
+                    self._data = self.executor.submit(query, self.names).result()
+                else:
+                    self._data = query(self.names)
+                self._at = time.monotonic()
+            return [self._data[n] for n in self.names]
+
+    def get(self, name):
+        return next(s for s in self.get_all() if s["name"] == name)
+
+    # ---- optional D-Bus push ----
+    def _subscribe(self):
+        try:
+            import dbus
+            from dbus.mainloop.glib import DBusGMainLoop
+            from gi.repository import GLib
+        except ImportError:
+            return False
+        try:
+            bus = dbus.SystemBus(mainloop=DBusGMainLoop())
+            mgr = bus.get_object("org.freedesktop.systemd1", "/org/freedesktop/systemd1")
+            dbus.Interface(mgr, "org.freedesktop.systemd1.Manager").Subscribe()
+            paths = {unit_object_path(n) for n in self.names}
+
+            def changed(interface, props, _invalidated, path=None):
+                if path in paths and interface == "org.freedesktop.systemd1.Unit":
+                    self.invalidate()
+            bus.add_signal_receiver(changed, signal_name="PropertiesChanged",
+                                    dbus_interface="org.freedesktop.DBus.Properties",
+                                    bus_name="org.freedesktop.systemd1", path_keyword="path")
+        except dbus.DBusException as e:
+            log.warning("systemd D-Bus subscribe failed, polling only: %s", e)
+            return False
+        threading.Thread(target=GLib.MainLoop().run, name="systemd-signals", daemon=True).start()
+        return True
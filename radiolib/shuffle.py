@@ -0,0 +1,194 @@
+"""History-aware shuffle for a rolling MPD queue.
+
+MPD's own ``random`` mode draws each next track independently -- recent
+tracks come round again -- and forgets everything when the queue is
+rebuilt, i.e. on every station switch. Loading a whole folder to shuffle
+also makes every switch cost O(station size) in MPD.
+
+:class:`Shuffler` decides the order instead. Each station keeps its recent
+play history and the tracks it had queued next in SHUFFLE_FILE (a shared
+:class:`radiolib.state.Document`), so both survive switches and reboots.
+A new pick is a random track that
+
+* has not played within the last ``HISTORY_FRACTION`` of the station
+  (at most HISTORY_MAX tracks), and
+* does not share an artist with the last ARTIST_GAP tracks, while there
+  is any choice left.
+
+Picks are random draws tested against those rules, falling back to a
+scan of the folder only when the draws keep failing, so topping up the
+queue costs O(window), not O(station). :class:`radiolib.switch.StationSwitcher`
+gives MPD WINDOW tracks at a time in ``consume`` mode and tops the queue
+up as it drains.
+"""
+import contextlib, fcntl, logging, os, random, threading
+
+from . import state
+from .catalog import is_audio
+
+SHUFFLE_FILE = os.path.join(os.path.expanduser("~"), ".station_shuffle.json")
+WINDOW = 6                 # tracks given to MPD at a time
+LOW_WATER = 2              # top up when fewer than this follow the current track
+HISTORY_FRACTION = 0.5     # a track waits for this share of its station before replaying
+HISTORY_MAX = 500
+ARTIST_GAP = 3             # recent tracks whose artists are avoided
+SAMPLE_TRIES = 24          # random draws before scanning the whole folder
+
+log = logging.getLogger(__name__)
+
+
+class Shuffler:
+    """Per-station play history and upcoming order. Thread-safe.
+
+    ``catalog`` (a :class:`radiolib.catalog.Catalog`) supplies artists for
+    spacing; without one, only history is considered.
+    """
+
+    def __init__(self, music_root, catalog=None, path=SHUFFLE_FILE):
+        self.music_root, self.catalog = music_root, catalog
+        self._doc = state.document(path)
+        self._lock_path = path + ".lock"
+        self._lock_fd = None
+        self._lock = threading.Lock()
+        self._lists = {}           # folder -> (mtime, names, {name: artist})
+
+    # ---- station contents ----
+    def _tracks(self, folder):
+        d = os.path.join(self.music_root, folder)
+        try:
+            mtime = os.stat(d).st_mtime
+        except OSError:
+            return [], {}
+        with self._lock:
+            cached = self._lists.get(folder)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        try:
+            names = sorted(n for n in os.listdir(d) if is_audio(n))
+        except OSError:
+            names = []
+        artists = {}
+        if self.catalog is not None:
+            try:
+                artists = {t["name"]: (t["artist"] or "").casefold() or None
+                           for t in self.catalog.tracks(folder)}
+            except Exception as e:      # spacing is a nicety; never fail a switch over it
+                log.debug("shuffle: no artists for %s: %s", folder, e)
+        with self._lock:
+            self._lists[folder] = (mtime, names, artists)
+        return names, artists
+
+    def _record(self, folder):
+        rec = self._doc.get(folder) or {}
+        return list(rec.get("history", [])), list(rec.get("queue", []))
+
+    # ---- order ----
+    def upcoming(self, folder):
+        """The files (``NN/name``) the station had queued next, still on disk."""
+        return [f"{folder}/{n}" for n in self._record(folder)[1]
+                if os.path.isfile(os.path.join(self.music_root, folder, n))]
+
+    def pick(self, folder, count, exclude=()):
+        """``count`` new files for ``folder``, not among ``exclude`` or the recent history."""
+        names, artists = self._tracks(folder)
+        if not names:
+            return []
+        history = self._record(folder)[0]
+        keep = min(HISTORY_MAX, int(len(names) * HISTORY_FRACTION))
+        excluded = [f.split("/", 1)[-1] for f in exclude]
+        taken, order = set(excluded), history + excluded
+        recent = set(history[-keep:]) if keep else set()
+        out = []
+        for _ in range(count):
+            spaced = {artists.get(n) for n in order[-ARTIST_GAP:]} - {None}
+            rules = (lambda n: n not in taken and n not in recent and artists.get(n) not in spaced,
+                     lambda n: n not in taken and n not in recent,
+                     lambda n: n not in taken)
+            choice = None
+            for ok in rules:
+                for _ in range(SAMPLE_TRIES):
+                    n = random.choice(names)
+                    if ok(n):
+                        choice = n
+                        break
+                else:
+                    pool = [n for n in names if ok(n)]
+                    choice = random.choice(pool) if pool else None
+                if choice:
+                    break
+            if choice is None:          # the window is bigger than the station
+                choice = random.choice(names)
+            taken.add(choice)
+            order.append(choice)
+            out.append(f"{folder}/{choice}")
+        return out
+
+    def _edit(self, folder, fn):
+        """Apply ``fn(history, queue) -> (history, queue)`` to the station's newest record.
+
+        Goes straight to disk under the document's flock: the web app and
+        the knob daemon both record plays, and neither may work from a copy
+        the other has since changed.
+        """
+        def change(rec):
+            rec = rec or {}
+            history, queue = fn(list(rec.get("history", [])), list(rec.get("queue", [])))
+            return {"history": history, "queue": queue}
+        self._doc.edit(folder, change)
+
+    def keep(self, folder, files):
+        """Remember what the station has queued after the current track."""
+        names = [f.split("/", 1)[-1] for f in files if f.startswith(folder + "/")]
+        self._edit(folder, lambda history, queue: (history, names))
+
+    def played(self, file):
+        """Add ``file`` (``NN/name``) to its station's history."""
+        folder, _, name = file.partition("/")
+        if not name:
+            return
+
+        def add(history, queue):
+            if not history or history[-1] != name:
+                history = (history + [name])[-HISTORY_MAX:]
+            return history, [n for n in queue if n != name]
+        self._edit(folder, add)
+
+    def back(self, folder):
+        """Step the history back over the current track; returns the one before it, or None.
+
+        Both leave the history: the previous track is recorded again when
+        it starts playing.
+        """
+        found = []
+
+        def step(history, queue):
+            if len(history) < 2:
+                return history, queue
+            found.append(history[-2])
+            return history[:-2], queue
+        self._edit(folder, step)
+        return f"{folder}/{found[0]}" if found else None
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Yield True if no other process is topping up a queue right now.
+
+        The web app and the knob daemon both react to the same MPD events;
+        whoever gets here second skips, instead of adding a second set of picks.
+        """
+        try:
+            if self._lock_fd is None:
+                self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def forget(self, folder):
+        with self._lock:
+            self._lists.pop(folder, None)
+        self._doc.remove(folder)
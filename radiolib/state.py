@@ -0,0 +1,222 @@
+"""Small JSON state files, cached in memory and written in batches.
+
+The web app and both daemons share a handful of tiny documents: station
+names (``~/music/stations.json``), the radio's runtime state
+(``~/.radio_state.json``: current station, the volume the amp monitor
+will restore), resume positions and the EQ curve. :class:`Document` keeps
+one parsed copy per process and re-reads the file only when its mtime or
+size changes, so a read is one ``stat()`` rather than open + parse.
+
+Writes land in memory at once and reach the SD card ``delay`` seconds
+later (atomic: temp file, fsync, rename), so a burst of changes -- a
+spun knob, a dragged EQ slider -- costs one write. Pending keys are laid
+over the newest on-disk copy when flushed, so processes writing
+different keys never undo each other. Everything pending is flushed at
+interpreter exit; daemons turn SIGTERM into a normal exit for that.
+Changes made by other processes are announced on the bus
+(:mod:`radiolib.bus`); this module only makes re-reading them cheap.
+"""
+import atexit, fcntl, json, logging, os, threading
+
+HOME = os.path.expanduser("~")
+NAMES_FILE = os.path.join(HOME, "music", "stations.json")
+RADIO_FILE = os.path.join(HOME, ".radio_state.json")
+WRITE_DELAY = 2.0          # seconds a change may wait in memory before it is written
+
+log = logging.getLogger(__name__)
+_DELETED = object()
+_docs = {}
+_docs_lock = threading.Lock()
+
+
+class Document:
+    """One JSON object on disk, mirrored in memory. Thread-safe."""
+
+    def __init__(self, path, delay=WRITE_DELAY, indent=None):
+        self.path, self.delay, self.indent = path, delay, indent
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()    # held across a flush's disk I/O
+        self._data, self._sig = {}, None
+        self._pending = {}                 # key -> value or _DELETED, not yet on disk
+        self._timer = None
+        self.writes = 0
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return None
+
+    def _load(self):
+        """The file as it is on disk ({} if missing or unreadable)."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("%s unreadable, ignoring: %s", self.path, e)
+            return {}
+
+    @staticmethod
+    def _apply(data, changes):
+        for k, v in changes.items():
+            if v is _DELETED:
+                data.pop(k, None)
+            else:
+                data[k] = v
+        return data
+
+    def _refresh(self):
+        sig = self._signature()
+        if sig == self._sig:
+            return
+        data = self._load() if sig is not None else {}
+        self._data, self._sig = self._apply(data, self._pending), sig
+
+    # ---- reading ----
+    def data(self):
+        """A shallow copy of the whole document."""
+        with self._lock:
+            self._refresh()
+            return dict(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._refresh()
+            return self._data.get(key, default)
+
+    # ---- writing ----
+    def update(self, changes=None, **kw):
+        """Set keys; returns at once (written now when ``delay`` is 0).
+
+        Raises TypeError/ValueError for values JSON can't store.
+        """
+        self._change(dict(changes or {}, **kw))
+
+    def remove(self, *keys):
+        with self._lock:
+            self._refresh()
+            keys = [k for k in keys if k in self._data]
+        if keys:
+            self._change({k: _DELETED for k in keys})
+
+    def replace(self, data):
+        """Make the document exactly ``data``."""
+        with self._lock:
+            self._refresh()
+            stale = {k: _DELETED for k in self._data if k not in data}
+        self._change(dict(stale, **data))
+
+    def _change(self, changes):
+        # refuse what JSON can't hold here, where the caller sees it, rather
+        # than leave it pending (and every later change with it) forever
+        json.dumps({k: v for k, v in changes.items() if v is not _DELETED})
+        with self._lock:
+            self._refresh()
+            self._apply(self._data, changes)
+            self._pending.update(changes)
+            if self.delay > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Write pending changes now, merged over the current file.
+
+        Readers and writers only wait for ``_lock`` while the pending keys
+        are copied out and again while they are retired; the merge, fsync
+        and rename run under ``_write_lock`` (one flush per process) and a
+        flock on the folder (one per machine). Keys changed again during
+        the write stay pending for the next flush.
+        """
+        self._write()
+
+    def edit(self, key, fn):
+        """Change one key starting from its newest value, atomically across processes.
+
+        ``fn`` gets the key's value as the file has it (with this process's
+        pending changes laid over; None if missing) and returns the new one.
+        Unlike :meth:`update` this is written at once, under the same flock,
+        so processes editing the same key never start from a stale copy.
+        """
+        self._write(key, fn)
+
+    def _write(self, key=None, fn=None):
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._pending and fn is None:
+                    return
+                batch = dict(self._pending)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            folder = os.path.dirname(self.path) or "."
+            try:
+                os.makedirs(folder, exist_ok=True)
+                dfd = os.open(folder, os.O_RDONLY)
+            except OSError as e:
+                log.warning("saving %s failed: %s", self.path, e)
+                return
+            try:
+                fcntl.flock(dfd, fcntl.LOCK_EX)  # read-merge-write is atomic across processes
+                data = self._apply(self._load(), batch)
+                if fn is not None:
+                    old = data.get(key)
+                    new = fn(old)
+                    if new == old and not batch:
+                        return
+                    data[key] = new
+                try:
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(data, f, ensure_ascii=False, indent=self.indent)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, self.path)
+                except (OSError, TypeError, ValueError) as e:
+                    log.warning("saving %s failed: %s", self.path, e)
+                    try:
+                        os.unlink(tmp)
+                    except OSError:
+                        pass
+                    return                      # still pending: the next flush tries again
+                with self._lock:
+                    for k, v in batch.items():
+                        if self._pending.get(k, batch) is v:
+                            del self._pending[k]
+                    self._data = self._apply(data, self._pending)
+                    self._sig = self._signature()
+                    self.writes += 1
+            except OSError as e:
+                log.warning("saving %s failed: %s", self.path, e)
+            finally:
+                os.close(dfd)
+
+
+def document(path, delay=WRITE_DELAY, indent=None):
+    """The process-wide :class:`Document` for ``path`` (created on first use)."""
+    path = os.path.abspath(path)
+    with _docs_lock:
+        doc = _docs.get(path)
+        if doc is None:
+            doc = _docs[path] = Document(path, delay, indent)
+        return doc
+
+
+def station_names(doc):
+    """``{"01": "Jazz", ...}`` from a names document, ignoring stray keys."""
+    return {k: v for k, v in doc.data().items() if len(k) == 2 and k.isdigit()}
+
+
+@atexit.register
+def flush_all():
+    with _docs_lock:
+        docs = list(_docs.values())
+    for doc in docs:
+        doc.flush()
@@ -0,0 +1,394 @@
+"""Internet-stream stations through a local ring-buffer relay.
+
+A station is either a music folder or, when ``stations.json`` has an
+entry for it under ``"streams"``, an HTTP/Icecast stream::
+
+    {"01": "Classics", "06": "Radio Paradise",
+     "streams": {"06": "http://stream.radioparadise.com/mp3-128"}}
+
+MPD never talks to the internet station itself: it plays
+``http://127.0.0.1:PROXY_PORT/stream/NN`` from :class:`Proxy` (the
+``radio-stream`` service). For each station being listened to, a
+:class:`Relay` thread keeps one upstream connection open and writes what
+arrives into a bounded in-memory :class:`Ring`. When the connection
+drops or stalls, the relay reconnects with exponential backoff and
+jitter (held to a couple of seconds while anyone is listening). A listener starts LEAD_SEC behind the newest data, so it always
+has that much audio in hand, and a Wi-Fi hiccup shorter than the lead is
+never heard. Relays stay connected LINGER_SEC after their last listener,
+and :meth:`StreamStations.prefetch` starts one early: when the knob
+tunes towards a stream station, its lead is already buffered on arrival.
+
+Buffer fill, listener lead, bitrate, reconnects and stalls are exported
+through :mod:`radiolib.metrics` (the web app's ``/metrics``), and
+``GET /status`` on the proxy returns them as JSON.
+
+    python3 -m radiolib.stream            # the relay service
+"""
+import http.client, json, logging, os, random, signal, sys, threading, time, urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import metrics, state
+
+STREAMS_KEY = "streams"
+PROXY_HOST = "127.0.0.1"
+PROXY_PORT = int(os.environ.get("RADIO_STREAM_PORT", "8765"))
+BUFFER_BYTES = int(os.environ.get("RADIO_STREAM_BUFFER_KB", "1024")) * 1024  # ~64 s at 128 kbps
+LEAD_SEC = 8.0              # how far behind live a listener starts: its dropout cushion
+LINGER_SEC = 60.0           # relays stay connected this long after the last listener
+DEFAULT_KBPS = 128          # assumed until the stream's rate is known
+CHUNK = 16 * 1024
+CONNECT_TIMEOUT = 10.0      # also the longest silence before a connection counts as dead
+START_WAIT_SEC = 20.0       # a new listener waits this long for the first bytes
+STALL_SEC = 0.5             # a listener waiting longer than this for data has stalled
+BACKOFF_MIN, BACKOFF_MAX = 0.5, 30.0
+BACKOFF_LISTENING = 2.0     # backoff cap while someone is listening: stay inside the lead
+RATE_WINDOW_SEC = 5.0
+JANITOR_SEC = 5.0
+USER_AGENT = "RetroRadio/1.0"
+
+log = logging.getLogger(__name__)
+
+
+def is_stream_url(url):
+    return isinstance(url, str) and url.lower().startswith(("http://", "https://"))
+
+
+def proxy_url(station, host=PROXY_HOST, port=PROXY_PORT):
+    return f"http://{host}:{port}/stream/{station}"
+
+
+class StreamStations:
+    """Which stations are streams, from ``stations.json`` (shared, cached)."""
+
+    def __init__(self, path=state.NAMES_FILE, host=PROXY_HOST, port=PROXY_PORT):
+        self.host, self.port = host, port
+        self._doc = state.document(path, delay=0, indent=2)
+
+    def all(self):
+        """``{"06": "http://...", ...}``"""
+        streams = self._doc.get(STREAMS_KEY) or {}
+        return {k: v for k, v in streams.items() if len(k) == 2 and k.isdigit() and is_stream_url(v)} \
+            if isinstance(streams, dict) else {}
+
+    def source(self, station):
+        return self.all().get(station)
+
+    def url(self, station):
+        """What MPD should play for ``station`` (the proxy), or None for a folder station."""
+        return proxy_url(station, self.host, self.port) if self.source(station) else None
+
+    def set(self, station, url):
+        """Make ``station`` a stream (``url``) or a folder station again (None)."""
+        if url is not None and not is_stream_url(url):
+            raise ValueError("stream URLs must be http:// or https://")
+        streams = dict(self.all())
+        if url:
+            streams[station] = url
+        else:
+            streams.pop(station, None)
+        if streams:
+            self._doc.update({STREAMS_KEY: streams})
+        else:
+            self._doc.remove(STREAMS_KEY)
+
+    def prefetch(self, station, timeout=1.0):
+        """Have the proxy connect to ``station`` now; False if it could not be asked."""
+        try:
+            with urllib.request.urlopen(f"http://{self.host}:{self.port}/prefetch/{station}",
+                                        timeout=timeout):
+                return True
+        except OSError as e:
+            log.debug("prefetch %s: %s", station, e)
+            return False
+
+
+# ------------------ ring buffer ------------------
+class Ring:
+    """Bounded byte ring addressed by absolute stream offsets. Thread-safe.
+
+    One writer appends; any number of readers each keep their own offset.
+    A reader that falls more than ``capacity`` behind skips ahead.
+    """
+
+    def __init__(self, capacity=BUFFER_BYTES):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self.end = 0                    # bytes written so far
+        self.cv = threading.Condition()
+        self.closed = False
+
+    @property
+    def start(self):
+        return max(0, self.end - self.capacity)
+
+    def write(self, data):
+        n = len(data)
+        with self.cv:
+            tail = memoryview(data)[-self.capacity:]
+            i = (self.end + n - len(tail)) % self.capacity
+            first = min(len(tail), self.capacity - i)
+            self._buf[i:i + first] = tail[:first]
+            self._buf[:len(tail) - first] = tail[first:]
+            self.end += n
+            self.cv.notify_all()
+
+    def read(self, pos, limit=CHUNK, timeout=None):
+        """``(pos, data)``: up to ``limit`` bytes from ``pos`` (moved up if overwritten).
+
+        Waits up to ``timeout`` for data; returns empty data on timeout or close.
+        """
+        with self.cv:
+            self.cv.wait_for(lambda: self.end > pos or self.closed, timeout)
+            pos = max(pos, self.start)
+            n = min(limit, self.end - pos)
+            if n <= 0:
+                return pos, b""
+            i = pos % self.capacity
+            first = min(n, self.capacity - i)
+            return pos, bytes(self._buf[i:i + first]) + bytes(self._buf[:n - first])
+
+    def close(self):
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+
+
+# ------------------ upstream relay ------------------
+class Relay:
+    """One upstream stream kept flowing into a :class:`Ring`."""
+
+    def __init__(self, station, url, capacity=BUFFER_BYTES):
+        self.station, self.url = station, url
+        self.ring = Ring(capacity)
+        self.content_type = "audio/mpeg"
+        self.declared_kbps = None       # icy-br, if the server says
+        self.measured_kbps = None
+        self.connected = False
+        self.reconnects = 0
+        self.listeners = 0
+        self.last_used = time.monotonic()
+        self._got_data = False
+        self._stop = threading.Event()
+        labels = {"station": station}
+        self._m = {
+            "fill": metrics.gauge("stream_buffer_fill_ratio", "Share of the relay ring holding audio.", **labels),
+            "lead": metrics.gauge("stream_listener_lead_seconds", "Audio buffered ahead of the listener.", **labels),
+            "kbps": metrics.gauge("stream_bitrate_kbps", "Measured upstream bitrate.", **labels),
+            "up": metrics.gauge("stream_connected", "Upstream connection open.", **labels),
+            "rx": metrics.counter("stream_received_bytes_total", "Bytes read from upstream.", **labels),
+            "tx": metrics.counter("stream_sent_bytes_total", "Bytes sent to listeners.", **labels),
+            "reconnects": metrics.counter("stream_reconnects_total", "Upstream reconnections.", **labels),
+            "stalls": metrics.counter("stream_stalls_total", "Listeners left waiting for data.", **labels),
+        }
+        threading.Thread(target=self._run, name=f"relay-{station}", daemon=True).start()
+
+    @property
+    def byte_rate(self):
+        return (self.declared_kbps or self.measured_kbps or DEFAULT_KBPS) * 1000 / 8
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def stop(self):
+        self._stop.set()
+        self.ring.close()
+        self._m["up"].set(0)
+
+    def _run(self):
+        delay = BACKOFF_MIN
+        while not self._stop.is_set():
+            try:
+                self._pump()
+                err = "end of stream"
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                err = e
+            self.connected = False
+            self._m["up"].set(0)
+            if self._stop.is_set():
+                break
+            if self._got_data:              # it was working: retry quickly
+                delay = BACKOFF_MIN
+            self.reconnects += 1
+            self._m["reconnects"].inc()
+            cap = BACKOFF_LISTENING if self.listeners else BACKOFF_MAX
+            wait = min(delay, cap) * random.uniform(0.5, 1.5)
+            log.info("stream %s: %s; reconnecting in %.1fs", self.station, err, wait)
+            if self._stop.wait(wait):
+                break
+            delay = min(BACKOFF_MAX, delay * 2)
+
+    def _pump(self):
+        self._got_data = False
+        req = urllib.request.Request(self.url, headers={"User-Agent": USER_AGENT, "Icy-MetaData": "0"})
+        with urllib.request.urlopen(req, timeout=CONNECT_TIMEOUT) as r:
+            self.content_type = r.headers.get("Content-Type", self.content_type)
+            br = (r.headers.get("icy-br") or "").split(",")[0].strip()
+            self.declared_kbps = int(br) if br.isdigit() else None
+            self.connected = True
+            self._m["up"].set(1)
+            if self.declared_kbps and not self.measured_kbps:
+                self._m["kbps"].set(self.declared_kbps)
+            t0, got = time.monotonic(), 0
+            while not self._stop.is_set():
+                data = r.read1(CHUNK)
+                if not data:
+                    return
+                self._got_data = True
+                self.ring.write(data)
+                self._m["rx"].inc(len(data))
+                self._m["fill"].set(round((self.ring.end - self.ring.start) / self.ring.capacity, 3))
+                got += len(data)
+                now = time.monotonic()
+                if now - t0 >= RATE_WINDOW_SEC:
+                    self.measured_kbps = round(got * 8 / 1000 / (now - t0), 1)
+                    self._m["kbps"].set(self.measured_kbps)
+                    t0, got = now, 0
+
+    def wait_ready(self, timeout=START_WAIT_SEC):
+        """Wait for the first upstream bytes; False if none came."""
+        self.touch()
+        with self.ring.cv:
+            return self.ring.cv.wait_for(lambda: self.ring.end > 0 or self.ring.closed, timeout) \
+                and not self.ring.closed
+
+    def listen(self, write):
+        """Feed one listener through ``write(bytes)`` until it hangs up or the relay stops."""
+        with self.ring.cv:
+            self.listeners += 1
+        self.touch()
+        try:
+            pos = max(self.ring.start, self.ring.end - int(LEAD_SEC * self.byte_rate))
+            while not self.ring.closed:
+                t = time.monotonic()
+                pos, data = self.ring.read(pos, CHUNK, timeout=CONNECT_TIMEOUT)
+                if time.monotonic() - t > STALL_SEC:
+                    self._m["stalls"].inc()
+                if not data:
+                    continue
+                write(data)
+                pos += len(data)
+                self._m["tx"].inc(len(data))
+                self._m["lead"].set(round((self.ring.end - pos) / self.byte_rate, 2))
+        finally:
+            with self.ring.cv:
+                self.listeners -= 1
+            self.touch()
+
+    def info(self):
+        return {"url": self.url, "connected": self.connected, "listeners": self.listeners,
+                "buffered": self.ring.end - self.ring.start, "capacity": self.ring.capacity,
+                "received": self.ring.end, "kbps": self.measured_kbps or self.declared_kbps,
+                "reconnects": self.reconnects}
+
+
+# ------------------ local proxy ------------------
+class Proxy:
+    """Relays on demand for the stations ``stations`` knows, served over HTTP."""
+
+    def __init__(self, stations=None, capacity=BUFFER_BYTES, linger=LINGER_SEC):
+        self.stations = stations or StreamStations()
+        self.capacity, self.linger = capacity, linger
+        self._lock = threading.Lock()
+        self._relays = {}
+        threading.Thread(target=self._janitor, name="relay-janitor", daemon=True).start()
+
+    def relay(self, station):
+        """The running relay for ``station`` (started if needed), or None if it isn't a stream."""
+        url = self.stations.source(station)
+        with self._lock:
+            r = self._relays.get(station)
+            if r and r.url != url:          # URL changed (or station no longer a stream)
+                self._relays.pop(station).stop()
+                r = None
+            if url and not r:
+                r = self._relays[station] = Relay(station, url, self.capacity)
+            if r:
+                r.touch()
+            return r
+
+    def _janitor(self):
+        while True:
+            time.sleep(JANITOR_SEC)
+            now = time.monotonic()
+            with self._lock:
+                idle = [s for s, r in self._relays.items()
+                        if not r.listeners and now - r.last_used > self.linger]
+                for s in idle:
+                    self._relays.pop(s).stop()
+            for s in idle:
+                log.info("stream %s: idle, disconnected", s)
+
+    def status(self):
+        with self._lock:
+            return {s: r.info() for s, r in self._relays.items()}
+
+    def close(self):
+        with self._lock:
+            for r in self._relays.values():
+                r.stop()
+            self._relays.clear()
+
+    def server(self, host=PROXY_HOST, port=PROXY_PORT):
+        """A ThreadingHTTPServer for this proxy (call ``serve_forever``)."""
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = self.path.split("?", 1)[0].strip("/").split("/")
+                if parts == ["status"]:
+                    return self._reply(200, "application/json", json.dumps(proxy.status()).encode())
+                if len(parts) != 2 or parts[0] not in ("stream", "prefetch") \
+                        or not (len(parts[1]) == 2 and parts[1].isdigit()):
+                    return self._reply(404, "text/plain", b"not found\n")
+                relay = proxy.relay(parts[1])
+                if relay is None:
+                    return self._reply(404, "text/plain", b"not a stream station\n")
+                if parts[0] == "prefetch":
+                    return self._reply(204, "text/plain", b"")
+                if not relay.wait_ready():
+                    log.warning("stream %s: no data from upstream", parts[1])
+                    return self._reply(503, "text/plain", b"stream unavailable\n")
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", relay.content_type)
+                    self.send_header("Cache-Control", "no-cache")
+                    self.end_headers()
+                    relay.listen(self.wfile.write)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass                    # MPD hung up: switched station or stopped
+
+            def _reply(self, code, ctype, body):
+                self.send_response(code)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                log.debug("%s " + fmt, self.address_string(), *args)
+
+        srv = ThreadingHTTPServer((host, port), Handler)
+        srv.daemon_threads = True
+        return srv
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(prog="python3 -m radiolib.stream")
+    ap.add_argument("--host", default=PROXY_HOST)
+    ap.add_argument("--port", type=int, default=PROXY_PORT)
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+    proxy = Proxy()
+    srv = proxy.server(args.host, args.port)
+    metrics.serve("radio_stream")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    log.info("stream relay on %s:%d", args.host, args.port)
+    try:
+        srv.serve_forever()
+    finally:
+        proxy.close()
+
+
+if __name__ == "__main__":
+    main()
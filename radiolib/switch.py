@@ -0,0 +1,569 @@
+"""Atomic station switching over MPD command lists.
+
+A switch is two ``command_list_ok_begin`` batches. The first reads where
+the outgoing station was, then clears the queue, loads the station's stored
+playlist (or adds its folder), sets random/repeat and finds the track the
+station should start with; the second plays it (seeking to the resume
+point), reads back ``status`` and saves the playlist for next time if
+needed. (Where the start track lands in a loaded playlist is only known
+from the first reply, hence two.) A rolling queue or an internet stream
+knows its start position up front and switches in one batch. The queue
+is never left half-built and the caller gets the new state in the same
+exchange.
+
+Which track a station starts with is decided ahead of time -- where it was
+left off (:class:`~radiolib.warmstart.PositionStore`) or a pre-picked random
+track -- so :meth:`StationSwitcher.prepare` can have it read into the
+:class:`~radiolib.warmstart.WarmCache` before the knob is even clicked.
+
+Stored playlists are named ``station-NN`` and are rebuilt whenever the
+station folder's mtime is newer than the playlist (files added/removed).
+A snapshot taken less than SNAPSHOT_SETTLE_SEC after the folder changed
+is not trusted either, since MPD may still have been rescanning it.
+
+With a :class:`~radiolib.shuffle.Shuffler` the queue is never the whole
+folder: a switch loads the start track and a few picks after it
+(``shuffle.WINDOW``) with ``consume`` on, no stored playlist involved, and
+whoever plays the radio calls :meth:`StationSwitcher.top_up` on every
+player/queue change to record history and add the next picks. The
+outgoing station's remaining picks are kept for its next turn.
+
+Stations ``streams`` (a :class:`~radiolib.stream.StreamStations`) lists
+as internet streams queue the local relay's URL instead, and
+:meth:`StationSwitcher.prepare` asks the relay to start buffering them.
+
+The exchange itself is written once (``_steps``) and driven either over an
+:class:`~radiolib.mpd.MPDPool` (:meth:`StationSwitcher.switch`) or an
+:class:`~radiolib.mpd.AsyncMPDClient` (:meth:`StationSwitcher.switch_async`).
+"""
+import asyncio, logging, os, random, threading, time
+from calendar import timegm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .catalog import is_audio
+from .mpd import MPDError, to_dict
+from .shuffle import LOW_WATER, WINDOW
+from .warmstart import RESUME_REWIND_SEC
+
+PLAYLIST_PREFIX = "station-"
+AUDIO_POLL_SEC = 0.02     # first status poll while waiting for sound; doubles each time...
+AUDIO_POLL_MAX_SEC = 0.5  # ...up to this, so a switch costs ~a dozen polls at most
+AUDIO_WAIT_SEC = 5.0      # give up measuring after this long
+SAMPLES_KEPT = 50
+SNAPSHOT_SETTLE_SEC = 30  # MPD's background `update` should be done by then
+LOAD_INDEX = 3            # position of load/add in the build batch
+
+log = logging.getLogger(__name__)
+
+
+def station_folder(station) -> str:
+    """``1`` / ``"01"`` -> ``"01"``."""
+    return f"{int(station):02d}"
+
+
+def _parse_mpd_time(s):
+    try:
+        return float(timegm(time.strptime(s, "%Y-%m-%dT%H:%M:%SZ")))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _queue_files(pairs):
+    return [v for k, v in pairs if k == "file"]
+
+
+def _pct(values, q):
+    if not values:
+        return None
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(q * (len(v) - 1))))]
+
+
+class StationSwitcher:
+    """Switch stations on an MPDPool and keep switch latency statistics.
+
+    ``positions`` (a PositionStore) enables resuming where a station was
+    left; ``warm`` (a WarmCache) enables :meth:`prepare`; ``shuffler`` (a
+    Shuffler) replaces MPD's random mode with a rolling queue; ``streams``
+    (a StreamStations) enables internet-stream stations.
+    """
+
+    def __init__(self, pool, music_root, shuffle=True, positions=None, warm=None, shuffler=None,
+                 streams=None):
+        self.pool = pool
+        self.music_root = music_root
+        self.shuffle = shuffle
+        self.positions, self.warm = positions, warm
+        self.shuffler = shuffler if shuffle else None
+        self.streams = streams
+        self._lock = threading.Lock()
+        self._alock = None              # asyncio.Lock, created on the loop by switch_async
+        self._playlists = None          # name -> mtime of the stored playlist
+        self._next = {}                 # folder -> pre-picked start track (random mode)
+        self._wanted = set()            # folders the latest prepare() asked for
+        self._prep = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warm") if warm else None
+        self._rtt_ms = deque(maxlen=SAMPLES_KEPT)
+        self._audio_ms = {True: deque(maxlen=SAMPLES_KEPT), False: deque(maxlen=SAMPLES_KEPT)}
+        self.last = {}
+
+    # ---- stored playlists ----
+    @staticmethod
+    def _parse_playlists(pairs):
+        pl = {}
+        name = None
+        for k, v in pairs:
+            if k == "playlist":
+                name = v
+                pl[name] = 0.0
+            elif k == "Last-Modified" and name:
+                pl[name] = _parse_mpd_time(v)
+        return pl
+
+    def _folder_mtime(self, folder):
+        try:
+            return os.stat(os.path.join(self.music_root, folder)).st_mtime
+        except OSError:
+            return None
+
+    def invalidate(self, station=None):
+        """Forget cached playlist state (all stations, or one)."""
+        with self._lock:
+            if station is None or self._playlists is None:
+                self._playlists = None
+                self._next.clear()
+            else:
+                self._playlists.pop(PLAYLIST_PREFIX + station_folder(station), None)
+                self._next.pop(station_folder(station), None)
+
+    def forget(self, station):
+        """Drop everything remembered about a deleted station."""
+        self.invalidate(station)
+        folder = station_folder(station)
+        if self.positions:
+            self.positions.forget(folder)
+        if self.shuffler:
+            self.shuffler.forget(folder)
+
+    # ---- start track & warm start ----
+    def _target(self, folder, consume=False):
+        """``{"file", "elapsed"}`` the station will start with, or None (let MPD pick)."""
+        rec = self.positions.get(folder) if self.positions else None
+        if rec and os.path.isfile(os.path.join(self.music_root, rec["file"])):
+            return {"file": rec["file"], "elapsed": max(0.0, rec["elapsed"] - RESUME_REWIND_SEC),
+                    "offset": self._offset(rec), "resumed": True}
+        if not self.shuffle:
+            return None
+        target = self._next.pop(folder, None) if consume else self._next.get(folder)
+        if target and os.path.isfile(os.path.join(self.music_root, target["file"])):
+            return target
+        if self.shuffler:
+            files = self.shuffler.upcoming(folder)[:1] or self.shuffler.pick(folder, 1)
+        else:
+            try:
+                names = [n for n in os.listdir(os.path.join(self.music_root, folder)) if is_audio(n)]
+            except OSError:
+                names = []
+            files = [f"{folder}/{random.choice(names)}"] if names else []
+        if not files:
+            return None
+        target = {"file": files[0], "elapsed": 0.0, "offset": 0, "resumed": False}
+        if not consume:
+            self._next[folder] = target
+        return target
+
+    @staticmethod
+    def _offset(rec):
+        """Approximate byte offset of a resume point (CBR-accurate)."""
+        if rec.get("size") and rec.get("duration"):
+            return int(rec["size"] * rec["elapsed"] / rec["duration"])
+        return 0
+
+    def prepare(self, *stations):
+        """Read the start tracks of ``stations`` into the warm cache, in the background.
+
+        Each call replaces the previous wish list, so spinning the knob past
+        a station doesn't leave a queue of stale reads behind.
+        """
+        folders = [station_folder(s) for s in stations]
+        if self.streams:
+            for f in [f for f in folders if self.streams.url(f)]:
+                folders.remove(f)
+                threading.Thread(target=self.streams.prefetch, args=(f,), daemon=True).start()
+        if not self._prep:
+            return
+        self._wanted = set(folders)
+        for f in folders:
+            self._prep.submit(self._prepare, f)
+
+    def _prepare(self, folder):
+        if folder not in self._wanted:
+            return
+        target = self._target(folder)
+        if target:
+            self.warm.load(os.path.join(self.music_root, target["file"]), target["offset"])
+
+    def _remember(self, song, status):
+        """Store where the outgoing station was, from the status before ``clear``."""
+        f = song.get("file", "")
+        folder = f.split("/", 1)[0]
+        if not (self.positions and status.get("state") in ("play", "pause") and len(folder) == 2
+                and folder.isdigit()):
+            return
+        try:
+            elapsed = float(status.get("elapsed", 0))
+            duration = float(status.get("duration") or song.get("duration") or 0) or None
+            size = os.path.getsize(os.path.join(self.music_root, f))
+        except (ValueError, OSError):
+            return
+        self.positions.put(folder, f, elapsed, duration, size)
+
+    # ---- switching ----
+    def _build(self, folder, use_stored, target):
+        cmds = ["currentsong", "status", "clear",
+                ("load", PLAYLIST_PREFIX + folder) if use_stored else ("add", folder)]
+        if self.shuffle:
+            cmds += [("random", 1), ("repeat", 1)]
+        if target:
+            cmds.append(("playlistfind", "file", target["file"]))
+        return cmds
+
+    def _start(self, folder, pos, elapsed, snapshot, existing, extra):
+        name = PLAYLIST_PREFIX + folder
+        cmds = [("play", pos) if pos is not None else "play"]
+        if elapsed:
+            cmds.append(("seekcur", f"{elapsed:.1f}"))
+        cmds += list(extra) + ["currentsong", "status"]
+        si = len(cmds) - 1
+        if snapshot:
+            # Snapshot the freshly added folder; after "status" so that a
+            # failure here can't affect playback.
+            cmds += ([("rm", name)] if existing else []) + [("save", name)]
+        return cmds, si
+
+    def _steps(self, folder, extra):
+        """The switch as a generator: yields command lists, is sent their results.
+
+        MPDErrors are thrown back in so the fallbacks live here, whichever
+        way the commands travel. Returns ``(status, song, info)``.
+        """
+        url = self.streams.url(folder) if self.streams else None
+        if url:
+            return (yield from self._stream_steps(folder, url, extra))
+        if self.shuffler:
+            return (yield from self._rolling_steps(folder, extra))
+        name = PLAYLIST_PREFIX + folder
+        if self._playlists is None:
+            self._playlists = self._parse_playlists((yield ["listplaylists"])[0])
+        known = self._playlists
+        mtime = self._folder_mtime(folder)
+        use_stored = (name in known and mtime is not None
+                      and known[name] >= int(mtime) + SNAPSHOT_SETTLE_SEC)
+        target = self._target(folder, consume=True)
+        try:
+            built = yield self._build(folder, use_stored, target)
+        except MPDError as e:
+            if not (use_stored and e.index == LOAD_INDEX):
+                raise
+            # Stored playlist vanished underneath us: rebuild from folder
+            use_stored = False
+            built = yield self._build(folder, False, target)
+        self._remember(to_dict(built[0]), to_dict(built[1]))
+        pos = to_dict(built[-1]).get("Pos") if target else None
+        elapsed = target["elapsed"] if pos is not None else 0.0
+        cmds, si = self._start(folder, pos, elapsed, not use_stored, name in known, extra)
+        try:
+            res = yield cmds
+            if not use_stored:
+                known[name] = time.time()
+        except MPDError as e:
+            if e.index is None or e.index <= si:
+                raise
+            known.pop(name, None)  # playlist snapshot failed, playback is fine
+            res = yield ["currentsong", "status"]
+            si = 1
+        info = {"from_playlist": use_stored, "elapsed": elapsed,
+                "resumed": bool(pos is not None and target["resumed"])}
+        return to_dict(res[si]), to_dict(res[si - 1]), info
+
+    def _rolling_steps(self, folder, extra):
+        """:meth:`_steps` for a shuffler: queue WINDOW tracks, consume mode."""
+        target = self._target(folder, consume=True)
+        files = [target["file"]] if target else []
+        files += [f for f in self.shuffler.upcoming(folder) if f not in files][:WINDOW - len(files)]
+        files += self.shuffler.pick(folder, WINDOW - len(files), exclude=files)
+        reads = ["currentsong", "status", "playlistinfo"]
+        while True:
+            start = bool(target and files and files[0] == target["file"])
+            elapsed = target["elapsed"] if start else 0.0
+            build = reads + ["clear"] + [("add", f) for f in files] + \
+                [("random", 0), ("repeat", 0), ("consume", 1)]
+            if files:
+                cmds, si = self._start(folder, 0, elapsed, False, False, extra)
+            else:                       # nothing could be queued: don't `play` an empty queue
+                cmds, si = ["currentsong", "status"], 1
+            try:
+                res = yield build + cmds
+                break
+            except MPDError as e:
+                i = (e.index or 0) - len(reads) - 1
+                if not 0 <= i < len(files):
+                    raise
+                # Not in MPD's database yet (a fresh upload): leave it out. The
+                # outgoing station's reads are lost with the failed list.
+                log.info("station %s: %s not in MPD's database, skipped", folder, files[i])
+                del files[i]
+                reads = []
+        if reads:
+            self._leave(folder, res)
+        self.shuffler.keep(folder, files[1:])
+        si += len(build)
+        return to_dict(res[si]), to_dict(res[si - 1]), {
+            "from_playlist": False, "elapsed": elapsed, "resumed": start and target["resumed"]}
+
+    def _stream_steps(self, folder, url, extra):
+        """:meth:`_steps` for an internet stream: queue the relay, play."""
+        build = ["currentsong", "status", "playlistinfo", "clear", ("add", url),
+                 ("random", 0), ("repeat", 0), ("consume", 0)]
+        cmds, si = self._start(folder, 0, 0.0, False, False, extra)
+        res = yield build + cmds
+        self._leave(folder, res)
+        si += len(build)
+        return to_dict(res[si]), to_dict(res[si - 1]), {
+            "from_playlist": False, "elapsed": 0.0, "resumed": False}
+
+    def _leave(self, folder, built):
+        """Save the outgoing station's place from currentsong/status/playlistinfo replies."""
+        song, st = to_dict(built[0]), to_dict(built[1])
+        self._remember(song, st)
+        old = song.get("file", "").split("/", 1)[0]
+        if self.shuffler and old and old != folder and st.get("consume") == "1":
+            self.shuffler.keep(old, _queue_files(built[2])[int(st.get("song", 0)) + 1:])
+
+    def _top_up_steps(self):
+        """Record the playing track and add picks when the rolling queue runs low.
+
+        Returns the number of tracks added (None: not a rolling queue).
+        """
+        res = yield ["currentsong", "status", "playlistinfo"]
+        song, st = to_dict(res[0]), to_dict(res[1])
+        file = song.get("file", "")
+        folder = file.split("/", 1)[0]
+        if not (self.shuffler and st.get("consume") == "1" and len(folder) == 2 and folder.isdigit()):
+            return None
+        if st.get("state") in ("play", "pause"):
+            self.shuffler.played(file)
+        ahead = _queue_files(res[2])[int(st.get("song", 0)) + 1:]
+        added = []
+        if len(ahead) < LOW_WATER:
+            # One list, led by a check that the song we read is still queued: if
+            # anyone switched station meanwhile, MPD rejects it before any add.
+            guard = ("playlistid", st.get("songid", "-1"))
+            pending = self.shuffler.pick(folder, WINDOW - 1 - len(ahead), exclude=[file] + ahead)
+            while pending:
+                try:
+                    yield [guard] + [("add", f) for f in pending]
+                    added += pending
+                    break
+                except MPDError as e:
+                    i = (e.index or 0) - 1
+                    if i < 0:
+                        log.info("station %s: queue changed under top-up, left alone", folder)
+                        return 0
+                    log.info("station %s: could not queue %s: %s", folder, pending[i], e)
+                    added += pending[:i]
+                    pending = pending[i + 1:]
+        self.shuffler.keep(folder, ahead + added)
+        return len(added)
+
+    def _previous_steps(self):
+        """Back to the track before the current one.
+
+        A rolling queue consumes what it played, so MPD's own ``previous``
+        has nothing to go back to: the previous track comes from the
+        station's history, and the current one is queued again to follow it.
+        """
+        res = yield ["currentsong", "status"]
+        song, st = to_dict(res[0]), to_dict(res[1])
+        file = song.get("file", "")
+        folder = file.split("/", 1)[0]
+        prev = None
+        if self.shuffler and st.get("consume") == "1" and len(folder) == 2 and folder.isdigit():
+            prev = self.shuffler.back(folder)
+        if not prev:
+            yield ["previous"]
+            return None
+        pos, songid = int(st.get("song", 0)), st.get("songid", "-1")
+        try:
+            # prev and a fresh copy of the current track go after it, prev plays, and
+            # the old entry goes (unless consume already took it: the last command)
+            yield [("playlistid", songid), ("addid", prev, pos + 1), ("addid", file, pos + 2),
+                   ("play", pos + 1), ("deleteid", songid)]
+        except MPDError as e:
+            if e.index == 4:
+                return prev
+            log.info("station %s: could not go back to %s: %s", folder, prev, e)
+            yield ["previous"]
+            return None
+        return prev
+
+    # ---- driving the steps ----
+    def _drive(self, steps):
+        with self.pool.client() as c:
+            reply, err = None, None
+            while True:
+                try:
+                    cmds = steps.throw(err) if err else steps.send(reply)
+                except StopIteration as done:
+                    return done.value
+                try:
+                    reply, err = c.command_list(cmds), None
+                except MPDError as e:
+                    reply, err = None, e
+
+    async def _drive_async(self, client, steps):
+        reply, err = None, None
+        while True:
+            try:
+                cmds = steps.throw(err) if err else steps.send(reply)
+            except StopIteration as done:
+                return done.value
+            try:
+                reply, err = await client.command_list(cmds), None
+            except MPDError as e:
+                reply, err = None, e
+
+    def top_up(self):
+        """Keep a rolling queue going (call on MPD player/playlist changes).
+
+        Safe to call from every process that watches MPD: while one is
+        topping up, the others skip (None).
+        """
+        if not self.shuffler:
+            return None
+        with self._lock, self.shuffler.exclusive() as mine:
+            return self._drive(self._top_up_steps()) if mine else None
+
+    async def top_up_async(self, client):
+        if not self.shuffler:
+            return None
+        if self._alock is None:
+            self._alock = asyncio.Lock()
+        async with self._alock:
+            with self.shuffler.exclusive() as mine:
+                return await self._drive_async(client, self._top_up_steps()) if mine else None
+
+    def previous(self):
+        """Go back one track (``/api/prev``); returns the file, or None if MPD's previous ran."""
+        with self._lock:
+            return self._drive(self._previous_steps())
+
+    def _finish(self, folder, t0, song, info):
+        rtt = (time.monotonic() - t0) * 1000.0
+        self._rtt_ms.append(rtt)
+        metrics.histogram("station_switch_seconds", "Station switch MPD round trips.").observe(rtt / 1000.0)
+        f = song.get("file", "")
+        path = os.path.join(self.music_root, f) if f and "://" not in f else None
+        warm = bool(self.warm and path and self.warm.note(path))
+        self.last = {"station": folder, "from_playlist": info["from_playlist"],
+                     "resumed": info["resumed"], "warm": warm,
+                     "rtt_ms": round(rtt, 1), "audio_ms": None}
+        return self.last
+
+    def switch(self, station, extra=(), measure=True):
+        """Switch to ``station``; return ``(status, currentsong)`` dicts.
+
+        ``extra`` commands (e.g. ``("setvol", 75)``) run right after ``play``.
+        Raises MPDError/OSError like the pool does.
+        """
+        folder = station_folder(station)
+        t0 = time.monotonic()
+        with self._lock:
+            status, song, info = self._drive(self._steps(folder, extra))
+        rec = self._finish(folder, t0, song, info)
+        if measure and status.get("state") == "play":
+            threading.Thread(target=self._measure_audio, args=(t0, rec, info["elapsed"]),
+                             daemon=True).start()
+        return status, song
+
+    async def switch_async(self, client, station, extra=(), measure=True):
+        """:meth:`switch` over an AsyncMPDClient, for event-loop programs.
+
+        Audio latency is then measured by a task on the same loop.
+        """
+        folder = station_folder(station)
+        t0 = time.monotonic()
+        if self._alock is None:
+            self._alock = asyncio.Lock()
+        async with self._alock:
+            status, song, info = await self._drive_async(client, self._steps(folder, extra))
+        rec = self._finish(folder, t0, song, info)
+        if measure and status.get("state") == "play":
+            asyncio.ensure_future(self._measure_audio_async(client, t0, rec, info["elapsed"]))
+        return status, song
+
+    def _audio_started(self, st, t0, rec, base):
+        """True once ``st`` shows decoded audio past ``base`` (records the sample); None to give up."""
+        if st.get("state") != "play":
+            return None
+        try:
+            if float(st.get("elapsed", 0)) <= base:
+                return False
+        except ValueError:
+            return False
+        ms = (time.monotonic() - t0) * 1000.0
+        rec["audio_ms"] = round(ms, 1)
+        self._audio_ms[rec["warm"]].append(ms)
+        metrics.histogram("station_first_audio_seconds", "Switch to first decoded audio.",
+                          cache="warm" if rec["warm"] else "cold").observe(ms / 1000.0)
+        log.info("station %s: first audio after %.0f ms (%s, switch round trip %.0f ms)",
+                 rec["station"], ms, "warm" if rec["warm"] else "cold", rec["rtt_ms"])
+        return True
+
+    def _measure_audio(self, t0, rec, base=0.0):
+        """Poll until MPD's elapsed moves past ``base`` (decoded audio is playing).
+
+        MPD sends no event when decoding starts (``idle player`` fires on
+        ``play`` already), so this polls ``status``, backing off from
+        AUDIO_POLL_SEC: fine-grained where first audio usually lands, a
+        handful of requests when it is slow.
+        """
+        delay = AUDIO_POLL_SEC
+        while time.monotonic() - t0 < AUDIO_WAIT_SEC:
+            try:
+                st = to_dict(self.pool.execute("status"))
+            except (MPDError, OSError):
+                return
+            if self._audio_started(st, t0, rec, base) is not False:
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, AUDIO_POLL_MAX_SEC)
+
+    async def _measure_audio_async(self, client, t0, rec, base=0.0):
+        delay = AUDIO_POLL_SEC
+        while time.monotonic() - t0 < AUDIO_WAIT_SEC:
+            try:
+                st = to_dict(await client.execute("status"))
+            except (MPDError, OSError, asyncio.TimeoutError):
+                return
+            if self._audio_started(st, t0, rec, base) is not False:
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, AUDIO_POLL_MAX_SEC)
+
+    def stats(self):
+        """Latency summary over the last few switches (milliseconds)."""
+        rtt = list(self._rtt_ms)
+        warm, cold = list(self._audio_ms[True]), list(self._audio_ms[False])
+        audio = warm + cold
+        out = {
+            "switches": len(rtt),
+            "rtt_ms_p50": _pct(rtt, 0.5), "rtt_ms_p99": _pct(rtt, 0.99),
+            "audio_ms_p50": _pct(audio, 0.5), "audio_ms_p99": _pct(audio, 0.99),
+            "audio_ms_p50_warm": _pct(warm, 0.5), "audio_ms_p50_cold": _pct(cold, 0.5),
+            "last": dict(self.last),
+        }
+        if self.warm:
+            out["warm_cache"] = self.warm.stats()
+        return out
@@ -0,0 +1,65 @@
+"""Debounced, station-scoped MPD database updates.
+
+Uploads and deletes call :meth:`UpdateCoalescer.schedule` instead of
+running ``mpc update`` inline. Requests are collected for ``delay``
+seconds (never longer than ``max_delay`` in total) and then sent from a
+background thread as one command list of ``update NN`` -- so a 200-file
+batch triggers one scoped rescan, not 200 full ones.
+"""
+import logging, threading, time
+
+from .mpd import MPDError
+
+DEBOUNCE_SEC = 2.0
+MAX_DELAY_SEC = 30.0
+
+log = logging.getLogger(__name__)
+
+
+class UpdateCoalescer:
+    def __init__(self, pool, delay=DEBOUNCE_SEC, max_delay=MAX_DELAY_SEC, on_flush=None):
+        self.pool = pool
+        self.delay, self.max_delay = delay, max_delay
+        self.on_flush = on_flush        # called with the set of stations (None = all)
+        self._cv = threading.Condition()
+        self._pending, self._full = set(), False
+        self._due = self._first = None
+        threading.Thread(target=self._loop, name="mpd-update", daemon=True).start()
+
+    def schedule(self, station=None):
+        """Queue an update of ``station`` (or the whole library)."""
+        with self._cv:
+            now = time.monotonic()
+            if station is None:
+                self._full = True
+            else:
+                self._pending.add(station)
+            self._first = self._first or now
+            self._due = min(now + self.delay, self._first + self.max_delay)
+            self._cv.notify()
+
+    def flush(self):
+        """Run whatever is pending right away."""
+        with self._cv:
+            if self._due is not None:
+                self._due = time.monotonic()
+                self._cv.notify()
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while self._due is None or time.monotonic() < self._due:
+                    self._cv.wait(None if self._due is None else self._due - time.monotonic())
+                stations, full = self._pending, self._full
+                self._pending, self._full = set(), False
+                self._due = self._first = None
+            cmds = ["update"] if full else [("update", s) for s in sorted(stations)]
+            try:
+                self.pool.command_list(cmds)
+            except (MPDError, OSError) as e:
+                log.warning("MPD update %s failed: %s", cmds, e)
+            if self.on_flush:
+                try:
+                    self.on_flush(None if full else stations)
+                except Exception:
+                    log.exception("update flush callback failed")
@@ -0,0 +1,177 @@
+"""Station warm start: resume positions and a pinned read-ahead cache.
+
+A cold switch makes MPD open, probe and start decoding a random file off
+the SD card. Two things take that off the critical path:
+
+* :class:`PositionStore` remembers, per station, which track was playing
+  and how far in when the radio switched away, so the next switch resumes
+  there instead of picking a new track (``~/.station_positions.json``,
+  shared by the web app and the knob).
+* :class:`WarmCache` keeps the first ``head`` bytes (ID3 tag, Xing header,
+  first few seconds of audio) of the track each likely-next station will
+  start with -- plus the bytes around a resume point -- mapped and, where
+  RLIMIT_MEMLOCK allows, mlock()ed, within a fixed RAM budget. MPD then
+  reads them from RAM.
+
+:class:`radiolib.switch.StationSwitcher` decides which track a station
+will start with and asks the cache to hold it (see ``prepare``).
+"""
+import ctypes, ctypes.util, logging, mmap, os, threading, time
+from collections import OrderedDict
+
+from . import state
+
+POSITIONS_FILE = os.path.join(os.path.expanduser("~"), ".station_positions.json")
+WARM_BUDGET = int(float(os.environ.get("RADIO_WARM_BUDGET_MB", "8")) * 1024 * 1024)
+WARM_HEAD = 256 * 1024        # ~16 s of 128 kbps audio, plus tags
+RESUME_MAX_AGE_SEC = 6 * 3600  # older positions start fresh
+RESUME_REWIND_SEC = 2.0        # resume slightly before where we left
+RESUME_TAIL_SEC = 5.0          # nearly finished tracks aren't resumed
+
+log = logging.getLogger(__name__)
+
+
+# ------------------ resume positions ------------------
+class PositionStore:
+    """``{station: {"file", "elapsed", "duration", "size", "ts"}}`` in a JSON file.
+
+    Backed by a shared :class:`radiolib.state.Document`: reads are served
+    from memory and a run of switches is written to the card once.
+    """
+
+    def __init__(self, path=POSITIONS_FILE):
+        self.path = path
+        self._doc = state.document(path)
+
+    def get(self, station):
+        """The resume point for ``station``, or None if unknown or stale."""
+        rec = self._doc.get(station)
+        if not rec or time.time() - rec.get("ts", 0) > RESUME_MAX_AGE_SEC:
+            return None
+        return rec
+
+    def put(self, station, file, elapsed, duration=None, size=None):
+        if duration and elapsed > duration - RESUME_TAIL_SEC:
+            self._doc.remove(station)
+        else:
+            self._doc.update({station: {"file": file, "elapsed": round(elapsed, 1),
+                                        "duration": duration, "size": size, "ts": time.time()}})
+
+    def forget(self, station):
+        self._doc.remove(station)
+
+
+# ------------------ read-ahead cache ------------------
+_PROT_READ, _MAP_SHARED, _MADV_WILLNEED = 1, 1, 3
+_libc = None
+
+
+def _c():
+    global _libc
+    if _libc is None:
+        lib = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        lib.mmap64.restype = ctypes.c_void_p
+        lib.mmap64.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int,
+                               ctypes.c_int, ctypes.c_int64)
+        lib.munmap.argtypes = lib.mlock.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        lib.madvise.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+        _libc = lib
+    return _libc
+
+
+class _Mapping:
+    """A read-only, shared mapping of part of a file: its pages *are* the page cache.
+
+    Python's mmap can't lock a read-only mapping (``from_buffer`` needs a
+    writable one, and locking a private writable mapping copies every page
+    instead of pinning the cache MPD reads), so this goes through libc.
+    """
+
+    def __init__(self, fd, length, offset):
+        c = _c()
+        addr = c.mmap64(None, length, _PROT_READ, _MAP_SHARED, fd, offset)
+        if addr in (None, ctypes.c_void_p(-1).value):
+            raise OSError(ctypes.get_errno(), "mmap failed")
+        self.addr, self.length = addr, length
+
+    def lock(self):
+        """Best-effort mlock() (faults every page in); False if not permitted."""
+        return _c().mlock(self.addr, self.length) == 0
+
+    def prefetch(self):
+        _c().madvise(self.addr, self.length, _MADV_WILLNEED)
+        for i in range(0, self.length, mmap.PAGESIZE):  # fault every page in now
+            ctypes.c_char.from_address(self.addr + i).value
+
+    def close(self):
+        if self.addr is not None:
+            _c().munmap(self.addr, self.length)   # also unlocks
+            self.addr = None
+
+
+class WarmCache:
+    """LRU of mapped file regions, never more than ``budget`` bytes in total."""
+
+    def __init__(self, budget=WARM_BUDGET, head=WARM_HEAD):
+        self.budget, self.head = budget, head
+        self._lock = threading.Lock()
+        self._regions = OrderedDict()   # (path, offset) -> (_Mapping, length, locked)
+        self.bytes = 0
+        self.loads = self.hits = self.misses = 0
+        self.mlock_ok = True
+
+    def _region(self, path, offset, length):
+        key = (path, offset)
+        with self._lock:
+            if key in self._regions:
+                self._regions.move_to_end(key)
+                return True
+        if length <= 0 or length > self.budget:
+            return False
+        with open(path, "rb") as f:
+            mm = _Mapping(f.fileno(), length, offset)
+        locked = self.mlock_ok and mm.lock()
+        if not locked:
+            mm.prefetch()
+        if self.mlock_ok and not locked:
+            self.mlock_ok = False  # RLIMIT_MEMLOCK too small: page cache only
+            log.info("warm cache: mlock not permitted, relying on the page cache")
+        with self._lock:
+            self._regions[key] = (mm, length, locked)
+            self.bytes += length
+            self.loads += 1
+            while self.bytes > self.budget and len(self._regions) > 1:
+                _, (old, n, _) = self._regions.popitem(last=False)
+                self.bytes -= n
+                old.close()  # munmap also unlocks
+        return True
+
+    def load(self, path, offset=0):
+        """Hold the head of ``path`` and, if ``offset`` is set, the bytes from there."""
+        try:
+            size = os.path.getsize(path)
+            self._region(path, 0, min(self.head, size))
+            if offset > self.head:
+                start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                self._region(path, start, min(self.head, size - start))
+        except (OSError, ValueError) as e:
+            log.debug("warm cache: %s: %s", path, e)
+
+    def contains(self, path):
+        with self._lock:
+            return (path, 0) in self._regions
+
+    def note(self, path):
+        """Count a switch that started ``path`` as a hit or a miss."""
+        hit = self.contains(path)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    def stats(self):
+        with self._lock:
+            return {"bytes": self.bytes, "budget": self.budget, "regions": len(self._regions),
+                    "loads": self.loads, "hits": self.hits, "misses": self.misses,
+                    "mlock": self.mlock_ok}
@@ -1,67 +1,64 @@
 #!/usr/bin/env python3
-import os, time, subprocess
+import sys, time, signal
 from gpiozero import DigitalInputDevice
+from radiolib.mpd import MPDPool, MPDError, to_dict
+from radiolib import bus, metrics, state
+from radiolib.fade import Fader
 
 SENSE_PIN = 23            # GPIO tied to amp's switched rail via divider/isolator
 ACTIVE_HIGH = True        # True if pin is HIGH when amp is ON
 DEBOUNCE_SEC = 0.15
-FADE_STEP = 5
-FADE_DELAY = 0.05
+FADE_SEC = 0.6            # time-based ramp length
+FADE_CURVE = "perceptual"  # or "linear"
 
-OLED_MSG = "/tmp/display_message"
-VOL_FILE  = "/var/local/amp_prev_volume"
-FLAG_FILE = "/var/local/amp_paused_by_monitor"
-AMP_STATE = "/var/local/amp_state"  # "ON"/"OFF"
+# "amp_paused": we paused MPD (so amp-on resumes it), "amp_volume": level to fade back up to
+RADIO = state.document(state.RADIO_FILE)
 
-def sh(cmd): subprocess.run(cmd, shell=True, check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+MPD = MPDPool(size=1)
+def mpd(*cmds):
+    """Pipeline MPD commands over the persistent connection; None on failure."""
+    try: return MPD.command_list(cmds)
+    except (MPDError, OSError): return None
 def get_volume():
-    try:
-        out = subprocess.check_output("mpc volume", shell=True, text=True, timeout=2).strip()
-        for tok in out.split():
-            if tok.endswith("%") and tok[:-1].isdigit():
-                return int(tok[:-1])
-    except: pass
+    res = mpd("status")
+    if res:
+        v = to_dict(res[0]).get("volume", "")
+        if v.isdigit(): return int(v)
     return 100
-def set_volume(v): sh(f"mpc volume {max(0,min(100,int(v)))}")
-def fade_to(target):
-    cur=get_volume()
-    step = -FADE_STEP if cur>target else FADE_STEP
-    for v in range(cur, target + (1 if step>0 else -1), step):
-        set_volume(v); time.sleep(FADE_DELAY)
-    set_volume(target)
-def show(msg):
-    try: open(OLED_MSG,"w").write(msg)
-    except: pass
+def set_volume(v): mpd(("setvol", max(0,min(100,int(v)))))
+# One fader thread owns the volume; a new fade cancels/retargets the old one
+FADER = Fader(set_volume, get_volume)
+def fade_to(target, **kw): FADER.fade(target, duration=FADE_SEC, curve=FADE_CURVE, **kw)
+def show(msg): bus.publish(bus.DISPLAY_MESSAGE, text=msg)
 def save_prev_volume():
-    try: open(VOL_FILE,"w").write(str(get_volume()))
-    except: pass
+    v = FADER.active_target()  # mid fade-up: remember where it was heading
+    RADIO.update(amp_volume=get_volume() if v is None else v)
 def load_prev_volume(defv=60):
-    try: return int(open(VOL_FILE).read().strip())
-    except: return defv
+    try: return int(RADIO.get("amp_volume", defv))
+    except (TypeError, ValueError): return defv
 def set_amp_state(on: bool):
-    try: open(AMP_STATE,"w").write("ON" if on else "OFF")
-    except: pass
+    metrics.counter("amp_transitions_total", "Amp sense edges seen.", state="on" if on else "off").inc()
+    bus.publish(bus.AMP_STATE, retain=True, on=bool(on))
 
+# Both return immediately; the fader thread does the ramp (and the pause
+# only if the fade-out wasn't cancelled by the amp coming back on).
 def pause_playback():
-    save_prev_volume()
-    fade_to(0)
-    sh("mpc pause")
-    open(FLAG_FILE,"w").close()
+    if not RADIO.get("amp_paused"):
+        save_prev_volume()
+        RADIO.update(amp_paused=True)
+    fade_to(0, then=lambda: mpd(("pause", 1)))
 def resume_playback():
-    if os.path.exists(FLAG_FILE):
+    if RADIO.get("amp_paused"):
         target=load_prev_volume()
-        sh("mpc play")
-        if get_volume()<target:
-            for v in range(get_volume(), target+1, FADE_STEP):
-                set_volume(v); time.sleep(FADE_DELAY)
-        else:
-            set_volume(target)
-        try: os.remove(FLAG_FILE)
-        except: pass
+        RADIO.update(amp_paused=False)
+        fade_to(target, before=lambda: mpd("play"))
 
 def amp_is_on(level): return bool(level) if ACTIVE_HIGH else not bool(level)
 
 def main():
+    try: signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # atexit flushes RADIO
+    except ValueError: pass                                      # not the main thread (bench harness)
+    metrics.serve("amp_monitor")
     sense = DigitalInputDevice(SENSE_PIN, pull_up=False, bounce_time=DEBOUNCE_SEC)
     on = amp_is_on(sense.value)
     set_amp_state(on)
@@ -1,197 +1,311 @@
 #!/usr/bin/env python3
-import os, time, json, threading, subprocess
-from gpiozero import RotaryEncoder, Button
-from PIL import Image, ImageDraw, ImageFont
-from luma.core.interface.serial import i2c
-from luma.oled.device import ssd1306
+# Boot order: power-on to sound first. Only the stdlib and radiolib load
+# before MPD is told to resume the saved station; then the panel shows the last
+# home screen from SPLASH_FILE (no fonts, no drawing), and only then do the
+# slow imports -- PIL fonts, gpiozero -- load. Phases are logged and
+# exported as boot_phase_seconds.
+import os, time, asyncio, logging, signal
+from functools import lru_cache
+from radiolib.mpd import AsyncMPDClient, MPDError
+from radiolib.switch import StationSwitcher
+from radiolib.shuffle import Shuffler
+from radiolib.stream import StreamStations
+from radiolib.warmstart import PositionStore, WarmCache
+from radiolib.catalog import Catalog
+from radiolib.oled import FrameDisplay, pack
+from radiolib import bus, metrics, state
 
 USER_HOME = os.path.expanduser("~")
 MUSIC_ROOT = os.path.join(USER_HOME, "music")
 NAMES_FILE = os.path.join(MUSIC_ROOT, "stations.json")
-STATE_FILE = os.path.join(USER_HOME, ".station")
+LEGACY_STATION_FILE = os.path.join(USER_HOME, ".station")   # read once if RADIO has no station yet
+SPLASH_FILE = os.path.join(USER_HOME, ".cache", "retroradio", "splash.frame")  # packed home screen
 OLED_ADDR = 0x3C
 ENC_A, ENC_B, ENC_BTN = 16, 20, 21
 FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"
 
 BLINK_ONOFF_SECONDS = 0.5
 TUNING_TIMEOUT_SEC  = 10
+RENDER_HZ = 30                           # max OLED frames per second while tuning
+ACCEL_MIN_STATIONS = 12                  # smaller dials always move one station per detent
+ACCEL_SLOW_SEC = 0.10                    # detents further apart than this: no acceleration
+ACCEL_FAST_SEC = 0.02                    # detents this close: full ACCEL_MAX
+ACCEL_MAX = 5
 
-AMP_STATE_FILE = "/var/local/amp_state"  # "ON" / "OFF" written by amp_monitor.py
 OLED_OFF_DELAY = 60                      # seconds to show AMP OFF before hiding panel
+MESSAGE_HOLD_SEC = 3                     # non-sticky messages with amp on, then back to name
+FRAME_CACHE_SIZE = 256                   # rendered frames kept (station names, messages)
 
-def sh(cmd): subprocess.run(cmd, shell=True, check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-def mpc(cmd): sh(f"mpc {cmd}")
+logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+
+BOOT=[]                                  # (phase, seconds after kernel start)
+def boot_phase(name, t=None):
+    t=time.clock_gettime(time.CLOCK_BOOTTIME) if t is None else t
+    BOOT.append((name,t))
+    metrics.gauge("boot_phase_seconds", "Seconds after kernel start each startup phase ended.", phase=name).set(round(t,3))
+def process_started():
+    try: return int(open("/proc/self/stat").read().rsplit(")",1)[1].split()[19])/os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError): return None
+_t=process_started()
+if _t is not None: boot_phase("exec", _t)
+boot_phase("imports")
+
+MPD = AsyncMPDClient()
+CATALOG = Catalog(MUSIC_ROOT)
+STREAMS = StreamStations(NAMES_FILE)     # internet stations, played via radio-stream's buffer
+# Resume points + start tracks of likely-next stations held in RAM (RADIO_WARM_BUDGET_MB);
+# a short rolling queue per station, shuffled with play history (~/.station_shuffle.json)
+SWITCHER = StationSwitcher(None, MUSIC_ROOT, positions=PositionStore(), warm=WarmCache(),
+                           shuffler=Shuffler(MUSIC_ROOT, catalog=CATALOG), streams=STREAMS)
 
 def detect_station_count():
-    n=0
-    try:
-        for name in sorted(os.listdir(MUSIC_ROOT)):
-            if len(name)==2 and name.isdigit() and os.path.isdir(os.path.join(MUSIC_ROOT,name)):
-                n=max(n,int(name))
-    except: pass
-    return max(n,1)
+    try: return max([CATALOG.max_station(),1]+[int(k) for k in STREAMS.all()])
+    except Exception: return 1
 
 STATION_COUNT = detect_station_count()
 
-def load_names():
-    try:
-        with open(NAMES_FILE,"r",encoding="utf-8") as f:
-            d=json.load(f); return {k:v for k,v in d.items() if len(k)==2 and k.isdigit()}
-    except: return {}
+# In-memory copies shared with the web app; re-read only when the file changes
+NAMES = state.document(NAMES_FILE, delay=0, indent=2)
+RADIO = state.document(state.RADIO_FILE)     # station writes are coalesced (a spun knob = one write)
+
+def load_names(): return state.station_names(NAMES)
 def station_name(n, names=None):
     names = names or load_names()
     return names.get(f"{n:02d}", f"Station {n:02d}")
 def load_station(default=1):
-    try:
-        n=int(open(STATE_FILE).read().strip()); 
-        return n if 1<=n<=STATION_COUNT else default
-    except: return default
-def save_station(n):
-    try: open(STATE_FILE,"w").write(str(int(n)))
-    except: pass
-
-def mpd_select_station(n):
-    folder=f"{n:02d}"
-    mpc("stop"); mpc("clear")
-    mpc(f"add {folder}")
-    mpc("random on"); mpc("repeat on"); mpc("play")
+    n=RADIO.get("station")
+    if n is None:
+        try: n=int(open(LEGACY_STATION_FILE).read().strip())
+        except (OSError, ValueError): n=default
+    try: n=int(n)
+    except (TypeError, ValueError): return default
+    return n if 1<=n<=STATION_COUNT else default
+def save_station(n): RADIO.update(station=int(n))
 
+def neighbours(n): return [(n-2)%STATION_COUNT+1, n%STATION_COUNT+1]
+
+async def select(n):
+    try: await SWITCHER.switch_async(MPD, n)
+    except (MPDError, OSError, asyncio.TimeoutError) as e: logging.warning("station %02d: switch failed: %s", n, e)
+    SWITCHER.prepare(*neighbours(n))
+
+async def feed_queue():
+    """Record history and top up the rolling queue on every track/queue change, whoever switched."""
+    watcher=AsyncMPDClient()             # idle holds its connection
+    while True:
+        try:
+            await SWITCHER.top_up_async(MPD)
+            await watcher.idle("player","playlist")
+        except (MPDError, OSError, asyncio.TimeoutError) as e:
+            logging.warning("queue feeder: %s", e); watcher.close(); await asyncio.sleep(2)
+
+# ---- 1. sound: resume the saved station before anything slow loads ----
+loop=asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+loop.run_until_complete(select(load_station(1)))
+boot_phase("mpd")
+
+# ---- 2. splash: the last home screen, straight from disk ----
+from luma.core.interface.serial import i2c
+from luma.oled.device import ssd1306
 serial = i2c(port=1, address=OLED_ADDR)
 dev = ssd1306(serial, width=128, height=64)
+oled = FrameDisplay(dev)   # skips identical frames, sends only changed pages
 W,H=dev.width, dev.height
+def load_splash():
+    try:
+        frame=open(SPLASH_FILE,"rb").read()
+        return frame if len(frame)==W*H//8 else None
+    except OSError: return None
+def save_splash(frame):
+    try:
+        os.makedirs(os.path.dirname(SPLASH_FILE), exist_ok=True)
+        tmp=SPLASH_FILE+".tmp"
+        with open(tmp,"wb") as f: f.write(frame)
+        os.replace(tmp, SPLASH_FILE)
+    except OSError: pass
+splash=load_splash()
+if splash: oled.show(splash)
+boot_phase("splash")
+
+# ---- 3. the rest: fonts, then GPIO (below) ----
+from PIL import Image, ImageDraw, ImageFont
 font_big=ImageFont.truetype(FONT_PATH,22)
 font_med=ImageFont.truetype(FONT_PATH,16)
 
-def draw_centered(text, blank=False):
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def render_frame(text, font, blank):
     img = Image.new("1",(W,H))
     if not blank:
         d=ImageDraw.Draw(img)
-        f=font_big if len(text)<=12 else font_med
-        tw,th=d.textsize(text,font=f)
-        d.text(((W-tw)//2,(H-th)//2), text, font=f, fill=1)
-    dev.display(img)
-
-names_cache=load_names()
-current=load_station(1)
-preview=current
-
-tuning_active=False
-stop_blink_ev=threading.Event()
-tuning_timer=None
-
-def _tuning_timeout():
-    global tuning_active
-    tuning_active=False
-    stop_blink_ev.set()
-    draw_centered(station_name(current,names_cache), blank=False)
-
-def _start_tuning_timer():
-    global tuning_timer
-    if tuning_timer: tuning_timer.cancel()
-    tuning_timer=threading.Timer(TUNING_TIMEOUT_SEC,_tuning_timeout)
-    tuning_timer.daemon=True; tuning_timer.start()
-
-def _blink_loop(name_to_blink):
-    show=True
-    while not stop_blink_ev.is_set():
-        draw_centered(name_to_blink, blank=not show)
-        time.sleep(BLINK_ONOFF_SECONDS)
-        show=not show
-
-def on_rotate():
-    global preview, tuning_active
-    steps = enc.steps % STATION_COUNT
-    preview = steps + 1
-    name = station_name(preview,names_cache)
-    if not tuning_active:
-        tuning_active=True
-        stop_blink_ev.clear()
-        threading.Thread(target=_blink_loop,args=(name,),daemon=True).start()
-    else:
-        draw_centered(name, blank=False)
-    _start_tuning_timer()
-
-def on_click():
-    global current, tuning_active, names_cache
-    if tuning_active:
-        if tuning_timer: tuning_timer.cancel()
-        tuning_active=False; stop_blink_ev.set()
-        current=preview; save_station(current)
-        names_cache=load_names()
-        draw_centered(station_name(current,names_cache), blank=False)
-        mpd_select_station(current)
-    else:
-        draw_centered(station_name(current,names_cache), blank=False)
-
-def on_hold():
-    mpc("stop")
-    draw_centered(station_name(current,names_cache), blank=False)
-
-enc=RotaryEncoder(a=ENC_A,b=ENC_B,max_steps=STATION_COUNT, wrap=True)
+        l,t,r,b=d.textbbox((0,0),text,font=font)
+        d.text(((W-(r-l))//2-l,(H-(b-t))//2-t), text, font=font, fill=1)
+    return pack(img)
+
+def draw_centered(text, blank=False):
+    frame=render_frame("", None, True) if blank else render_frame(text, font_big if len(text)<=12 else font_med, False)
+    oled.show(frame); return frame
+
+# ---- state machine ----
+# Everything below runs on one asyncio loop: GPIO callbacks (gpiozero's
+# threads) and bus datagrams are handed to it, timers are loop timers, and
+# MPD is spoken to asynchronously, so no state is shared between threads.
+# While tuning, frames are coalesced to at most RENDER_HZ a second (a fast
+# spin skips stations instead of queueing frames); otherwise the loop only
+# wakes for input.
+IDLE, TUNING, AMP_OFF, HIDDEN = "IDLE", "TUNING", "AMP_OFF", "HIDDEN"
+
+def accel_steps(interval, dt):
+    """(stations per detent, new smoothed interval): 1 when slow, up to ACCEL_MAX on a big dial."""
+    interval=0.5*interval+0.5*min(dt,ACCEL_SLOW_SEC)
+    if STATION_COUNT<ACCEL_MIN_STATIONS or interval>=ACCEL_SLOW_SEC: return 1, interval
+    f=(ACCEL_SLOW_SEC-max(interval,ACCEL_FAST_SEC))/(ACCEL_SLOW_SEC-ACCEL_FAST_SEC)
+    return 1+int(round(f*(ACCEL_MAX-1))), interval
+
+class Radio:
+    def __init__(self, loop):
+        self.loop=loop
+        self.state=IDLE
+        self.amp_on=True
+        self.names=load_names()
+        self.current=load_station(1); self.preview=self.current
+        self.last_turn=0.0; self.turn_interval=ACCEL_SLOW_SEC
+        self.last_frame=0.0; self.prepared=None
+        self.timers={}                   # name -> asyncio.TimerHandle
+        self.splash=splash               # home screen saved for the next boot
+
+    # -- timers --
+    def later(self, key, delay, fn):
+        self.cancel(key); self.timers[key]=self.loop.call_later(delay, fn)
+    def cancel(self, key):
+        h=self.timers.pop(key, None)
+        if h: h.cancel()
+
+    # -- states --
+    def enter(self, state):
+        if state!=self.state: logging.debug("%s -> %s", self.state, state)
+        if self.state==HIDDEN and state!=HIDDEN:
+            try: dev.show()
+            except: pass
+        self.state=state
+        if state==TUNING: return
+        for k in ("tuning","frame"): self.cancel(k)
+        if state==AMP_OFF: self.later("oled_off", OLED_OFF_DELAY, lambda: self.enter(HIDDEN))
+        else: self.cancel("oled_off")
+        if state==HIDDEN:
+            try: dev.hide()
+            except: oled.clear()
+    def rest(self):
+        """Leave TUNING (or a message) for whatever the amp says we should be showing."""
+        self.enter(IDLE if self.amp_on else AMP_OFF)
+        self.show_home()
+    def show_home(self):
+        if self.state not in (IDLE, AMP_OFF): return
+        frame=draw_centered(station_name(self.current,self.names))
+        if frame!=self.splash: save_splash(frame); self.splash=frame
+
+    # -- tuning display --
+    def request_render(self):
+        if "frame" in self.timers: return  # a frame is already due; it will show the newest preview
+        self.later("frame", max(0.0, self.last_frame+1.0/RENDER_HZ-self.loop.time()), self.render)
+    def render(self):
+        self.timers.pop("frame", None)
+        if self.state!=TUNING: return
+        now=self.loop.time(); self.last_frame=now
+        ph=(now-self.last_turn)/BLINK_ONOFF_SECONDS
+        draw_centered(station_name(self.preview,self.names), blank=int(ph)%2==1)
+        self.later("frame", (int(ph)+1-ph)*BLINK_ONOFF_SECONDS, self.render)  # next blink edge
+        if self.preview!=self.prepared:
+            SWITCHER.prepare(self.preview, *neighbours(self.preview)); self.prepared=self.preview
+
+    # -- input (called on the loop via call_soon_threadsafe) --
+    def on_step(self, direction):
+        now=self.loop.time()
+        n,self.turn_interval=accel_steps(self.turn_interval, now-self.last_turn)
+        EVENTS["cw" if direction>0 else "ccw"].inc(); STEPS.inc(n)
+        if self.state!=TUNING:
+            self.enter(TUNING); self.preview=self.current
+        self.preview=(self.preview-1+direction*n)%STATION_COUNT+1
+        self.last_turn=now
+        self.cancel("frame"); self.request_render()
+        self.later("tuning", TUNING_TIMEOUT_SEC, self.rest)
+
+    def on_click(self):
+        EVENTS["click"].inc()
+        self.cancel("message")
+        if self.state!=TUNING:
+            self.rest(); return
+        self.current=self.preview; save_station(self.current)
+        self.names=load_names()
+        self.rest()
+        self.loop.create_task(select(self.current))
+        bus.publish(bus.STATION_CHANGED, station=f"{self.current:02d}", name=station_name(self.current,self.names))
+
+    def on_hold(self):
+        EVENTS["hold"].inc()
+        self.loop.create_task(self.mpd("stop"))
+        self.rest()
+
+    # -- MPD --
+    async def mpd(self, *cmds):
+        try: return await MPD.command_list(cmds)
+        except (MPDError, OSError, asyncio.TimeoutError): return None
+
+    # ---- event bus: amp_monitor / portal / web UI push, nothing is polled ----
+    def on_amp_state(self, msg):
+        self.amp_on=bool(msg.get("on", True))
+        if self.state==TUNING: return  # rest() picks the right state when tuning ends
+        self.cancel("message"); self.rest()
+
+    def on_display_message(self, msg):
+        text=(msg.get("text") or "").strip()
+        if not text: return
+        self.enter(IDLE if self.amp_on else AMP_OFF)  # also wakes a hidden panel
+        draw_centered(text)
+        if self.amp_on and not msg.get("sticky"): self.later("message", MESSAGE_HOLD_SEC, self.show_home)
+        else: self.cancel("message")
+
+    def on_station_changed(self, msg):
+        try: n=int(msg.get("station"))
+        except (TypeError, ValueError): return
+        if n!=self.current:
+            self.current=n; save_station(n); self.names=load_names()
+            self.show_home()
+            SWITCHER.prepare(*neighbours(n))
+
+EVENTS={e: metrics.counter("encoder_events_total", "Knob events by kind.", event=e) for e in ("cw","ccw","click","hold")}
+STEPS=metrics.counter("encoder_steps_total", "Station steps after acceleration.")
+
+radio=Radio(loop)
+
+def threadsafe(fn, *args):
+    """gpiozero calls back on its own threads; run ``fn`` on the loop instead."""
+    return lambda: loop.call_soon_threadsafe(fn, *args)
+
+from gpiozero import RotaryEncoder, Button   # slowest import: pin factory probing
+enc=RotaryEncoder(a=ENC_A,b=ENC_B,max_steps=0)
 btn=Button(ENC_BTN,pull_up=True,bounce_time=0.05)
-enc.when_rotated=on_rotate
-btn.when_pressed=on_click
+enc.when_rotated_clockwise=threadsafe(radio.on_step, +1)
+enc.when_rotated_counter_clockwise=threadsafe(radio.on_step, -1)
+btn.when_pressed=threadsafe(radio.on_click)
 btn.hold_time=1.5
-btn.when_held=on_hold
-
-draw_centered(station_name(current,names_cache), blank=False)
-mpd_select_station(current)
+btn.when_held=threadsafe(radio.on_hold)
 
-def watch_temp_messages():
-    last=""
-    while True:
-        try:
-            if os.path.exists("/tmp/display_message"):
-                msg=open("/tmp/display_message").read().strip()
-                if msg and msg!=last:
-                    dev.show()
-                    draw_centered(msg, blank=False)
-                    last=msg
-        except: pass
-        time.sleep(1)
-threading.Thread(target=watch_temp_messages,daemon=True).start()
-
-oled_hidden=False
-last_amp_off_at=None
-def current_amp_state():
-    try: return open(AMP_STATE_FILE).read().strip().upper()=="ON"
-    except: return True
-
-def oled_off():
-    global oled_hidden
-    if not oled_hidden:
-        try: dev.hide()
-        except: dev.clear()
-        oled_hidden=True
-
-def oled_on_and_render():
-    global oled_hidden
-    if oled_hidden:
-        try: dev.show()
-        except: pass
-        oled_hidden=False
-    draw_centered(station_name(current,names_cache), blank=False)
-
-def amp_oled_power_manager():
-    global last_amp_off_at
-    was_on=None
-    while True:
-        amp_on=current_amp_state()
-        now=time.time()
-        if amp_on:
-            last_amp_off_at=None
-            oled_on_and_render()
-        else:
-            if was_on is True:
-                last_amp_off_at=now
-            if last_amp_off_at and (now-last_amp_off_at>=OLED_OFF_DELAY):
-                oled_off()
-        was_on=amp_on
-        time.sleep(0.5)
-
-threading.Thread(target=amp_oled_power_manager,daemon=True).start()
+boot_phase("gpio")
+radio.show_home()
+bus.Subscriber("station_radio", {
+    bus.AMP_STATE: radio.on_amp_state,
+    bus.DISPLAY_MESSAGE: radio.on_display_message,
+    bus.STATION_CHANGED: radio.on_station_changed,
+}, replay=(bus.AMP_STATE,)).start(loop)
+metrics.serve("station_radio")   # /metrics on the web app scrapes this; idle until asked
+loop.create_task(feed_queue())
+boot_phase("ready")
+logging.info("boot: %s", ", ".join(f"{name} {t:.2f}s" for name,t in BOOT))
 
+try: loop.add_signal_handler(signal.SIGTERM, loop.stop)   # exit cleanly so pending state is flushed
+except (ValueError, RuntimeError): pass                  # not the main thread (bench harness)
 try:
-    while True: time.sleep(0.2)
+    loop.run_forever()
 except KeyboardInterrupt:
-    dev.clear()
+    oled.clear()
@@ -0,0 +1,19 @@
+"""Keep the suite off the real home directory, bus and MPD.
+
+Runs before any test module imports radiolib or the web app, whose
+paths (``~/music``, ``~/.radio_state.json``, the bus directory) and MPD
+address are read at import time. MPD is the bench's stand-in.
+"""
+import os, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HOME = tempfile.mkdtemp(prefix="radio-tests-")
+os.makedirs(os.path.join(HOME, "music"))
+os.environ.update(HOME=HOME, RADIO_BUS_DIR=os.path.join(HOME, "bus"))
+
+from bench.mock_mpd import MockMPDServer  # noqa: E402
+
+MPD = MockMPDServer(os.path.join(HOME, "music")).start()
+os.environ.update(MPD_HOST="127.0.0.1", MPD_PORT=str(MPD.port))
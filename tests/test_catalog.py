@@ -0,0 +1,115 @@
+"""radiolib.catalog.Catalog: deduplication and keyset pagination."""
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiolib.catalog import Catalog, _cursor, _uncursor  # noqa: E402
+
+AUDIO = (b"\xff\xfb\x90\x00" + bytes(413)) * 30
+
+
+def id3(title):
+    t = title.encode()
+    frame = b"TIT2" + (len(t) + 1).to_bytes(4, "big") + b"\x00\x00\x00" + t
+    return b"ID3\x03\x00\x00" + len(frame).to_bytes(4, "big") + frame
+
+
+def put(root, station, name, data):
+    d = root / station
+    d.mkdir(exist_ok=True)
+    (d / name).write_bytes(data)
+    return d / name
+
+
+def catalog(root):
+    cat = Catalog(str(root))
+    cat.refresh(force=True)
+    cat.enrich()
+    return cat
+
+
+def test_dedupe_links_only_matching_tags(tmp_path):
+    copies = {s: put(tmp_path, s, "x.mp3", id3(t) + AUDIO)
+              for s, t in (("01", "A"), ("02", "A"), ("03", "B"), ("04", "B"))}
+    other = put(tmp_path, "05", "y.mp3", id3("A") + AUDIO + b"other audio")
+    cat = catalog(tmp_path)
+    res = cat.dedupe()
+    assert res["linked"] == 2 and res["stations"] == ["02", "04"]
+    assert res["bytes"] == 2 * len(id3("A") + AUDIO)
+    assert res["tags_differ"] == 2                       # 03 and 04 keep their own tags
+    ino = {s: os.stat(p).st_ino for s, p in copies.items()}
+    assert ino["01"] == ino["02"] != ino["03"] == ino["04"]
+    assert copies["02"].read_bytes() == id3("A") + AUDIO
+    assert copies["04"].read_bytes() == id3("B") + AUDIO
+    assert os.stat(other).st_nlink == 1
+    assert not [n for s in copies for n in os.listdir(tmp_path / s) if n.endswith(".tmp")]
+
+
+def test_dedupe_again_finds_nothing(tmp_path):
+    for s in ("01", "02"):
+        put(tmp_path, s, "x.mp3", id3("A") + AUDIO)
+    put(tmp_path, "03", "x.mp3", id3("B") + AUDIO)
+    cat = catalog(tmp_path)
+    assert cat.dedupe()["linked"] == 1
+    again = cat.dedupe()
+    assert (again["linked"], again["bytes"], again["tags_differ"]) == (0, 0, 1)
+
+
+def walk(cat, station, after=None, **kw):
+    """Every page of ``station`` from ``after`` on; returns (names, number of pages)."""
+    names, pages = [], 0
+    while True:
+        page = cat.page(station, after=after, **kw)
+        names += [t["name"] for t in page["tracks"]]
+        pages += 1
+        after = page["next"]
+        if after is None:
+            return names, pages
+
+
+def test_cursor_round_trip():
+    for key, name in ((12, "a.mp3"), (None, "Ünïcode – ♫.mp3"), (-1, "x,y\"z.mp3")):
+        assert _uncursor(_cursor(key, name)) == (key, name)
+    with pytest.raises(ValueError):
+        _uncursor("not a cursor")
+
+
+def test_pages_cover_everything_once(tmp_path):
+    for i in range(25):
+        put(tmp_path, "01", f"{i:02d}.mp3", bytes(i % 4 + 1))     # ties on size
+    cat = catalog(tmp_path)
+    names, pages = walk(cat, "01", limit=10)
+    assert names == [f"{i:02d}.mp3" for i in range(25)] and pages == 3
+    by_size, _ = walk(cat, "01", sort="size", desc=True, limit=4)
+    assert by_size == sorted(names, key=lambda n: (int(n[:2]) % 4, n), reverse=True)
+
+
+def test_last_page(tmp_path):
+    for i in range(20):
+        put(tmp_path, "01", f"{i:02d}.mp3", b"x")
+    cat = catalog(tmp_path)
+    first = cat.page("01", limit=10)
+    last = cat.page("01", limit=10, after=first["next"])
+    assert len(last["tracks"]) == 10 and last["next"] is None     # no empty page after it
+    assert last["total"] == 20
+    assert cat.page("01", limit=50)["next"] is None
+
+
+def test_inserts_and_deletes_do_not_shift_later_pages(tmp_path):
+    for i in range(0, 40, 2):
+        put(tmp_path, "01", f"{i:02d}.mp3", b"x")
+    cat = catalog(tmp_path)
+    first = cat.page("01", limit=5)
+    seen = [t["name"] for t in first["tracks"]]
+    assert seen[-1] == "08.mp3"
+    os.unlink(tmp_path / "01" / "04.mp3")                # already shown
+    os.unlink(tmp_path / "01" / "12.mp3")                # not yet shown
+    put(tmp_path, "01", "01.mp3", b"x")                  # before the cursor
+    put(tmp_path, "01", "09.mp3", b"x")                  # after it
+    cat.refresh("01")
+    rest, _ = walk(cat, "01", limit=5, after=first["next"])
+    assert rest[0] == "09.mp3"
+    assert not set(rest) & set(seen)
+    assert rest == sorted(n for n in os.listdir(tmp_path / "01") if n > "08.mp3")
@@ -0,0 +1,154 @@
+"""radiolib.ingest.Ingest's queue, recovery and cancelling, with a fake ffmpeg on PATH."""
+import os, sys, threading, time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiolib import ingest  # noqa: E402
+from radiolib.ingest import PREFIX, Ingest  # noqa: E402
+
+# Copies its input to the output after a progress line. Inputs containing
+# BAD fail like a damaged file; SLOW ones take a few seconds.
+FAKE_FFMPEG = """#!%s
+import sys, time
+args = sys.argv[1:]
+src = open(args[args.index("-i") + 1], "rb").read()
+print("out_time_us=500000", flush=True)
+if b"SLOW" in src:
+    time.sleep(5)
+if b"BAD" in src:
+    sys.stderr.write("noise\\n" * 1000 + "Invalid data found when processing input\\n")
+    sys.exit(1)
+open(args[-1], "wb").write(src)
+print("progress=end", flush=True)
+"""
+FAKE_FFPROBE = "#!/bin/sh\necho 1.0\n"
+
+
+def until(cond, timeout=10.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+@pytest.fixture
+def music(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in (("ffmpeg", FAKE_FFMPEG % sys.executable), ("ffprobe", FAKE_FFPROBE)):
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    root = tmp_path / "music"
+    (root / "01").mkdir(parents=True)
+    return root
+
+
+class Filed:
+    """A ``commit`` that files into the station folder and remembers what it did."""
+
+    def __init__(self, root):
+        self.root, self.names = root, []
+
+    def __call__(self, path, station, filename):
+        os.replace(path, os.path.join(self.root, station, filename))
+        self.names.append(filename)
+        return filename, "stored"
+
+
+def upload(tmp_path, name, data):
+    p = tmp_path / name
+    p.write_bytes(data)
+    return str(p)
+
+
+def settled(ing, *uids):
+    return until(lambda: all(ing.job(u)["state"] in ("done", "failed", "cancelled") for u in uids))
+
+
+def test_jobs_run_in_order_and_are_filed(tmp_path, music):
+    filed = Filed(music)
+    ing = Ingest(str(music), filed)
+    a = ing.submit(upload(tmp_path, "a.flac", b"one"), "01", "a.flac")
+    b = ing.submit(upload(tmp_path, "b.wav", b"two"), "01", "b.wav")
+    assert settled(ing, a["id"], b["id"])
+    assert [ing.job(u)["state"] for u in (a["id"], b["id"])] == ["done", "done"]
+    assert ing.job(a["id"])["progress"] == 1.0 and filed.names == ["a.mp3", "b.mp3"]
+    assert (music / "01" / "b.mp3").read_bytes() == b"two"
+    assert not [n for n in os.listdir(music / "01") if n.startswith(PREFIX)]
+
+
+def test_a_failing_file_does_not_stop_the_queue(tmp_path, music):
+    ing = Ingest(str(music), Filed(music))
+    bad = ing.submit(upload(tmp_path, "bad.flac", b"BAD"), "01", "bad.flac")
+    good = ing.submit(upload(tmp_path, "good.flac", b"fine"), "01", "good.flac")
+    assert settled(ing, bad["id"], good["id"])
+    assert ing.job(bad["id"])["state"] == "failed"
+    assert ing.job(bad["id"])["error"] == "Invalid data found when processing input"
+    assert ing.job(good["id"])["state"] == "done"
+    assert sorted(os.listdir(music / "01")) == ["good.mp3"]
+
+
+def test_recovery_requeues_sources_and_drops_partial_outputs(music):
+    (music / "01" / f"{PREFIX}abc123-left.flac").write_bytes(b"left over")
+    (music / "01" / f"{PREFIX}abc123.out.mp3").write_bytes(b"half")
+    ing = Ingest(str(music), Filed(music))
+    assert settled(ing, "abc123")
+    assert ing.job("abc123")["state"] == "done"
+    assert sorted(os.listdir(music / "01")) == ["left.mp3"]
+
+
+def test_cancel_queued_and_running(tmp_path, music):
+    filed = Filed(music)
+    ing = Ingest(str(music), filed)
+    slow = ing.submit(upload(tmp_path, "slow.flac", b"SLOW"), "01", "slow.flac")
+    queued = ing.submit(upload(tmp_path, "q.flac", b"q"), "01", "q.flac")
+    assert until(lambda: ing.job(slow["id"])["state"] == "running" and ing._current)
+    assert ing.cancel(queued["id"]) and ing.job(queued["id"])["state"] == "cancelled"
+    assert ing.cancel(slow["id"])
+    assert settled(ing, slow["id"])
+    assert ing.job(slow["id"])["state"] == "cancelled" and ing.job(slow["id"])["error"] is None
+    assert filed.names == [] and os.listdir(music / "01") == []
+    assert not ing.cancel(slow["id"])
+
+
+def test_cancel_after_ffmpeg_finished_wins(tmp_path, music, monkeypatch):
+    filed = Filed(music)
+    ing = Ingest(str(music), filed)
+    transcode, cancelled = ing._transcode, []
+
+    def then_cancel(job, out):                  # the cancel lands between ffmpeg and filing
+        transcode(job, out)
+        cancelled.append(ing.cancel(job["id"]))
+    monkeypatch.setattr(ing, "_transcode", then_cancel)
+    job = ing.submit(upload(tmp_path, "late.flac", b"late"), "01", "late.flac")
+    assert settled(ing, job["id"])
+    assert cancelled == [True] and ing.job(job["id"])["state"] == "cancelled"
+    assert filed.names == [] and os.listdir(music / "01") == []
+
+
+def test_cancel_while_filing_is_too_late(tmp_path, music):
+    entered, release, answers = threading.Event(), threading.Event(), []
+    filed = Filed(music)
+
+    def slow_commit(path, station, filename):
+        entered.set()
+        release.wait(5)
+        return filed(path, station, filename)
+    ing = Ingest(str(music), slow_commit)
+    job = ing.submit(upload(tmp_path, "x.flac", b"x"), "01", "x.flac")
+    assert entered.wait(10)
+    answers.append(ing.cancel(job["id"]))
+    release.set()
+    assert settled(ing, job["id"])
+    assert answers == [False] and ing.job(job["id"])["state"] == "done"
+    assert filed.names == ["x.mp3"]
+
+
+def test_disabled_without_ffmpeg(music, monkeypatch):
+    monkeypatch.setattr(ingest.shutil, "which", lambda name: None)
+    assert not Ingest(str(music), Filed(music)).enabled
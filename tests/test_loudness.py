@@ -0,0 +1,143 @@
+"""ID3 editing in radiolib.loudness.write_tags."""
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiolib import loudness  # noqa: E402
+from radiolib.loudness import Analyzer, _frames, _syncsafe, _unsyncsafe, write_tags  # noqa: E402
+
+AUDIO = b"\xff\xfb\x90\x00" + bytes(413)
+RG = {"REPLAYGAIN_TRACK_GAIN": "-3.20 dB", "REPLAYGAIN_TRACK_PEAK": "0.950000"}
+
+
+def frame(fid, data, major, size=None):
+    n = len(data) if size is None else size
+    return fid + (_syncsafe(n) if major == 4 else n.to_bytes(4, "big")) + b"\x00\x00" + data
+
+
+def text(fid, value, major):
+    return frame(fid, b"\x03" + value.encode(), major)
+
+
+def mp3(path, frames, major=4, padding=0):
+    body = b"".join(frames) + bytes(padding)
+    with open(path, "wb") as f:
+        f.write(b"ID3" + bytes((major, 0, 0)) + _syncsafe(len(body)) + body + AUDIO * 4)
+    return path
+
+
+def read_tag(path):
+    with open(path, "rb") as f:
+        head = f.read(10)
+        body = f.read(_unsyncsafe(head[6:10]))
+        audio = f.read()
+    return head[3], _frames(body, head[3]), audio
+
+
+def by_id(frames):
+    return {fid: data for fid, _, data in frames if fid != b"TXXX"}
+
+
+def txxx(frames):
+    return sorted(data for fid, _, data in frames if fid == b"TXXX")
+
+
+@pytest.mark.parametrize("major", [3, 4])
+def test_edit_within_padding_keeps_frames(tmp_path, major):
+    p = mp3(tmp_path / "a.mp3", [text(b"TIT2", "Song", major), text(b"TPE1", "Artist", major)],
+            major, padding=512)
+    before = os.stat(p)
+    assert write_tags(str(p), RG) is not None
+    after = os.stat(p)
+    assert after.st_size == before.st_size                # fitted in the padding
+    assert after.st_ino != before.st_ino                  # a renamed copy, never torn in place
+    assert after.st_mtime_ns == before.st_mtime_ns
+    got_major, frames, audio = read_tag(p)
+    assert got_major == major and audio == AUDIO * 4
+    assert by_id(frames) == {b"TIT2": b"\x03Song", b"TPE1": b"\x03Artist"}
+    assert len(txxx(frames)) == 2
+    assert write_tags(str(p), RG) is None                 # unchanged values: no write
+
+
+@pytest.mark.parametrize("major", [3, 4])
+def test_rewrite_when_no_room(tmp_path, major):
+    pic = b"\x00image/jpeg\x00\x03\x00" + os.urandom(600)
+    p = mp3(tmp_path / "b.mp3", [text(b"TPE1", "Artist", major), frame(b"APIC", pic, major)], major)
+    assert write_tags(str(p), RG) is not None
+    _, frames, audio = read_tag(p)
+    assert by_id(frames) == {b"TPE1": b"\x03Artist", b"APIC": pic} and len(txxx(frames)) == 2
+    assert audio == AUDIO * 4
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".tmp")]
+
+
+def test_v24_with_big_endian_sizes(tmp_path):
+    pic = b"\x00image/png\x00\x03\x00" + bytes(range(256)) * 2   # 528 bytes: not syncsafe
+    p = mp3(tmp_path / "c.mp3", [frame(b"APIC", pic, 3), text(b"TPE1", "Artist", 3)], 4, padding=64)
+    assert write_tags(str(p), RG) is not None
+    _, frames, _ = read_tag(p)
+    assert by_id(frames) == {b"APIC": pic, b"TPE1": b"\x03Artist"}
+
+
+def test_malformed_tag_is_left_alone(tmp_path):
+    broken = text(b"TIT2", "Song", 4) + frame(b"APIC", b"\x00" * 40, 4, size=4000) + text(b"TPE1", "A", 4)
+    p = mp3(tmp_path / "d.mp3", [broken], 4, padding=32)
+    before = open(p, "rb").read()
+    with pytest.raises(ValueError):
+        write_tags(str(p), RG)
+    assert open(p, "rb").read() == before
+
+
+def test_untagged_file_gets_a_tag(tmp_path):
+    p = tmp_path / "e.mp3"
+    p.write_bytes(AUDIO * 4)
+    assert write_tags(str(p), RG) is not None
+    _, frames, audio = read_tag(p)
+    assert audio == AUDIO * 4 and len(txxx(frames)) == 2
+
+
+def test_hardlinked_track_is_not_retagged(tmp_path):
+    p = mp3(tmp_path / "f.mp3", [text(b"TPE1", "Artist", 4)], 4, padding=512)
+    os.link(p, tmp_path / "g.mp3")
+    before = open(p, "rb").read()
+    with pytest.raises(ValueError):
+        write_tags(str(p), RG)
+    assert open(p, "rb").read() == before and os.stat(p).st_nlink == 2
+
+
+def fake_measure(path):
+    return -23.0 if path.endswith("a.mp3") else -13.0, -1.0, 180.0
+
+
+def logged_write_tags(path, values):
+    with open(os.path.join(os.path.dirname(os.path.dirname(path)), "writes.log"), "a") as f:
+        f.write(os.path.basename(path) + "\n")     # the pool's workers are other processes
+    return write_tags(path, values)
+
+
+def test_unchanged_station_is_not_retagged(tmp_path, monkeypatch):
+    monkeypatch.setattr(loudness, "measure", fake_measure)
+    monkeypatch.setattr(loudness, "write_tags", logged_write_tags)
+    writes = tmp_path / "writes.log"
+    station = tmp_path / "01"
+    station.mkdir()
+    for n, name in enumerate(("a.mp3", "b.mp3")):
+        with open(mp3(station / name, [text(b"TIT2", name, 4)], 4, padding=512), "ab") as f:
+            f.write(AUDIO * n)                  # different audio, so each is measured
+    an = Analyzer(str(tmp_path))
+    try:
+        an._station("01")
+        assert (an.counts["measured"], an.counts["tagged"]) == (2, 2)
+        inodes = {n: os.stat(station / n).st_ino for n in ("a.mp3", "b.mp3")}
+        an._station("01")
+        assert (an.counts["measured"], an.counts["tagged"]) == (2, 2)
+        assert writes.read_text().split() == ["a.mp3", "b.mp3"]     # not even opened again
+        assert {n: os.stat(station / n).st_ino for n in inodes} == inodes
+        assert an.albums["01"]["tracks"] == 2
+        os.unlink(station / "b.mp3")            # album gain moves by 7 dB: a.mp3 is retagged
+        an._station("01")
+        assert an.counts["tagged"] == 3 and an.albums["01"]["tracks"] == 1
+    finally:
+        if an._procs:
+            an._procs.shutdown()
@@ -0,0 +1,49 @@
+"""Shared play history in radiolib.shuffle.Shuffler."""
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiolib import state  # noqa: E402
+from radiolib.shuffle import Shuffler  # noqa: E402
+
+
+def two_processes(tmp_path):
+    """Two Shufflers on one file, each with its own in-memory Document, as in two processes."""
+    music = tmp_path / "music"
+    (music / "01").mkdir(parents=True)
+    path = str(tmp_path / "shuffle.json")
+    state._docs.pop(os.path.abspath(path), None)
+    a = Shuffler(str(music), path=path)
+    state._docs.pop(os.path.abspath(path), None)
+    b = Shuffler(str(music), path=path)
+    assert a._doc is not b._doc
+    return a, b
+
+
+def test_plays_from_both_processes_are_kept(tmp_path):
+    a, b = two_processes(tmp_path)
+    a.played("01/x.mp3")
+    b.played("01/y.mp3")
+    a.keep("01", ["01/q.mp3"])
+    b.played("01/z.mp3")
+    want = {"history": ["x.mp3", "y.mp3", "z.mp3"], "queue": ["q.mp3"]}
+    assert a._doc.get("01") == want
+    assert b._doc.get("01") == want
+
+
+def test_back_sees_the_other_process(tmp_path):
+    a, b = two_processes(tmp_path)
+    a.played("01/x.mp3")
+    a.played("01/y.mp3")
+    b.played("01/z.mp3")
+    assert a.back("01") == "01/y.mp3"
+    assert b._doc.get("01")["history"] == ["x.mp3"]
+
+
+def test_exclusive_lets_one_holder_in(tmp_path):
+    a, b = two_processes(tmp_path)
+    with a.exclusive() as first:
+        with b.exclusive() as second:
+            assert (first, second) == (True, False)
+    with b.exclusive() as again:
+        assert again
@@ -0,0 +1,104 @@
+"""radiolib.state.Document: merging, delayed flushes and reloads."""
+import json, os, sys, time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiolib import state  # noqa: E402
+from radiolib.state import Document  # noqa: E402
+
+
+def on_disk(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def leftovers(tmp_path):
+    return [n for n in os.listdir(tmp_path) if n.endswith(".tmp")]
+
+
+def test_writers_of_different_keys_merge(tmp_path):
+    path = str(tmp_path / "s.json")
+    a, b = Document(path, delay=60), Document(path, delay=60)     # as in two processes
+    a.update(volume=40)
+    b.update(station="03")
+    b.flush()
+    a.flush()
+    assert on_disk(path) == {"volume": 40, "station": "03"}
+    b.remove("station")
+    b.flush()
+    assert on_disk(path) == {"volume": 40}
+
+
+def test_delayed_write_flushes_once(tmp_path):
+    path = str(tmp_path / "s.json")
+    doc = Document(path, delay=0.1)
+    for v in range(10):
+        doc.update(volume=v)
+    assert doc.get("volume") == 9 and not os.path.exists(path)
+    deadline = time.monotonic() + 5
+    while doc.writes == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert doc.writes == 1 and on_disk(path) == {"volume": 9}
+
+
+def test_reload_after_another_writer(tmp_path):
+    path = str(tmp_path / "s.json")
+    doc = Document(path, delay=0)
+    doc.update(a=1)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"a": 1, "b": 2, "c": 3}, f)       # changes size, hence the signature
+    assert doc.data() == {"a": 1, "b": 2, "c": 3}
+    doc.replace({"c": 4})
+    assert on_disk(path) == {"c": 4}
+
+
+def test_pending_changes_survive_a_reload(tmp_path):
+    path = str(tmp_path / "s.json")
+    doc = Document(path, delay=60)
+    doc.update(mine=1)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"theirs": 2}, f)
+    assert doc.data() == {"mine": 1, "theirs": 2}
+    doc.flush()
+    assert on_disk(path) == {"mine": 1, "theirs": 2}
+
+
+def test_unserialisable_value_is_refused(tmp_path):
+    path = str(tmp_path / "s.json")
+    doc = Document(path, delay=0)
+    doc.update(ok=1)
+    with pytest.raises(TypeError):
+        doc.update(bad={1, 2})
+    doc.update(also=2)
+    assert on_disk(path) == {"ok": 1, "also": 2} and doc._pending == {}
+    assert not leftovers(tmp_path)
+
+
+def test_failed_write_stays_pending(tmp_path, monkeypatch):
+    path = str(tmp_path / "s.json")
+    doc = Document(path, delay=60)
+    doc.update(a=1)
+
+    def broken(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(state.os, "replace", broken)
+    doc.flush()
+    assert doc._pending == {"a": 1} and not leftovers(tmp_path) and not os.path.exists(path)
+    monkeypatch.undo()
+    doc.flush()
+    assert on_disk(path) == {"a": 1} and doc._pending == {}
+
+
+def test_edit_starts_from_the_newest_value(tmp_path):
+    path = str(tmp_path / "s.json")
+    a, b = Document(path, delay=60), Document(path, delay=60)
+    a.edit("plays", lambda v: (v or []) + ["x"])
+    assert b.get("plays") == ["x"]
+    b.edit("plays", lambda v: (v or []) + ["y"])
+    a.edit("plays", lambda v: (v or []) + ["z"])
+    assert on_disk(path) == {"plays": ["x", "y", "z"]}
+    writes = a.writes
+    a.edit("plays", lambda v: v)                     # unchanged: nothing written
+    assert a.writes == writes
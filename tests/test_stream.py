@@ -0,0 +1,97 @@
+"""radiolib.stream's ring buffer and relay, against bench.stream_server."""
+import os, sys, threading, time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stream_server import StreamServer  # noqa: E402
+from radiolib import stream  # noqa: E402
+from radiolib.stream import Relay, Ring  # noqa: E402
+
+
+def until(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(**kw):
+        srv = StreamServer(**kw).start()
+        servers.append(srv)
+        return srv
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+
+def test_ring_wraps_around():
+    ring = Ring(10)
+    ring.write(b"abcdefgh")
+    ring.write(b"ijkl")                         # wraps: holds offsets 2..11
+    assert (ring.start, ring.end) == (2, 12)
+    assert ring.read(6, limit=6) == (6, b"ghijkl")
+    assert ring.read(0, limit=4) == (2, b"cdef")    # overwritten: skipped ahead
+    ring.write(b"0123456789ABC")                # more than capacity: only the tail stays
+    assert ring.read(0, limit=100) == (15, b"3456789ABC")
+    assert ring.read(ring.end, timeout=0.01) == (25, b"")
+
+
+def test_ring_read_wakes_on_write_and_close():
+    ring = Ring(16)
+    got = []
+    t = threading.Thread(target=lambda: got.append(ring.read(0, timeout=5)))
+    t.start()
+    ring.write(b"hi")
+    t.join(2)
+    assert got == [(0, b"hi")]
+    t = threading.Thread(target=lambda: got.append(ring.read(2, timeout=5)))
+    t.start()
+    ring.close()
+    t.join(2)
+    assert got[1] == (2, b"")
+
+
+def test_relay_reconnects_after_a_dropout(server, monkeypatch):
+    monkeypatch.setattr(stream, "BACKOFF_MIN", 0.05)
+    srv = server(kbps=64, burst=0.5, drop_every=0.6, outage=0.4)
+    relay = Relay("90", srv.url, capacity=64 * 1024)
+    try:
+        assert relay.wait_ready(5)
+        assert relay.declared_kbps == 64
+        assert until(lambda: relay.reconnects >= 1 and not relay.connected)
+        before = relay.ring.end
+        assert until(lambda: relay.connected and relay.ring.end > before)
+        assert srv.connections >= 2
+    finally:
+        relay.stop()
+
+
+def test_slow_listener_skips_ahead_without_holding_up_the_relay(server):
+    srv = server(kbps=128, burst=1.0)
+    relay = Relay("91", srv.url, capacity=8 * 1024)
+    got = []
+
+    def slow(data):
+        got.append(len(data))
+        time.sleep(0.3)
+    t = threading.Thread(target=relay.listen, args=(slow,), daemon=True)
+    try:
+        assert relay.wait_ready(5)
+        t.start()
+        assert until(lambda: relay.ring.end > 6 * relay.ring.capacity)
+        assert relay.connected and relay.listeners == 1
+        assert sum(got) < relay.ring.end - relay.ring.capacity    # it missed audio...
+        assert all(n <= relay.ring.capacity for n in got)         # ...in whole-ring skips
+    finally:
+        relay.stop()
+    t.join(2)
+    assert not t.is_alive() and relay.listeners == 0
@@ -0,0 +1,80 @@
+"""The web app's bulk track operations (/api/station/NN/tracks/bulk)."""
+import os, shutil, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "webapp"))
+
+import app as webapp  # noqa: E402
+
+AUDIO = (b"\xff\xfb\x90\x00" + bytes(413)) * 30
+
+
+@pytest.fixture
+def stations():
+    """Stations 41 and 42 with a few tracks, removed again afterwards."""
+    made = {}
+    for st, names in (("41", ("a.mp3", "b.mp3", "c.mp3")), ("42", ("z.mp3",))):
+        d = os.path.join(webapp.MUSIC_ROOT, st)
+        os.makedirs(d)
+        for i, n in enumerate(names):
+            with open(os.path.join(d, n), "wb") as f:
+                f.write(AUDIO + n.encode() * (i + 1))
+        made[st] = d
+        webapp.CATALOG.refresh(st)
+    webapp.CATALOG.enrich()
+    yield made
+    for st, d in made.items():
+        shutil.rmtree(d, ignore_errors=True)
+        webapp.CATALOG.refresh(st)
+
+
+@pytest.fixture
+def client():
+    return webapp.app.test_client()
+
+
+def bulk(client, station, **body):
+    r = client.post(f"/api/station/{station}/tracks/bulk", json=body)
+    return r.status_code, r.get_json()
+
+
+def test_delete(client, stations):
+    code, res = bulk(client, "41", action="delete", names=["a.mp3", "b.mp3", "gone.mp3", "../42/z.mp3"])
+    assert code == 200 and res["done"] == 2 and not res["ok"]
+    assert {r["name"]: r["ok"] for r in res["results"]} == {
+        "a.mp3": True, "b.mp3": True, "gone.mp3": False, "../42/z.mp3": False}
+    assert sorted(os.listdir(stations["41"])) == ["c.mp3"]
+    assert os.path.isfile(os.path.join(stations["42"], "z.mp3"))
+    assert [t["name"] for t in webapp.CATALOG.tracks("41")] == ["c.mp3"]
+
+
+def test_move_and_copy(client, stations):
+    code, res = bulk(client, "41", action="copy", names=["a.mp3"], to="42")
+    assert code == 200 and res["ok"]
+    src, dst = (os.path.join(stations[s], "a.mp3") for s in ("41", "42"))
+    assert os.stat(src).st_ino == os.stat(dst).st_ino            # a link, not a byte copy
+    code, res = bulk(client, "41", action="move", names=["a.mp3", "b.mp3"], to="42")
+    assert res["ok"] and [r.get("stored") for r in res["results"]] == ["duplicate", None]
+    assert sorted(os.listdir(stations["41"])) == ["c.mp3"]
+    assert sorted(os.listdir(stations["42"])) == ["a.mp3", "b.mp3", "z.mp3"]
+    assert sorted(t["name"] for t in webapp.CATALOG.tracks("42")) == ["a.mp3", "b.mp3", "z.mp3"]
+
+
+@pytest.mark.parametrize("station, body, code", [
+    ("41", {"action": "shred", "names": ["a.mp3"]}, 400),
+    ("41", {"action": "delete", "names": "a.mp3"}, 400),
+    ("41", {"action": "delete", "names": ["a.mp3"] * (webapp.BULK_MAX + 1)}, 400),
+    ("41", {"action": "move", "names": ["a.mp3"], "to": "41"}, 400),
+    ("41", {"action": "copy", "names": ["a.mp3"], "to": "99"}, 400),
+    ("4x", {"action": "delete", "names": ["a.mp3"]}, 404),
+    ("77", {"action": "delete", "names": ["a.mp3"]}, 404),
+])
+def test_rejects_bad_requests(client, stations, station, body, code):
+    assert bulk(client, station, **body)[0] == code
+    assert sorted(os.listdir(stations["41"])) == ["a.mp3", "b.mp3", "c.mp3"]
+
+
+def test_no_get_delete(client, stations):
+    assert client.get("/delete/41/a.mp3").status_code == 404
+    assert os.path.isfile(os.path.join(stations["41"], "a.mp3"))
@@ -1,16 +1,55 @@
 #!/usr/bin/env python3
 from flask import (
-    Flask, render_template, request, redirect, url_for,
-    send_from_directory, flash, jsonify
+    Flask, Request, render_template, request, redirect, url_for,
+    flash, jsonify, abort, Response
 )
-import os, json, subprocess, re, shutil, time
+import os, sys, json, signal, subprocess, shutil, time, threading, tempfile, secrets
+from concurrent.futures import ThreadPoolExecutor
+
+# radiolib/ is installed next to this folder (~/radiolib beside ~/webapp)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from radiolib.mpd import MPDClient, MPDPool, MPDError, to_dict
+from radiolib.switch import StationSwitcher, PLAYLIST_PREFIX
+from radiolib.shuffle import Shuffler
+from radiolib.stream import StreamStations
+from radiolib.warmstart import PositionStore
+from radiolib.services import ServiceStatusCache
+from radiolib.catalog import AudioHasher, Catalog, audio_hash, is_audio, is_station_id, tag_hash
+from radiolib.updater import UpdateCoalescer
+from radiolib.loudness import Analyzer
+from radiolib.ingest import Ingest, accepts, needs_transcode
+from radiolib.eq import Equalizer, PRESETS
+from radiolib.server import Gate, serve
+from radiolib.files import resolve, send_path, send_static
+from radiolib import bus, metrics, state
 
 # ------------------ Paths & constants ------------------
 USER_HOME = os.path.expanduser("~")
 MUSIC_ROOT = os.path.join(USER_HOME, "music")
 NAMES_FILE = os.path.join(MUSIC_ROOT, "stations.json")
-PRESETS = ["EQ Warm","EQ Flat","EQ Voice","EQ Night","EQ Bright","EQ Bypass"]
-PRESET_FILE = "/var/local/eq_preset"
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+IDLE_SUBSYSTEMS = ("player", "mixer", "options", "output", "playlist")
+SSE_KEEPALIVE_SEC = 25
+UPLOAD_PREFIX = ".upload-"          # in-progress uploads live in the station folder
+UPLOAD_BUF = 256 * 1024
+UPLOAD_STALE_SEC = 2 * 24 * 3600    # abandoned resumable uploads are swept after this
+BULK_MAX = 5000                     # tracks per bulk delete/move/copy request
+
+# Serving & concurrency (override in radio-web.service)
+def _env_int(name, default):
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+WEB_HOST = os.environ.get("RADIO_WEB_HOST", "0.0.0.0")
+WEB_PORT = _env_int("RADIO_WEB_PORT", 8080)
+WEB_THREADS = _env_int("RADIO_WEB_THREADS", 8)        # request workers
+WEB_UPLOADS = _env_int("RADIO_WEB_UPLOADS", 2)        # concurrent upload requests
+WEB_STREAMS = _env_int("RADIO_WEB_STREAMS", 3)        # open /api/events streams
+WEB_DOWNLOADS = _env_int("RADIO_WEB_DOWNLOADS", 2)    # track downloads / preview transfers
+WEB_SUBPROCS = _env_int("RADIO_WEB_SUBPROCS", 2)      # concurrent child processes
+WEB_MPD_CONNS = _env_int("RADIO_WEB_MPD_CONNS", 3)    # pooled MPD connections
 
 # Services we expose in Settings > Services table
 SERVICE_ALLOWLIST = [
@@ -21,62 +60,157 @@ SERVICE_ALLOWLIST = [
     "radio-portal",
     "eq-apply",
     "amp-monitor",
+    "radio-stream",
     "ssh",
 ]
 
-app = Flask(__name__)
+# Persistent MPD connections shared by all request threads
+MPD = MPDPool(size=WEB_MPD_CONNS)
+# Station names, parsed once and re-read only when the file changes (shared with the knob)
+NAMES = state.document(NAMES_FILE, delay=0, indent=2)
+# Internet-stream stations: URLs under "streams" in stations.json, played through the local relay
+INTERNET = StreamStations(NAMES_FILE)
+# Child processes (systemctl, df, ...) run here, never more than WEB_SUBPROCS at once
+SUBPROCS = ThreadPoolExecutor(max_workers=WEB_SUBPROCS, thread_name_prefix="subproc")
+# One `systemctl show` for all allow-listed units, cached
+SERVICES = ServiceStatusCache(SERVICE_ALLOWLIST, executor=SUBPROCS)
+# Indexed library (~/music/.catalog.db); tags/durations probed in background
+CATALOG = Catalog(MUSIC_ROOT)
+CATALOG.run_enricher()
+# Stations resume where they were left and shuffle with history (both shared with the
+# knob, which keeps the rolling queue topped up)
+SWITCHER = StationSwitcher(MPD, MUSIC_ROOT, positions=PositionStore(),
+                           shuffler=Shuffler(MUSIC_ROOT, catalog=CATALOG), streams=INTERNET)
+# ReplayGain analysis/tagging at idle priority (~/music/.loudness.db). The startup pass only
+# stats files: ffmpeg and retagging run just for stations with new, changed or removed tracks
+ANALYZER = Analyzer(MUSIC_ROOT, pool=MPD)
+ANALYZER.schedule()
+# Live EQ on the single MPD output: curves glide in place, no output switching
+EQ = Equalizer()
+# Debounced, station-scoped `update NN` in the background; changed stations get analysed
+UPDATER = UpdateCoalescer(MPD, on_flush=ANALYZER.schedule)
+# Uploads and SSE streams hold a worker for a long time; cap them so
+# status and control requests always find a free one
+UPLOADS = Gate("uploads", WEB_UPLOADS)
+STREAMS = Gate("event streams", WEB_STREAMS)
+DOWNLOADS = Gate("downloads", WEB_DOWNLOADS)
+PROFILES = Gate("profiles", 1)      # /debug/profile holds a worker for up to a minute
+
+class HashingSpool:
+    """File wrapper that hashes the audio as the upload is written."""
+    def __init__(self, f):
+        self._f, self.hasher = f, AudioHasher()
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+class UploadRequest(Request):
+    """Spool multipart file parts straight into the target station folder.
+
+    Werkzeug would otherwise buffer each part in /tmp and FileStorage.save()
+    would copy it again; here the part is written once next to its final
+    name (hashed on the way) and committed with fsync + link/rename.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        station = (self.view_args or {}).get("station", "")
+        if self.endpoint == "upload" and is_station_id(station):
+            d = os.path.join(MUSIC_ROOT, station)
+            os.makedirs(d, exist_ok=True)
+            return HashingSpool(tempfile.NamedTemporaryFile("wb+", dir=d, prefix=UPLOAD_PREFIX,
+                                                            suffix=".part", delete=False))
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app = Flask(__name__, static_folder=None)  # /static is served below, precompressed
+app.request_class = UploadRequest
 app.secret_key = "retro_radio_secret"
 app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024 * 1024  # 1 GB uploads
 
+# ------------------ Metrics ------------------
+@app.before_request
+def _request_started():
+    request.environ["radio.t0"] = time.perf_counter()
+
+@app.after_request
+def _request_finished(resp):
+    t0 = request.environ.get("radio.t0")
+    if t0 is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.histogram("http_request_seconds", "Web requests by route (streams: until the first byte).",
+                          route=route, method=request.method, status=resp.status_code
+                          ).observe(time.perf_counter() - t0)
+    return resp
+
+def _timed(argv):
+    """Time one child process, labelled by program (looking past sudo)."""
+    words = [w for w in argv if w != "sudo"] or ["?"]
+    return metrics.histogram("subprocess_seconds", "Child processes run, by program.",
+                             cmd=os.path.basename(words[0])).time()
+
 # ------------------ Helpers ------------------
-def sh(cmd: str, timeout: int = 10) -> int:
-    """Run a shell command, non-throwing."""
+def _sh(cmd, timeout):
     try:
-        subprocess.run(cmd, shell=True, check=False, timeout=timeout)
+        with _timed(cmd.split()):
+            subprocess.run(cmd, shell=True, check=False, timeout=timeout)
         return 0
     except Exception:
         return 1
 
-def run(cmd_list, timeout: int = 10):
-    """Run a command list, capture stdout (utf-8), return (rc, out)."""
+def sh(cmd: str, timeout: int = 10) -> int:
+    """Run a shell command on the subprocess pool, non-throwing."""
+    return SUBPROCS.submit(_sh, cmd, timeout).result()
+
+def _run(cmd_list, timeout):
     try:
-        out = subprocess.check_output(cmd_list, stderr=subprocess.STDOUT, timeout=timeout)
+        with _timed(cmd_list):
+            out = subprocess.check_output(cmd_list, stderr=subprocess.STDOUT, timeout=timeout)
         return 0, out.decode("utf-8", "ignore")
     except subprocess.CalledProcessError as e:
         return e.returncode, e.output.decode("utf-8", "ignore")
     except Exception as e:
         return 1, str(e)
 
-def load_names():
+def run(cmd_list, timeout: int = 10):
+    """Run a command list on the subprocess pool, capture stdout (utf-8), return (rc, out)."""
+    return SUBPROCS.submit(_run, cmd_list, timeout).result()
+
+def mpd(*commands):
+    """Run MPD commands in one round trip, non-throwing.
+
+    Each command is ``"name"`` or ``("name", arg, ...)``. Returns a list of
+    ``(key, value)`` pair-lists, one per command, or None on failure.
+    """
     try:
-        with open(NAMES_FILE, encoding="utf-8") as f:
-            data = json.load(f)
-        return {k: v for k, v in data.items() if len(k) == 2 and k.isdigit()}
-    except Exception:
-        return {}
+        return MPD.command_list(commands)
+    except (MPDError, OSError) as e:
+        app.logger.warning("MPD %s failed: %s", commands, e)
+        return None
+
+def load_names():
+    # In memory; stations.json is re-parsed only after someone else changes it
+    return state.station_names(NAMES)
 
 def save_names(n):
-    os.makedirs(os.path.dirname(NAMES_FILE), exist_ok=True)
-    tmp = NAMES_FILE + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(n, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, NAMES_FILE)
+    # Written through at once (the radio re-reads it on the next bus event); other keys
+    # ("streams") are kept
+    names = load_names()
+    NAMES.replace(dict({k: v for k, v in NAMES.data().items() if k not in names}, **n))
 
 def station_dirs():
-    if not os.path.isdir(MUSIC_ROOT):
-        return []
-    return sorted([d for d in os.listdir(MUSIC_ROOT)
-                   if len(d) == 2 and d.isdigit()
-                   and os.path.isdir(os.path.join(MUSIC_ROOT, d))])
+    return CATALOG.stations()
 
 def get_stations():
-    names = load_names()
-    items = [{"id": d, "label": names.get(d, f"Station {d}")} for d in station_dirs()]
+    names, streams = load_names(), INTERNET.all()
+    items = [{"id": d, "label": names.get(d, f"Station {d}"), "stream": d in streams}
+             for d in sorted(set(station_dirs()) | set(streams))]
     items.sort(key=lambda x: x["label"].lower())
     return items
 
 def next_free_station():
-    used = set(station_dirs())
+    used = set(station_dirs()) | set(INTERNET.all())
     for i in range(1, 100):
         cand = f"{i:02d}"
         if cand not in used:
@@ -84,40 +218,30 @@ def next_free_station():
     return None
 
 def current_preset():
-    # Prefer MPD's reported enabled output
-    try:
-        rc, out = run(["mpc", "outputs"], timeout=2)
-        if rc == 0:
-            for line in out.splitlines():
-                m = re.match(r'output:\s+(.*?)\s+\(.*\)\s+\[(on|off)\]', line.strip())
-                if m and m.group(2) == "on":
-                    return m.group(1)
-    except Exception:
-        pass
-    # Fallback to sticky file
-    try:
-        return open(PRESET_FILE).read().strip()
-    except Exception:
-        return "EQ Warm"
+    return EQ.state["preset"] or "Custom"
 
 def set_preset(name: str):
-    if name not in PRESETS:
-        return False
-    sh(f'mpc enableonly "{name}"')
     try:
-        os.makedirs(os.path.dirname(PRESET_FILE), exist_ok=True)
-        open(PRESET_FILE, "w").write(name)
-    except Exception:
-        pass
+        EQ.set(preset=name)
+    except (ValueError, OSError) as e:
+        app.logger.warning("EQ preset %s failed: %s", name, e)
+        return False
     return True
 
 def ensure_mpd_volume_75():
     # You asked to keep MPD fixed at 75% for outboard amp control
-    sh("mpc volume 75", timeout=3)
+    mpd(("setvol", 75))
 
 # Call once at startup (and we’ll also set it inside /api/play_station)
 ensure_mpd_volume_75()
 
+@app.template_filter("mmss")
+def fmt_mmss(seconds):
+    if not seconds:
+        return ""
+    s = int(round(seconds))
+    return f"{s // 60}:{s % 60:02d}"
+
 # ------------------ Web pages ------------------
 @app.route("/")
 def index():
@@ -125,10 +249,11 @@ def index():
 
 @app.route("/station/<station>")
 def station_view(station):
-    p = os.path.join(MUSIC_ROOT, station)
-    files = sorted([f for f in os.listdir(p) if f.lower().endswith(".mp3")]) if os.path.isdir(p) else []
+    # Tracks are fetched page by page from /api/station/<id>/tracks and rendered virtually
     label = load_names().get(station, f"Station {station}")
-    return render_template("station.html", station=station, label=label, files=files, title=label)
+    others = [s for s in get_stations() if s["id"] != station and not s["stream"]]
+    return render_template("station.html", station=station, label=label, others=others,
+                           stream=INTERNET.source(station), title=label)
 
 @app.route("/settings")
 def settings_view():
@@ -139,8 +264,111 @@ def settings_view():
                            title="Settings")
 
 # ------------------ Uploads & files ------------------
+def link_track(src: str, station: str, filename: str) -> str:
+    """Hardlink ``src`` into ``station`` as ``filename`` (or ``name_N.ext``); returns the name used."""
+    base, ext = os.path.splitext(os.path.basename(filename))
+    name, i = base + ext, 1
+    while True:
+        try:
+            os.link(src, os.path.join(MUSIC_ROOT, station, name))  # never clobbers an existing track
+            return name
+        except FileExistsError:
+            name = f"{base}_{i}{ext}"
+            i += 1
+
+def fsync_dir(d):
+    dfd = os.open(d, os.O_RDONLY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
+
+def commit_upload(tmp_path: str, station: str, filename: str, digest=None):
+    """Give a finished upload its final, collision-safe name; returns ``(name, how)``.
+
+    ``how`` is "new", "linked" (same audio and tags already in another
+    station: hardlinked to that copy, nothing stored twice) or "duplicate"
+    (same audio already in this station under ``name``; the upload is
+    dropped). Same audio with other tags is stored as "new", so linking
+    never swaps the upload's tags for another copy's.
+    """
+    d = os.path.join(MUSIC_ROOT, station)
+    digest = digest or audio_hash(tmp_path)
+    copies = [c for c in CATALOG.find_hash(digest)
+              if os.path.isfile(os.path.join(MUSIC_ROOT, c["station"], c["name"]))]
+    same = [c for c in copies if c["station"] == station]
+    if same:
+        discard_upload(tmp_path)
+        return same[0]["name"], "duplicate"
+    if copies:
+        tags = tag_hash(tmp_path)
+        copies = [c for c in copies if _tag_hash(os.path.join(MUSIC_ROOT, c["station"], c["name"])) == tags]
+    if copies:
+        src = os.path.join(MUSIC_ROOT, copies[0]["station"], copies[0]["name"])
+    else:
+        src = tmp_path
+        fd = os.open(tmp_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    name = link_track(src, station, filename)
+    os.unlink(tmp_path)
+    fsync_dir(d)
+    CATALOG.add(station, name, digest)
+    return name, ("linked" if copies else "new")
+
+def _tag_hash(path):
+    try:
+        return tag_hash(path)
+    except OSError:
+        return None
+
+def discard_upload(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def sweep_stale_uploads():
+    cutoff = time.time() - UPLOAD_STALE_SEC
+    for station in station_dirs():
+        d = os.path.join(MUSIC_ROOT, station)
+        for fn in os.listdir(d):
+            p = os.path.join(d, fn)
+            if fn.startswith(UPLOAD_PREFIX) and os.path.getmtime(p) < cutoff:
+                discard_upload(p)
+
+sweep_stale_uploads()
+
+def _ingested(path, station, filename):
+    name, how = commit_upload(path, station, filename)
+    CATALOG.refresh(station)
+    UPDATER.schedule(station)
+    return name, how
+
+# FLAC/WAV/M4A and off-rate MP3s are transcoded to the DAC's rate in the background
+INGEST = Ingest(MUSIC_ROOT, commit=_ingested)
+
+def accept_upload(tmp, station, filename, digest=None):
+    """File a finished upload directly or queue it for transcoding; returns ``(name, how)``.
+
+    ``how`` is commit_upload's, "queued" (``name`` is then the ingest job
+    id) or "unsupported" (dropped).
+    """
+    if INGEST.enabled and needs_transcode(tmp, filename):
+        return INGEST.submit(tmp, station, filename)["id"], "queued"
+    if not filename.lower().endswith(".mp3"):
+        discard_upload(tmp)
+        return None, "unsupported"
+    return commit_upload(tmp, station, filename, digest)
+
 @app.route("/upload/<station>", methods=["POST"])
+@UPLOADS
 def upload(station):
+    if not is_station_id(station):
+        flash("Invalid station.")
+        return redirect(url_for("index"))
     # Multi-file upload support
     files = request.files.getlist("files") or []
     if not files:
@@ -148,37 +376,253 @@ def upload(station):
         f = request.files.get("file")
         files = [f] if f else []
 
-    saved = 0
-    os.makedirs(os.path.join(MUSIC_ROOT, station), exist_ok=True)
+    saved, queued, dups = 0, 0, []
+    d = os.path.join(MUSIC_ROOT, station)
+    os.makedirs(d, exist_ok=True)
     for f in files:
-        if not f or not f.filename.lower().endswith(".mp3"):
+        if not f:
             continue
-        dest = os.path.join(MUSIC_ROOT, station, f.filename)
-        # collision-safe rename
-        base, ext = os.path.splitext(os.path.basename(f.filename))
-        i = 1
-        while os.path.exists(dest):
-            dest = os.path.join(MUSIC_ROOT, station, f"{base}_{i}{ext}")
-            i += 1
-        f.save(dest)
-        saved += 1
-
-    sh("mpc update")
+        tmp = getattr(f.stream, "name", None)
+        hasher = getattr(f.stream, "hasher", None)
+        if not (isinstance(tmp, str) and os.path.dirname(tmp) == d):
+            hasher = None
+            # Small parts stay in memory; write them out next to the target
+            with tempfile.NamedTemporaryFile(dir=d, prefix=UPLOAD_PREFIX, suffix=".part",
+                                             delete=False) as out:
+                shutil.copyfileobj(f.stream, out)
+            tmp = out.name
+        f.stream.close()
+        if not accepts(f.filename):
+            discard_upload(tmp)
+            continue
+        name, how = accept_upload(tmp, station, f.filename, hasher and hasher.hexdigest())
+        if how == "duplicate":
+            dups.append(name)
+        elif how == "queued":
+            queued += 1
+        elif how != "unsupported":
+            saved += 1
+
+    CATALOG.refresh(station)
+    UPDATER.schedule(station)
     flash(f"Uploaded {saved} file(s).")
+    if queued:
+        flash(f"Converting {queued} file(s) in the background.")
+    if dups:
+        flash(f"Already in this station: {', '.join(dups)}")
     return redirect(url_for("station_view", station=station))
 
+# Resumable chunked uploads: POST to start, PUT chunks at ?offset=N, GET to resume
+def _upload_paths(station, uid):
+    d = os.path.join(MUSIC_ROOT, station)
+    return os.path.join(d, f"{UPLOAD_PREFIX}{uid}.part"), os.path.join(d, f"{UPLOAD_PREFIX}{uid}.json")
+
+def _upload_meta(station, uid):
+    if not (is_station_id(station) and uid.isalnum()):
+        return None, None
+    part, meta = _upload_paths(station, uid)
+    try:
+        with open(meta, encoding="utf-8") as f:
+            return part, json.load(f)
+    except (OSError, ValueError):
+        return None, None
+
+# Chunks arrive in order, so each upload's hash is kept running in memory;
+# after a restart (or an out-of-order resume) the file is hashed at commit
+_CHUNK_HASHERS = {}                  # uid -> (offset, AudioHasher)
+_CHUNK_BUSY = set()                  # uids with a PUT in progress (a retry must not append too)
+_CHUNK_HASHERS_LOCK = threading.Lock()
+
+@app.post("/api/upload/<station>")
+def api_upload_start(station):
+    body = request.get_json(silent=True) or {}
+    filename = os.path.basename(str(body.get("filename", "")))
+    size = body.get("size")
+    if not is_station_id(station) or not accepts(filename) \
+            or not isinstance(size, int) or not 0 <= size <= app.config["MAX_CONTENT_LENGTH"]:
+        return jsonify({"ok": False, "error": "bad upload"}), 400
+    os.makedirs(os.path.join(MUSIC_ROOT, station), exist_ok=True)
+    uid = secrets.token_hex(8)
+    part, meta = _upload_paths(station, uid)
+    open(part, "wb").close()
+    with open(meta, "w", encoding="utf-8") as f:
+        json.dump({"filename": filename, "size": size}, f)
+    return jsonify({"ok": True, "id": uid, "offset": 0, "size": size})
+
+@app.get("/api/upload/<station>/<uid>")
+def api_upload_status(station, uid):
+    part, meta = _upload_meta(station, uid)
+    if not meta:
+        return jsonify({"ok": False, "error": "unknown upload"}), 404
+    return jsonify({"ok": True, "id": uid, "offset": os.path.getsize(part), "size": meta["size"]})
+
+@app.put("/api/upload/<station>/<uid>")
+@UPLOADS
+def api_upload_chunk(station, uid):
+    with _CHUNK_HASHERS_LOCK:
+        if uid in _CHUNK_BUSY:
+            return jsonify({"ok": False, "busy": True, "error": "upload busy"}), 409
+        _CHUNK_BUSY.add(uid)
+    try:
+        return _upload_chunk(station, uid)
+    finally:
+        with _CHUNK_HASHERS_LOCK:
+            _CHUNK_BUSY.discard(uid)
+
+def _upload_chunk(station, uid):
+    part, meta = _upload_meta(station, uid)
+    if not meta:
+        return jsonify({"ok": False, "error": "unknown upload"}), 404
+    have = os.path.getsize(part)
+    if request.args.get("offset", type=int) != have:
+        return jsonify({"ok": False, "offset": have, "size": meta["size"]}), 409
+    with _CHUNK_HASHERS_LOCK:
+        at, hasher = _CHUNK_HASHERS.pop(uid, (0, AudioHasher()))
+    if at != have:
+        hasher = None
+    with open(part, "ab") as out:
+        while have < meta["size"]:
+            buf = request.stream.read(min(UPLOAD_BUF, meta["size"] - have))
+            if not buf:
+                break
+            out.write(buf)
+            if hasher:
+                hasher.update(buf)
+            have += len(buf)
+    if have < meta["size"]:
+        if hasher:
+            with _CHUNK_HASHERS_LOCK:
+                _CHUNK_HASHERS[uid] = (have, hasher)
+        return jsonify({"ok": True, "offset": have, "size": meta["size"]})
+    name, how = accept_upload(part, station, meta["filename"], hasher and hasher.hexdigest())
+    discard_upload(_upload_paths(station, uid)[1])
+    if how == "unsupported":
+        return jsonify({"ok": False, "error": "cannot convert without ffmpeg"}), 415
+    CATALOG.refresh(station)
+    UPDATER.schedule(station)
+    return jsonify({"ok": True, "done": True, "name": name, "stored": how,
+                    "offset": have, "size": meta["size"]})
+
+# Transcode queue: GET lists jobs (?station=NN), GET/DELETE one job
+@app.get("/api/ingest")
+def api_ingest_jobs():
+    station = request.args.get("station")
+    if station is not None and not is_station_id(station):
+        return jsonify({"ok": False, "error": "bad station"}), 400
+    return jsonify({"ok": True, "enabled": INGEST.enabled, "jobs": INGEST.jobs(station)})
+
+@app.get("/api/ingest/<uid>")
+def api_ingest_job(uid):
+    job = INGEST.job(uid)
+    if not job:
+        return jsonify({"ok": False, "error": "unknown job"}), 404
+    return jsonify({"ok": True, "job": job})
+
+@app.delete("/api/ingest/<uid>")
+def api_ingest_cancel(uid):
+    if not INGEST.cancel(uid):
+        return jsonify({"ok": False, "error": "not queued or running"}), 409
+    return jsonify({"ok": True, "job": INGEST.job(uid)})
+
+def send_track(station, fn, **kw):
+    """send_path for a track, holding a DOWNLOADS slot until the body is sent.
+
+    The transfer runs after the view returns, so the slot is released
+    with the body rather than by the Gate decorator.
+    """
+    if not is_station_id(station):
+        abort(404)
+    path = resolve(os.path.join(MUSIC_ROOT, station), fn)
+    if not DOWNLOADS.acquire():
+        return DOWNLOADS.busy()
+    try:
+        return send_path(path, on_close=DOWNLOADS.release, **kw)
+    except BaseException:
+        DOWNLOADS.release()
+        raise
+
 @app.route("/files/<station>/<fn>")
 def download(station, fn):
-    return send_from_directory(os.path.join(MUSIC_ROOT, station), fn, as_attachment=True)
-
-@app.route("/delete/<station>/<fn>")
-def delete_file(station, fn):
-    p = os.path.join(MUSIC_ROOT, station, fn)
-    if os.path.exists(p):
-        os.remove(p)
-        sh("mpc update")
-        flash(f"Deleted {fn}")
-    return redirect(url_for("station_view", station=station))
+    return send_track(station, fn, as_attachment=True)
+
+@app.route("/stream/<station>/<fn>")
+def stream_track(station, fn):
+    """Inline audio for the preview player; browsers seek with Range requests."""
+    return send_track(station, fn, mimetype="audio/mpeg", max_age=0)
+
+@app.route("/static/<path:filename>", endpoint="static")
+def static_file(filename):
+    return send_static(STATIC_ROOT, filename)
+
+# ------------------ API: Track listing & bulk ops ------------------
+@app.get("/api/station/<station>/tracks")
+def api_station_tracks(station):
+    # ?sort=name|size|duration|mtime&order=asc|desc&q=&min_size=&max_size=&min_duration=&max_duration=
+    # &cursor=<next from the previous page>&limit=N
+    if not is_station_id(station):
+        abort(404)
+    a = request.args
+    try:
+        page = CATALOG.page(station, sort=a.get("sort", "name"), desc=a.get("order") == "desc",
+                            q=a.get("q") or None,
+                            min_size=a.get("min_size", type=int), max_size=a.get("max_size", type=int),
+                            min_duration=a.get("min_duration", type=float),
+                            max_duration=a.get("max_duration", type=float),
+                            after=a.get("cursor") or None, limit=a.get("limit", 100, type=int))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify(page)
+
+@app.post("/api/station/<station>/tracks/bulk")
+def api_station_bulk(station):
+    # {"action": "delete"|"move"|"copy", "names": [...], "to": "NN"}; one scoped MPD update per station touched
+    body = request.get_json(silent=True) or {}
+    action, names, dest = body.get("action"), body.get("names"), body.get("to")
+    if action not in ("delete", "move", "copy") or not isinstance(names, list) or len(names) > BULK_MAX:
+        return jsonify({"ok": False, "error": "need action delete/move/copy and a list of names"}), 400
+    if not is_station_id(station) or not os.path.isdir(os.path.join(MUSIC_ROOT, station)):
+        abort(404)
+    if action != "delete" and (not isinstance(dest, str) or not is_station_id(dest) or dest == station
+                               or not os.path.isdir(os.path.join(MUSIC_ROOT, dest))):
+        return jsonify({"ok": False, "error": "unknown target station"}), 400
+    src_dir = os.path.join(MUSIC_ROOT, station)
+    names = list(dict.fromkeys(n for n in names if isinstance(n, str)))
+    hashes = CATALOG.hashes(station, names) if action != "delete" else {}
+    results, carried = [], {}
+    for fn in names:
+        path = os.path.join(src_dir, fn)
+        if os.path.basename(fn) != fn or not is_audio(fn) or not os.path.isfile(path):
+            results.append({"name": fn, "ok": False, "error": "not found"})
+            continue
+        try:
+            if action == "delete":
+                os.unlink(path)
+                results.append({"name": fn, "ok": True})
+                continue
+            # Same audio already in the target: nothing to store (like a duplicate upload)
+            there = [c for c in CATALOG.find_hash(hashes[fn]) if c["station"] == dest] if fn in hashes else []
+            if there:
+                if action == "move":
+                    os.unlink(path)
+                results.append({"name": fn, "ok": True, "as": there[0]["name"], "stored": "duplicate"})
+                continue
+            # Tracks are hardlinked, never copied byte for byte: a copy costs no space (see dedupe)
+            new = link_track(path, dest, fn)
+            if action == "move":
+                os.unlink(path)
+            carried[fn] = new
+            results.append({"name": fn, "ok": True, "as": new})
+        except OSError as e:
+            results.append({"name": fn, "ok": False, "error": e.strerror or str(e)})
+    if action == "delete" or not carried:
+        CATALOG.refresh(station)
+    else:
+        fsync_dir(os.path.join(MUSIC_ROOT, dest))
+        CATALOG.carry(station, dest, carried)
+    for st in {"delete": [station], "move": [station, dest], "copy": [dest]}[action]:
+        UPDATER.schedule(st)
+    done = sum(r["ok"] for r in results)
+    return jsonify({"ok": done == len(results), "done": done, "results": results})
 
 # ------------------ Station mgmt ------------------
 @app.route("/station/<station>/set_name", methods=["POST"])
@@ -190,6 +634,22 @@ def set_station_name(station):
     flash("Saved station name.")
     return redirect(url_for("station_view", station=station))
 
+@app.route("/station/<station>/set_stream", methods=["POST"])
+def set_station_stream(station):
+    if not is_station_id(station):
+        flash("Invalid station.")
+        return redirect(url_for("index"))
+    url = request.form.get("url", "").strip() or None
+    try:
+        INTERNET.set(station, url)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for("station_view", station=station))
+    os.makedirs(os.path.join(MUSIC_ROOT, station), exist_ok=True)  # keeps its number on the dial
+    CATALOG.refresh(station)
+    flash("Saved stream URL." if url else "Station plays its music folder again.")
+    return redirect(url_for("station_view", station=station))
+
 @app.route("/add_station", methods=["POST"])
 def add_station():
     nn = next_free_station()
@@ -197,10 +657,11 @@ def add_station():
         flash("All station numbers 01–99 are already in use.")
         return redirect(url_for("index"))
     os.makedirs(os.path.join(MUSIC_ROOT, nn), exist_ok=True)
+    CATALOG.refresh(nn)
     names = load_names()
     names.setdefault(nn, f"Station {nn}")
     save_names(names)
-    sh("mpc update")
+    UPDATER.schedule()
     flash(f"Created {names[nn]}.")
     return redirect(url_for("station_view", station=nn))
 
@@ -220,7 +681,11 @@ def delete_station(station):
     if station in names:
         del names[station]
         save_names(names)
-    sh("mpc update")
+    CATALOG.refresh(station)
+    mpd(("rm", PLAYLIST_PREFIX + station))
+    SWITCHER.forget(station)
+    INTERNET.set(station, None)
+    UPDATER.schedule()
     flash("Station deleted.")
     return redirect(url_for("index"))
 
@@ -232,54 +697,100 @@ def set_preset_route():
     return redirect(url_for("settings_view"))
 
 # ------------------ API: Playback & status ------------------
+def status_payload(song, st):
+    """Shape MPD currentsong/status dicts for the UI."""
+    state = {"play": "playing", "pause": "paused"}.get(st.get("state"), "stopped")
+    cur = {"file": song.get("file") or None,
+           "title": song.get("Title") or None,
+           "artist": song.get("Artist") or None}
+    return {"state": state, "current": cur, "volume": 75}
+
 def parse_status():
     """Return dict with state/track and sticky 75% volume."""
-    rc, out = run(["mpc", "-f", "%file%|%title%|%artist%"])
-    state = "stopped"
-    cur = {"file": None, "title": None, "artist": None}
-    if rc == 0:
-        lines = [l for l in out.splitlines() if l.strip()]
-        if lines:
-            parts = lines[0].split("|")
-            if parts:
-                cur["file"] = parts[0] or None
-                cur["title"] = (parts[1] if len(parts) > 1 else None) or None
-                cur["artist"] = (parts[2] if len(parts) > 2 else None) or None
-        if len(lines) >= 2:
-            if "[playing]" in lines[1]:
-                state = "playing"
-            elif "[paused]" in lines[1]:
-                state = "paused"
-    return {"state": state, "current": cur, "volume": 75}
+    res = mpd("currentsong", "status")
+    return status_payload(*((to_dict(res[0]), to_dict(res[1])) if res else ({}, {})))
+
+# One background connection sits in MPD's `idle`; the latest status is
+# cached here and fanned out to /api/status and /api/events subscribers.
+_status = {"data": None, "version": 0}
+_status_cv = threading.Condition()
+
+def _publish_status(data):
+    with _status_cv:
+        if data != _status["data"]:
+            _status["data"] = data
+            _status["version"] += 1
+            _status_cv.notify_all()
+
+def _status_watcher():
+    client = MPDClient()
+    while True:
+        try:
+            SWITCHER.top_up()   # the knob daemon does this too; whichever is first wins
+            res = MPD.command_list(["currentsong", "status"])
+            _publish_status(status_payload(to_dict(res[0]), to_dict(res[1])))
+            client.idle(*IDLE_SUBSYSTEMS)
+        except (MPDError, OSError) as e:
+            app.logger.warning("status watcher: %s", e)
+            client.close()
+            with _status_cv:
+                _status["data"] = None  # stale; /api/status falls back to a live query
+            time.sleep(2)
+
+threading.Thread(target=_status_watcher, name="mpd-idle", daemon=True).start()
 
 @app.get("/api/status")
 def api_status():
-    return jsonify(parse_status())
+    return jsonify(_status["data"] or parse_status())
+
+@app.get("/api/events")
+def api_events():
+    """Server-Sent Events: a `status` event on every MPD state change."""
+    if not STREAMS.acquire():
+        return STREAMS.busy()  # the page falls back to polling /api/status
+    def stream():
+        seen = None
+        while True:
+            with _status_cv:
+                _status_cv.wait_for(lambda: _status["version"] != seen and _status["data"],
+                                    timeout=SSE_KEEPALIVE_SEC)
+                data, version = _status["data"], _status["version"]
+            if version == seen or not data:
+                yield ": keepalive\n\n"
+                continue
+            seen = version
+            yield f"event: status\ndata: {json.dumps(data)}\n\n"
+    resp = Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    resp.call_on_close(STREAMS.release)
+    return resp
 
 @app.post("/api/play")
 def api_play():
-    sh("mpc play")
-    ensure_mpd_volume_75()
+    mpd("play", ("setvol", 75))
     return jsonify(parse_status())
 
 @app.post("/api/pause")
 def api_pause():
-    sh("mpc pause")
+    mpd(("pause", 1))
     return jsonify(parse_status())
 
 @app.post("/api/stop")
 def api_stop():
-    sh("mpc stop")
+    mpd("stop")
     return jsonify(parse_status())
 
 @app.post("/api/next")
 def api_next():
-    sh("mpc next")
+    mpd("next")
     return jsonify(parse_status())
 
 @app.post("/api/prev")
 def api_prev():
-    sh("mpc prev")
+    try:
+        SWITCHER.previous()     # a rolling queue has consumed the previous track
+    except (MPDError, OSError) as e:
+        app.logger.warning("previous: %s", e)
     return jsonify(parse_status())
 
 @app.get("/api/stations")
@@ -288,28 +799,31 @@ def api_stations():
 
 @app.post("/api/play_station/<station_id>")
 def api_play_station(station_id):
-    # Clear queue, add folder by station id, play
-    sh("mpc stop")
-    sh("mpc clear")
-    # MPD indexes relative to music_directory, so station_id is enough
-    sh(f'mpc add "{station_id}"')
-    sh("mpc play")
-    ensure_mpd_volume_75()
-    return jsonify(parse_status())
+    if not (len(station_id) == 2 and station_id.isdigit()):
+        return jsonify({"ok": False, "error": "bad station"}), 400
+    # Clear, load station playlist, play and read status in one batch
+    try:
+        st, song = SWITCHER.switch(station_id, extra=[("setvol", 75)])
+    except (MPDError, OSError) as e:
+        app.logger.warning("station switch to %s failed: %s", station_id, e)
+        return jsonify(parse_status())
+    # Let the radio's OLED/~/.station follow a switch made from the web UI
+    bus.publish(bus.STATION_CHANGED, station=station_id,
+                name=load_names().get(station_id, f"Station {station_id}"))
+    return jsonify(dict(status_payload(song, st), switch=SWITCHER.last))
+
+@app.get("/api/switch_stats")
+def api_switch_stats():
+    return jsonify(SWITCHER.stats())
 
 # ------------------ API: Disk & services ------------------
 @app.get("/api/disks")
 def api_disks():
-    # Use df -B1 / for consistent bytes
-    rc, out = run(["df", "-B1", "/"])
-    total = used = avail = 0
-    if rc == 0:
-        # Filesystem 1B-blocks Used Available Use% Mounted on
-        lines = out.splitlines()
-        if len(lines) >= 2:
-            parts = lines[1].split()
-            if len(parts) >= 6:
-                total = int(parts[1]); used = int(parts[2]); avail = int(parts[3])
+    # statvfs directly: same numbers as `df -B1 /`, no child process
+    try:
+        total, used, avail = shutil.disk_usage("/")
+    except OSError:
+        total = used = avail = 0
     used_pct = int(round(100 * used / total)) if total else 0
     return jsonify({
         "total_bytes": total,
@@ -318,44 +832,66 @@ def api_disks():
         "used_pct": used_pct
     })
 
+@app.get("/api/storage")
+def api_storage():
+    # Per-station breakdown from the catalog index (hardlinked copies counted once), no `du`
+    return jsonify(CATALOG.storage())
+
 def svc_status(name: str):
-    st = {"name": name, "active": False, "enabled": False, "since": None}
-    rc, a = run(["sudo", "systemctl", "is-active", name])
-    st["active"] = a.strip() == "active"
-    rc, e = run(["sudo", "systemctl", "is-enabled", name])
-    st["enabled"] = e.strip() == "enabled"
-    # Optional: fetch since (best-effort)
-    rc, out = run(["systemctl", "show", name, "--property=ActiveEnterTimestamp"])
-    if rc == 0 and "ActiveEnterTimestamp=" in out:
-        st["since"] = out.strip().split("=", 1)[1] or None
-    return st
+    return SERVICES.get(name)
 
 @app.get("/api/services")
 def api_services():
-    return jsonify([svc_status(s) for s in SERVICE_ALLOWLIST])
+    return jsonify(SERVICES.get_all())
 
 @app.post("/api/service/<name>/restart")
 def api_service_restart(name):
     if name not in SERVICE_ALLOWLIST:
         return jsonify({"ok": False, "error": "disallowed"}), 400
     rc, out = run(["sudo", "systemctl", "restart", name], timeout=15)
+    SERVICES.invalidate()
     ok = (rc == 0)
     return jsonify({"ok": ok, "status": svc_status(name)}), (200 if ok else 500)
 
 # ------------------ API: Library & system ------------------
 @app.post("/api/library/rescan")
 def api_library_rescan():
-    sh("mpc update")
+    UPDATER.schedule()
+    UPDATER.flush()
     return jsonify({"ok": True})
 
+@app.get("/api/eq")
+def api_eq_get():
+    return jsonify(EQ.info())
+
+@app.post("/api/eq")
+def api_eq_set():
+    # {"preset": "EQ Warm"} or {"gains": [10 x dB]}, optional "fade" seconds
+    body = request.get_json(silent=True) or {}
+    try:
+        fade = min(max(float(body.get("fade", 0.4)), 0.0), 5.0)
+        EQ.set(gains=body.get("gains"), preset=body.get("preset"), fade=fade)
+    except (TypeError, ValueError) as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except OSError as e:
+        return jsonify({"ok": False, "error": str(e)}), 503
+    return jsonify(dict(EQ.info(), ok=True))
+
+@app.post("/api/library/dedupe")
+def api_library_dedupe():
+    res = CATALOG.dedupe()
+    for station in res["stations"]:
+        UPDATER.schedule(station)
+    return jsonify(dict(res, ok=True))
+
+@app.get("/api/loudness")
+def api_loudness():
+    return jsonify(ANALYZER.stats())
+
 @app.get("/api/settings/ssh")
 def api_settings_ssh_get():
-    rc, a = run(["sudo", "systemctl", "is-active", "ssh"])
-    rc, e = run(["sudo", "systemctl", "is-enabled", "ssh"])
-    return jsonify({
-        "active": a.strip() == "active",
-        "enabled": e.strip() == "enabled",
-    })
+    st = svc_status("ssh")
+    return jsonify({"active": st["active"], "enabled": st["enabled"]})
 
 @app.post("/api/settings/ssh")
 def api_settings_ssh_post():
@@ -367,8 +903,8 @@ def api_settings_ssh_post():
         run(["sudo", "systemctl", "stop", "ssh"])
         run(["sudo", "systemctl", "disable", "ssh"])
     elif action == "toggle":
-        rc, e = run(["sudo", "systemctl", "is-enabled", "ssh"])
-        if e.strip() == "enabled":
+        SERVICES.invalidate()
+        if svc_status("ssh")["enabled"]:
             run(["sudo", "systemctl", "stop", "ssh"])
             run(["sudo", "systemctl", "disable", "ssh"])
         else:
@@ -376,9 +912,9 @@ def api_settings_ssh_post():
             run(["sudo", "systemctl", "start", "ssh"])
     else:
         return jsonify({"ok": False, "error": "bad action"}), 400
-    rc, a = run(["sudo", "systemctl", "is-active", "ssh"])
-    rc, e = run(["sudo", "systemctl", "is-enabled", "ssh"])
-    return jsonify({"ok": True, "active": a.strip() == "active", "enabled": e.strip() == "enabled"})
+    SERVICES.invalidate()
+    st = svc_status("ssh")
+    return jsonify({"ok": True, "active": st["active"], "enabled": st["enabled"]})
 
 @app.post("/api/system/reboot")
 def api_system_reboot():
@@ -387,6 +923,31 @@ def api_system_reboot():
     sh("sudo /sbin/reboot")
     return jsonify({"ok": True, "rebooting": True})
 
+# ------------------ Metrics & profiling ------------------
+@app.get("/metrics")
+def metrics_view():
+    # Prometheus text: this process plus every daemon answering on its local metrics socket
+    return Response(metrics.collect("web"), mimetype="text/plain; version=0.0.4")
+
+@app.get("/debug/profile")
+@PROFILES
+def debug_profile():
+    # Folded stacks (flamegraph.pl / speedscope) sampled for ?seconds=N from ?daemon=name (default: web)
+    seconds = min(max(request.args.get("seconds", 10.0, type=float), 0.1), metrics.PROFILE_MAX_SEC)
+    daemon = request.args.get("daemon", "web")
+    if daemon == "web":
+        return Response(metrics.profile(seconds), mimetype="text/plain")
+    if daemon not in metrics.daemons():
+        return jsonify({"ok": False, "error": "unknown daemon", "daemons": metrics.daemons()}), 404
+    try:
+        out = metrics.ask(daemon, f"profile {seconds}", timeout=seconds + 10)
+    except OSError as e:
+        return jsonify({"ok": False, "error": str(e)}), 503
+    if out == metrics.PROFILE_BUSY:
+        return PROFILES.busy()
+    return Response(out, mimetype="text/plain")
+
 # ------------------ App entry ------------------
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080, debug=False)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # clean exit flushes pending state files
+    serve(app, WEB_HOST, WEB_PORT, threads=WEB_THREADS)